@@ -1,4 +1,5 @@
 from flask import Flask, jsonify, request
+from http_cache import StaticResponse
 
 app = Flask(__name__)
 
@@ -76,32 +77,37 @@ subject_data = {
     ]
 }
 
+# The catalog never changes while running: serialize, tag and compress each response once
+application_responses = {
+    subject: StaticResponse({'subject': subject, 'applications': applications})
+    for subject, applications in subject_data.items()
+}
+subjects_response = StaticResponse({'subjects': list(subject_data.keys())})
+home_response = StaticResponse({
+    'message': 'Real Life Applications API',
+    'endpoints': [
+        '/api/subjects - Get available subjects',
+        '/api/applications/<subject> - Get applications for specific subject'
+    ]
+})
+
 @app.route('/api/applications/<subject>', methods=['GET'])
 def get_applications(subject):
     """Get real-life applications for a specific subject"""
-    if subject in subject_data:
-        return jsonify({
-            'subject': subject,
-            'applications': subject_data[subject]
-        })
+    if subject in application_responses:
+        return application_responses[subject].respond()
     else:
         return jsonify({'error': 'Subject not found'}), 404
 
 @app.route('/api/subjects', methods=['GET'])
 def get_subjects():
     """Get list of available subjects"""
-    return jsonify({'subjects': list(subject_data.keys())})
+    return subjects_response.respond()
 
 @app.route('/')
 def home():
     """Home page with basic information"""
-    return jsonify({
-        'message': 'Real Life Applications API',
-        'endpoints': [
-            '/api/subjects - Get available subjects',
-            '/api/applications/<subject> - Get applications for specific subject'
-        ]
-    })
+    return home_response.respond()
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,12 @@
+"""
+Offline benchmark suite for the backend.
+
+- mock_llm: local OpenAI/Anthropic-compatible provider on localhost:4000 (the
+  LiteLLM route) with configurable latency, streaming and error injection
+- load_test: drives /api/chat, /api/history and /api/keys with N users x M
+  conversations against an in-process server (or --url)
+- storage_bench: micro-benchmarks of DataStorage operations as history grows
+- report: percentiles, requests/sec and comparison against a stored baseline
+
+Run from the backend directory, e.g. `python -m bench.load_test --users 10`.
+"""
@@ -0,0 +1,164 @@
+"""
+Load generator for the chat API.
+
+Each of N simulated users saves an API key, then holds M conversations of T
+chat turns through the LiteLLM provider, and pages through its history. The
+users then read their full history and key list. By default the API runs
+in-process on a throwaway data directory, against the mock provider on
+localhost:4000, so a run needs no network access and leaves no state behind.
+
+    python -m bench.load_test --users 20 --conversations 5 --turns 3
+    python -m bench.load_test --users 500 --conversations 1 --turns 1 --latency 2 --asgi
+    python -m bench.load_test --save-baseline bench/baseline.json
+    python -m bench.load_test --baseline bench/baseline.json
+"""
+
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import mock_llm, report  # noqa: E402
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def call(self, name: str, send) -> Optional[requests.Response]:
+        started = time.perf_counter()
+        try:
+            response = send()
+            response.content  # read streamed bodies to the end
+        except requests.RequestException:
+            response = None
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            if response is None or response.status_code >= 400:
+                self.errors[name] += 1
+            else:
+                self.samples[name].append(elapsed)
+        return response
+
+
+def run_user(base_url: str, user: int, args, recorder: Recorder):
+    session = requests.Session()
+    headers = {
+        'X-User-ID': f'bench-user-{user}',
+        'X-Provider': 'LiteLLM',
+        'X-Model': args.model,
+        'X-API-Key': f'bench-key-{user}',
+    }
+    recorder.call('POST /api/keys', lambda: session.post(
+        f'{base_url}/api/keys', headers=headers,
+        json={'key_name': 'bench', 'provider': 'LiteLLM', 'api_key': headers['X-API-Key']}))
+
+    chat_path = '/api/chat/stream' if args.stream else '/api/chat'
+    for conversation in range(args.conversations):
+        conversation_id = f'bench-{user}-{conversation}'
+        for turn in range(args.turns):
+            recorder.call(f'POST {chat_path}', lambda: session.post(
+                f'{base_url}{chat_path}', headers=headers, stream=args.stream,
+                json={'message': f'Question {turn} of conversation {conversation} from user {user}',
+                      'subject': 'Math', 'grade': 8, 'conversation_id': conversation_id,
+                      'timestamp': time.time()}))
+        recorder.call('GET /api/history?limit=20', lambda: session.get(
+            f'{base_url}/api/history', headers=headers, params={'limit': 20}))
+
+    recorder.call('GET /api/history', lambda: session.get(f'{base_url}/api/history', headers=headers))
+    recorder.call('GET /api/keys', lambda: session.get(f'{base_url}/api/keys', headers=headers))
+    session.close()
+
+
+def start_app(args) -> str:
+    """Serve chat_api from a background thread on a free port with a throwaway data directory"""
+    os.chdir(tempfile.mkdtemp(prefix='chat-bench-'))
+    os.environ.setdefault('USER_RATE_LIMIT', '0')  # the load itself would trip the per-user limit
+    os.environ['STORAGE_BACKEND'] = args.storage
+    os.environ['HISTORY_DURABILITY'] = args.durability
+
+    if args.asgi:
+        return start_asgi_app()
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    import chat_api
+
+    class QuietHandler(WSGIRequestHandler):
+        disable_nagle_algorithm = True
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, chat_api.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, name='bench-app', daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+def start_asgi_app() -> str:
+    """Serve the asyncio mode (chat_asgi) with uvicorn from a background thread"""
+    import uvicorn
+    import chat_asgi
+
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    server = uvicorn.Server(uvicorn.Config(chat_asgi.app, log_level='warning', backlog=4096))
+    threading.Thread(target=server.run, kwargs={'sockets': [sock]}, name='bench-app', daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return f'http://127.0.0.1:{sock.getsockname()[1]}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test /api/chat, /api/history and /api/keys')
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--conversations', type=int, default=3, help='conversations per user')
+    parser.add_argument('--turns', type=int, default=3, help='chat turns per conversation')
+    parser.add_argument('--stream', action='store_true', help='use /api/chat/stream')
+    parser.add_argument('--model', default='mock-model')
+    parser.add_argument('--url', help='test a running server instead of an in-process one')
+    parser.add_argument('--storage', default='json', choices=('json', 'sqlite'), help='in-process storage engine')
+    parser.add_argument('--durability', default='sync', choices=('sync', 'batched', 'async'),
+                        help='in-process history durability')
+    parser.add_argument('--asgi', action='store_true', help='serve the asyncio mode (chat_asgi) instead of Flask')
+    parser.add_argument('--no-mock', action='store_true', help='do not start the mock provider on port 4000')
+    mock_llm.add_arguments(parser)
+    report.add_arguments(parser)
+    args = parser.parse_args()
+
+    if not args.no_mock:
+        mock_llm.start(mock_llm.DEFAULT_PORT, mock_llm.config_from_args(args))
+    base_url = args.url.rstrip('/') if args.url else start_app(args)
+
+    recorder = Recorder()
+    users = [threading.Thread(target=run_user, args=(base_url, user, args, recorder))
+             for user in range(args.users)]
+    started = time.perf_counter()
+    for thread in users:
+        thread.start()
+    for thread in users:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    names = sorted(set(recorder.samples) | set(recorder.errors))
+    results = {name: report.summarize(recorder.samples[name], elapsed, recorder.errors[name]) for name in names}
+    every_sample = [sample for samples in recorder.samples.values() for sample in samples]
+    results['all requests'] = report.summarize(every_sample, elapsed, sum(recorder.errors.values()))
+
+    report.print_table(f'{args.users} users x {args.conversations} conversations x {args.turns} turns '
+                       f'in {elapsed:.1f}s (mock latency {args.latency}s)', results)
+    sys.exit(report.finish(results, args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""
+Local mock LLM provider for benchmarks.
+
+Answers OpenAI-style POST .../chat/completions and Anthropic-style POST
+.../messages, either as one JSON body or as an SSE stream when the request
+asks for `stream`. Latency is a base delay plus random jitter, streams can be
+spread over several chunks, and a fraction of requests can be failed with a
+chosen status. The LiteLLM provider points at http://localhost:4000, so the
+backend reaches this server without any configuration.
+
+    python -m bench.mock_llm --latency 0.2 --jitter 0.05 --error-rate 0.01
+"""
+
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+DEFAULT_PORT = 4000
+
+
+class MockConfig:
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, error_rate: float = 0.0,
+                 error_status: int = 503, answer_words: int = 60, stream_chunks: int = 10,
+                 seed: Optional[int] = None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.answer_words = answer_words
+        self.stream_chunks = stream_chunks
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+
+    def delay(self) -> float:
+        with self.lock:
+            return max(self.latency + self.random.uniform(-self.jitter, self.jitter), 0.0)
+
+    def should_fail(self) -> bool:
+        with self.lock:
+            self.requests += 1
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.errors += 1
+            return failed
+
+
+def _content_text(content: Any, cached_only: bool = False) -> str:
+    if isinstance(content, list):  # content blocks
+        return ' '.join(str(block.get('text', '')) for block in content
+                        if isinstance(block, dict) and (block.get('cache_control') or not cached_only))
+    return '' if cached_only else str(content or '')
+
+
+def _last_user_text(payload: Dict[str, Any]) -> str:
+    for message in reversed(payload.get('messages') or []):
+        content = _content_text(message.get('content'))
+        if message.get('role') == 'user' and content:
+            return content
+    return ''
+
+
+def _answer(payload: Dict[str, Any], words: int) -> str:
+    question = _last_user_text(payload)[:80]
+    filler = ('In real life this shows up when you cook, build, travel and shop, '
+              'and the same idea explains many everyday things.').split()
+    body = [filler[i % len(filler)] for i in range(max(words - 4, 0))]
+    return f'Mock answer to: {question}. ' + ' '.join(body)
+
+
+def _usage(payload: Dict[str, Any], answer: str, anthropic: bool) -> Dict[str, Any]:
+    """Token counts of ~4 characters each; blocks marked with cache_control count as cache reads"""
+    messages = payload.get('messages') or []
+    prompt_tokens = sum(len(_content_text(message.get('content'))) for message in messages) // 4
+    cached_tokens = sum(len(_content_text(message.get('content'), True)) for message in messages) // 4
+    completion_tokens = len(answer) // 4
+    if anthropic:
+        return {'input_tokens': prompt_tokens - cached_tokens, 'cache_read_input_tokens': cached_tokens,
+                'output_tokens': completion_tokens}
+    return {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+            'prompt_tokens_details': {'cached_tokens': cached_tokens}}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; with Nagle on, delayed ACKs add ~40ms to each
+    disable_nagle_algorithm = True
+    server: 'MockServer'
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, status: int, body: Dict[str, Any]):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_events(self, events):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        for event in events:
+            self.wfile.write(f'data: {json.dumps(event)}\n\n'.encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b'data: [DONE]\n\n')
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': {'message': 'Invalid JSON'}})
+            return
+
+        anthropic = self.path.rstrip('/').endswith('/messages')
+        if not anthropic and not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+            return
+
+        config = self.server.config
+        total_delay = config.delay()
+        if config.should_fail():
+            time.sleep(total_delay)
+            self._send_json(config.error_status, {'error': {'message': 'Injected failure'}})
+            return
+
+        answer = _answer(payload, config.answer_words)
+        usage = _usage(payload, answer, anthropic)
+        model = payload.get('model', 'mock')
+
+        if not payload.get('stream'):
+            time.sleep(total_delay)
+            if anthropic:
+                self._send_json(200, {'type': 'message', 'model': model, 'role': 'assistant',
+                                      'content': [{'type': 'text', 'text': answer}], 'usage': usage})
+            else:
+                self._send_json(200, {'object': 'chat.completion', 'model': model,
+                                      'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': answer},
+                                                   'finish_reason': 'stop'}],
+                                      'usage': usage})
+            return
+
+        # Stream: half the delay before the first chunk, the rest spread over the chunks
+        chunks = max(config.stream_chunks, 1)
+        words = answer.split(' ')
+        size = max(len(words) // chunks, 1)
+        pieces = [' '.join(words[i:i + size]) + ' ' for i in range(0, len(words), size)]
+
+        def events():
+            time.sleep(total_delay / 2)
+            for piece in pieces:
+                if anthropic:
+                    yield {'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': piece}}
+                else:
+                    yield {'choices': [{'index': 0, 'delta': {'content': piece}}]}
+                time.sleep(total_delay / 2 / len(pieces))
+            if anthropic:
+                yield {'type': 'message_delta', 'usage': usage}
+            else:
+                yield {'choices': [], 'usage': usage}
+
+        self._send_events(events())
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Load tests open many connections at once; the default backlog of 5 would drop and delay them
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients that gave up (cancelled or hedged requests) close the socket mid-answer
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def __init__(self, port: int = DEFAULT_PORT, config: Optional[MockConfig] = None):
+        super().__init__(('127.0.0.1', port), MockHandler)
+        self.config = config or MockConfig()
+
+
+def start(port: int = DEFAULT_PORT, config: Optional[MockConfig] = None) -> MockServer:
+    """Serve the mock provider from a background thread"""
+    server = MockServer(port, config)
+    threading.Thread(target=server.serve_forever, name='mock-llm', daemon=True).start()
+    return server
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds before the answer (default 0.05)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='+/- random seconds added to the latency')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests to fail (0..1)')
+    parser.add_argument('--error-status', type=int, default=503, help='status of injected failures')
+    parser.add_argument('--answer-words', type=int, default=60)
+    parser.add_argument('--stream-chunks', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=None, help='seed for reproducible jitter and errors')
+
+
+def config_from_args(args) -> MockConfig:
+    return MockConfig(args.latency, args.jitter, args.error_rate, args.error_status,
+                      args.answer_words, args.stream_chunks, args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock OpenAI/Anthropic-compatible provider')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = MockServer(args.port, config_from_args(args))
+    print(f'Mock LLM provider listening on http://127.0.0.1:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+Latency summaries, result tables and baseline comparison for the benchmarks.
+"""
+
+import json
+import os
+from typing import Any, Dict, List
+
+from routing import percentile
+
+# A run regresses when a latency percentile grows, or throughput drops, by more than this
+DEFAULT_TOLERANCE = 0.2
+# ...and by at least this many milliseconds, so sub-millisecond timer noise is not flagged
+MIN_DELTA_MS = 0.5
+
+
+def summarize(samples: List[float], elapsed: float, errors: int = 0) -> Dict[str, Any]:
+    """count, errors, p50/p95/p99 in milliseconds and requests/sec for one operation"""
+    if not samples:
+        return {'count': 0, 'errors': errors, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0, 'rps': 0.0}
+    return {
+        'count': len(samples),
+        'errors': errors,
+        'p50_ms': round(percentile(samples, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+        'rps': round(len(samples) / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+
+def print_table(title: str, results: Dict[str, Dict[str, Any]]):
+    columns = ('count', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'rps')
+    width = max([len(name) for name in results] + [9])
+    print(f'\n{title}')
+    print(f'{"operation":<{width}}  ' + '  '.join(f'{column:>9}' for column in columns))
+    for name, summary in results.items():
+        print(f'{name:<{width}}  ' + '  '.join(f'{summary.get(column, 0):>9}' for column in columns))
+
+
+def load_baseline(path: str) -> Dict[str, Any]:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, results: Dict[str, Any]):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f'\nBaseline saved to {path}')
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """Regressions of `results` against `baseline`, as readable lines"""
+    regressions = []
+    print(f'\nCompared with baseline (tolerance {tolerance:.0%})')
+    for name, summary in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        changes = []
+        for field in ('p50_ms', 'p95_ms', 'p99_ms'):
+            if before.get(field):
+                change = summary[field] / before[field] - 1
+                changes.append(f'{field} {change:+.0%}')
+                if change > tolerance and summary[field] - before[field] >= MIN_DELTA_MS:
+                    regressions.append(f'{name}: {field} {before[field]} -> {summary[field]}')
+        if before.get('rps'):
+            change = summary['rps'] / before['rps'] - 1
+            changes.append(f'rps {change:+.0%}')
+            if change < -tolerance:
+                regressions.append(f'{name}: rps {before["rps"]} -> {summary["rps"]}')
+        print(f'  {name}: ' + ', '.join(changes))
+
+    if regressions:
+        print('\nRegressions:')
+        for regression in regressions:
+            print(f'  {regression}')
+    else:
+        print('\nNo regressions')
+    return regressions
+
+
+def finish(results: Dict[str, Dict[str, Any]], args) -> int:
+    """Handle --save-baseline / --baseline; returns the process exit code"""
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+    if args.baseline:
+        if compare(results, load_baseline(args.baseline), args.tolerance):
+            return 1
+    return 0
+
+
+def add_arguments(parser):
+    parser.add_argument('--baseline', help='compare with results saved earlier; exit 1 on regression')
+    parser.add_argument('--save-baseline', help='write these results as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='allowed slowdown before a result counts as a regression (default 0.2)')
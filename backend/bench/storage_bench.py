@@ -0,0 +1,114 @@
+"""
+Micro-benchmarks of DataStorage operations as a user's history grows.
+
+For each storage engine and history size, one user is given that many
+conversations, then common operations are timed against a warm view cache.
+A second instance with the cache disabled measures cold reads. A few other
+users' conversations are stored alongside so whole-file engines pay for them
+the way they would in production.
+
+    python -m bench.storage_bench --sizes 100,1000,5000 --repeat 50
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench import report  # noqa: E402
+from data_storage import DataStorage  # noqa: E402
+from history_archive import RetentionPolicy  # noqa: E402
+
+USER = 'bench-user'
+OTHER_USERS = 5
+NO_RETENTION = RetentionPolicy(0, 0, 0)
+
+
+def conversation(index: int) -> Dict[str, Any]:
+    return {
+        'subject': ('Math', 'Physics', 'Biology', 'Chemistry')[index % 4],
+        'grade': str(5 + index % 7),
+        'timestamp': f'2025-01-01T00:00:00.{index:06d}',
+        'messages': [
+            {'type': 'user', 'message': f'How does topic {index % 97} show up in everyday life?'},
+            {'type': 'bot', 'message': f'Topic {index % 97} appears when you cook, travel and build. ' * 8},
+        ],
+    }
+
+
+def populate(storage: DataStorage, size: int):
+    for user in [USER] + [f'other-{n}' for n in range(OTHER_USERS)]:
+        count = size if user == USER else max(size // 10, 1)
+        for start in range(0, count, 500):
+            storage.save_chat_histories(user, {
+                f'c{index}': conversation(index) for index in range(start, min(start + 500, count))
+            })
+
+
+def timed(operation: Callable[[int], Any], repeat: int) -> Dict[str, Any]:
+    samples: List[float] = []
+    started = time.perf_counter()
+    for iteration in range(repeat):
+        call_started = time.perf_counter()
+        operation(iteration)
+        samples.append(time.perf_counter() - call_started)
+    return report.summarize(samples, time.perf_counter() - started)
+
+
+def bench_size(engine: str, size: int, repeat: int) -> Dict[str, Dict[str, Any]]:
+    data_dir = tempfile.mkdtemp(prefix='storage-bench-')
+    storage = DataStorage(data_dir, backend=engine, durability='sync', retention=NO_RETENTION)
+    populate(storage, size)
+    cold = DataStorage(data_dir, backend=engine, cache_max_users=0, durability='sync', retention=NO_RETENTION)
+    storage.get_chat_history(USER)  # warm the view cache
+
+    def save_exchange(iteration):
+        turn = {'user': f'Follow-up {iteration}', 'bot': 'Another answer. ' * 20}
+        storage.save_exchanges(USER, [('live', turn)], {'live': {
+            'subject': 'Math', 'grade': '8', 'last_message': turn, 'turn_count': iteration + 1,
+        }})
+
+    operations = {
+        'save_exchange': save_exchange,
+        'list_page': lambda iteration: storage.list_conversation_summaries(USER, 20),
+        'get_one': lambda iteration: storage.get_chat_history(USER, f'c{iteration % size}'),
+        'get_all': lambda iteration: storage.get_chat_history(USER),
+        'search': lambda iteration: storage.search_chat_history(USER, f'topic {iteration % 97} cook'),
+        'get_turns': lambda iteration: storage.get_conversation_turns(USER, 'live'),
+        'cold_list_page': lambda iteration: cold.list_conversation_summaries(USER, 20),
+        'cold_get_all': lambda iteration: cold.get_chat_history(USER),
+    }
+    # Whole-history reads are slow by nature at large sizes; fewer rounds keep the run short
+    slow = {'get_all', 'cold_get_all', 'cold_list_page'}
+    results = {}
+    for name, operation in operations.items():
+        rounds = max(repeat // 5, 3) if name in slow and size >= 5000 else repeat
+        results[f'{engine} n={size} {name}'] = timed(operation, rounds)
+    storage.backend.close()
+    cold.backend.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DataStorage operations by history size')
+    parser.add_argument('--sizes', default='100,1000,5000', help='conversations per user, comma separated')
+    parser.add_argument('--engines', default='json,sqlite', help='storage engines, comma separated')
+    parser.add_argument('--repeat', type=int, default=50, help='timed calls per operation')
+    report.add_arguments(parser)
+    args = parser.parse_args()
+
+    results = {}
+    for engine in args.engines.split(','):
+        for size in (int(size) for size in args.sizes.split(',')):
+            results.update(bench_size(engine, size, args.repeat))
+
+    report.print_table('DataStorage operations (ms per call)', results)
+    sys.exit(report.finish(results, args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,29 @@
-from flask import Flask, request, jsonify
+import gzip
+import json
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, Response, g, request, jsonify
 import requests
 from flask_cors import CORS
-from data_storage import DataStorage
+from http_cache import ConditionalResponses
+from circuit_breaker import CircuitBreakers, CircuitOpenError
+from context_window import ContextWindow
+from conversation_view import InvalidCursor
+from data_storage import IMPORT_CONFLICT_MODES, DataStorage
+from jobs import JobCancelled, JobManager, JobQueueFull
+from key_pool import KeyPool, NoKeyAvailable, PooledKey, request_cost
+from metrics import REGISTRY, stats_families
+from prompt_templates import PromptTemplates, cached_tokens
+from provider_client import ProviderClient, UpstreamError
+from response_cache import create_response_cache, request_fingerprint
+from routing import HedgedRouter, InvalidFallbackRoute, RouteTarget, is_failover_error, parse_fallback_route
+from singleflight import SingleFlight
+from usage_ledger import UsageLedger, parse_time
+from usage_limits import BudgetExceeded, RateLimited, UsageLimiter, key_id
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -9,6 +31,109 @@ CORS(app)  # Enable CORS for all routes
 # Initialize data storage
 data_store = DataStorage()
 
+# Pooled keep-alive sessions to the AI providers
+provider_client = ProviderClient()
+
+# Optional cache of answers to repeated questions (RESPONSE_CACHE_ENABLED=1)
+response_cache = create_response_cache(data_store.data_dir)
+
+# Identical questions asked at the same moment share one upstream call
+chat_flights = SingleFlight()
+
+# Token budget for earlier turns sent with each multi-turn request
+context_window = ContextWindow()
+
+# ETags of GET /api/history responses, so unchanged history is answered with 304 Not Modified
+history_responses = ConditionalResponses()
+
+# Tutor system prompts compiled once per (subject, grade), with provider prompt-cache breakpoints
+prompt_templates = PromptTemplates()
+
+# Request rate limits and token/credit budgets per user and per key, checkpointed to disk
+usage_limiter = UsageLimiter(os.path.join(data_store.data_dir, 'usage_limits.json'))
+
+# Hourly/daily token and cost counters per user, provider, model, key and subject
+usage_ledger = UsageLedger(os.path.join(data_store.data_dir, 'usage.db'))
+
+# Rotation state of the users' stored API keys (rate-limit headroom, 429 cool-downs)
+api_key_pool = KeyPool(usage_limiter)
+
+# Fail fast while a provider/model keeps erroring or timing out
+chat_breakers = CircuitBreakers()
+
+# Hedging and failover to fallback providers (X-Fallback-Route header or CHAT_FALLBACK_ROUTE)
+chat_router = HedgedRouter()
+
+# Shared worker pool for /api/chat/batch, with a cap on how many items one user runs at once
+batch_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('BATCH_WORKERS', 8)))
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 50))
+BATCH_USER_CONCURRENCY = int(os.environ.get('BATCH_USER_CONCURRENCY', 4))
+_batch_user_slots = {}  # user_id -> [semaphore, batches running], dropped when the last batch ends
+_batch_user_slots_lock = threading.Lock()
+
+# Background jobs for long generations (POST /api/chat/jobs)
+chat_jobs = JobManager(
+    workers=int(os.environ.get('JOB_WORKERS', 4)),
+    queue_size=int(os.environ.get('JOB_QUEUE_SIZE', 100)),
+    result_ttl=float(os.environ.get('JOB_RESULT_TTL', 600)),
+)
+JOB_MAX_WAIT = 30
+
+# History export/import: NDJSON lines are sent in chunks of about this size and imported in batches
+EXPORT_CHUNK_BYTES = 64 * 1024
+HISTORY_IMPORT_BATCH = int(os.environ.get('HISTORY_IMPORT_BATCH', 500))
+IMPORT_MAX_ERRORS = 20
+
+# Request latency per route and token/cost counters per provider and model (GET /metrics)
+HTTP_SECONDS = REGISTRY.histogram(
+    'chat_http_request_seconds', 'Time until a route returned its response (first byte for streams)', ('method', 'route'))
+HTTP_RESPONSES = REGISTRY.counter('chat_http_responses', 'Responses per route and status', ('method', 'route', 'status'))
+UPSTREAM_TOKENS = REGISTRY.counter('chat_upstream_tokens', 'Tokens used by AI provider calls', ('provider', 'model', 'kind'))
+UPSTREAM_COST = REGISTRY.counter('chat_upstream_cost', 'Credit spent on AI provider calls', ('provider', 'model'))
+CIRCUIT_STATE_VALUES = {'closed': 0, 'half_open': 1, 'open': 2}
+
+@app.before_request
+def _start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        HTTP_SECONDS.observe(time.perf_counter() - started, request.method, route)
+        HTTP_RESPONSES.inc(1, request.method, route, response.status_code)
+    return response
+
+def _collect_component_metrics():
+    """Gauges read from the caches, pools and queues when /metrics is scraped"""
+    families = []
+    if response_cache is not None:
+        families += stats_families('chat_response_cache', response_cache.stats(), 'Response cache')
+    families += stats_families('storage_view_cache', data_store.get_cache_stats(), 'Storage view cache')
+    families += stats_families('storage_history_writes', data_store.get_write_queue_stats(), 'History write queue')
+    families += stats_families('storage_history_archive', data_store.get_compaction_stats(), 'History compaction')
+    families += stats_families('chat_single_flight', chat_flights.stats(), 'Coalesced chat calls')
+    families += stats_families('chat_jobs', chat_jobs.stats(), 'Background chat jobs')
+    families += stats_families('chat_routing', chat_router.stats(), 'Hedging and failover')
+    families += stats_families('chat_prompt_templates', prompt_templates.stats(), 'Compiled system prompts')
+    families += stats_families('http_history_responses', history_responses.stats(), 'Conditional GET /api/history')
+
+    pool_samples = {}
+    for endpoint, counters in provider_client.stats().items():
+        for field, value in counters.items():
+            pool_samples.setdefault(field, []).append(('', {'endpoint': endpoint}, value))
+    families += [(f'chat_upstream_pool_{field}', 'gauge', f'Upstream connection pool: {field}', samples)
+                 for field, samples in pool_samples.items()]
+
+    families.append(('chat_circuit_state', 'gauge', 'Circuit breaker state (0 closed, 1 half open, 2 open)', [
+        ('', {'provider': circuit['provider'], 'model': circuit['model']}, CIRCUIT_STATE_VALUES.get(circuit['state'], 0))
+        for circuit in chat_breakers.states().values()
+    ]))
+    return families
+
+REGISTRY.register_collector(_collect_component_metrics)
+
 # This will be set dynamically, but keeping a default for fallback
 DEFAULT_OPENROUTER_API_KEY = "your_default_openrouter_api_key_here"  # Add your default key here
 
@@ -21,6 +146,157 @@ def get_api_key():
 
 @app.route('/api/chat', methods=['POST'])
 def chat():
+    # Clients that ask for an event stream get the streaming variant
+    if request.accept_mimetypes.best == 'text/event-stream':
+        return chat_stream()
+
+    try:
+        data = request.get_json()
+
+        # Get settings from headers
+        api_key = request.headers.get('X-API-Key', '')
+        provider = request.headers.get('X-Provider', 'OpenRouter')
+        model = request.headers.get('X-Model', 'deepseek/deepseek-r1')
+
+        user_id = data_store.get_user_id_from_request(request)
+        timestamp = request.headers.get('X-Timestamp', data.get('timestamp'))
+        route = _chat_route(user_id, provider, api_key, model)
+        if route is None:
+            return jsonify({'error': 'API key is required. Please configure it in Settings.'}), 400
+        usage_limiter.admit_user(user_id)
+        return jsonify(_answer_chat(user_id, data, route, timestamp, _response_cache_enabled()))
+
+    except InvalidFallbackRoute as e:
+        return jsonify({'error': str(e)}), 400
+    except CircuitOpenError as e:
+        return _retry_later_response(e, 503)
+    except (NoKeyAvailable, RateLimited, BudgetExceeded) as e:
+        return _retry_later_response(e, 429)
+    except UpstreamError as e:
+        return jsonify({'error': str(e)}), 500
+    except requests.Timeout:
+        return jsonify({'error': f'{provider} API timed out'}), 504
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _answer_chat(user_id, data, route, timestamp, use_cache, job=None):
+    """Answer one chat message and save it to history; returns the response body"""
+    provider, model = route[0].provider, route[0].model
+    user_message = data.get('message', '')
+    subject = data.get('subject', '')
+    grade = data.get('grade', '')
+    conversation = _prepare_conversation(user_id, data, model, subject, grade, user_message)
+
+    # Serve repeated questions from the response cache when enabled
+    cache_key = None
+    if use_cache and conversation['turn_count'] == 0:
+        cache_key = request_fingerprint(provider, model, subject, grade, user_message)
+    cached = response_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        _save_exchange(user_id, data, conversation, user_message, cached['response'], timestamp)
+        return dict(_cached_response_data(cached), conversation_id=conversation['id'])
+
+    # Call the appropriate AI service, joining an identical call already in flight.
+    # Follow-up questions depend on their own history, so they always go upstream.
+    call = lambda: _routed_chat(route, conversation['messages'], (user_id, subject))
+    if conversation['turn_count'] == 0:
+        flight_key = request_fingerprint(provider, model, subject, grade, user_message)
+        (ai_message, usage_info, routing), shared = chat_flights.do(flight_key, call)
+    else:
+        (ai_message, usage_info, routing), shared = call(), False
+
+    if cache_key and not shared:
+        response_cache.put(cache_key, {'response': ai_message, 'usage': usage_info})
+
+    # A cancelled background job leaves no trace in the history
+    if job is not None and job.cancel_requested:
+        raise JobCancelled()
+
+    # Automatically save chat history
+    _save_exchange(user_id, data, conversation, user_message, ai_message, timestamp,
+                   None if shared else usage_info)
+    return _answer_response(conversation['id'], ai_message, usage_info, routing, shared)
+
+def _answer_response(conversation_id, ai_message, usage_info, routing, shared):
+    """Response body for an answer from upstream, or from a call shared with an identical request"""
+    if shared:
+        # Another request paid for this answer
+        return {
+            'response': ai_message,
+            'conversation_id': conversation_id,
+            'coalesced': True,
+            'usage': {'input_tokens': 0, 'output_tokens': 0, 'total_tokens': 0},
+        }
+
+    response_data = {'response': ai_message, 'conversation_id': conversation_id}
+    if usage_info:
+        response_data['usage'] = usage_info
+    if routing:
+        response_data['routing'] = routing
+    return response_data
+
+@app.route('/api/chat/jobs', methods=['POST'])
+def create_chat_job():
+    """Queue a chat message for background processing and return its job ID at once"""
+    try:
+        data = request.get_json()
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Invalid JSON data'}), 400
+
+        # Get settings from headers
+        api_key = request.headers.get('X-API-Key', '')
+        provider = request.headers.get('X-Provider', 'OpenRouter')
+        model = request.headers.get('X-Model', 'deepseek/deepseek-r1')
+
+        user_id = data_store.get_user_id_from_request(request)
+        timestamp = request.headers.get('X-Timestamp', data.get('timestamp'))
+        use_cache = _response_cache_enabled()
+        route = _chat_route(user_id, provider, api_key, model)
+        if route is None:
+            return jsonify({'error': 'API key is required. Please configure it in Settings.'}), 400
+        usage_limiter.admit_user(user_id)
+
+        job = chat_jobs.submit(
+            user_id, lambda job: _answer_chat(user_id, data, route, timestamp, use_cache, job)
+        )
+        return jsonify(job.to_dict()), 202
+    except InvalidFallbackRoute as e:
+        return jsonify({'error': str(e)}), 400
+    except (RateLimited, BudgetExceeded) as e:
+        return _retry_later_response(e, 429)
+    except JobQueueFull:
+        return jsonify({'error': 'Too many chat jobs queued, please retry shortly'}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chat/jobs/<job_id>', methods=['GET'])
+def get_chat_job(job_id):
+    """Get a chat job's status and result (?wait=<seconds> long-polls until it finishes)"""
+    try:
+        user_id = data_store.get_user_id_from_request(request)
+        wait = min(max(request.args.get('wait', 0, type=float), 0), JOB_MAX_WAIT)
+        job = chat_jobs.get(user_id, job_id, wait=wait)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job.to_dict())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chat/jobs/<job_id>', methods=['DELETE'])
+def cancel_chat_job(job_id):
+    """Cancel a queued or running chat job"""
+    try:
+        user_id = data_store.get_user_id_from_request(request)
+        job = chat_jobs.cancel(user_id, job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        return jsonify(job.to_dict())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """Stream the AI answer token by token as Server-Sent Events"""
     try:
         data = request.get_json()
         user_message = data.get('message', '')
@@ -32,191 +308,534 @@ def chat():
         provider = request.headers.get('X-Provider', 'OpenRouter')
         model = request.headers.get('X-Model', 'deepseek/deepseek-r1')
 
-        if not api_key:
+        user_id = data_store.get_user_id_from_request(request)
+        route = _chat_route(user_id, provider, api_key, model)
+        if route is None:
             return jsonify({'error': 'API key is required. Please configure it in Settings.'}), 400
+        usage_limiter.admit_user(user_id)
+        timestamp = request.headers.get('X-Timestamp', data.get('timestamp'))
+        sse_headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
 
-        # Enhanced context with resource access instructions
-        context = f"""You are an educational AI tutor helping students understand real-life applications of {subject} concepts. The student is in grade {grade}.
-
-FORMATTING INSTRUCTIONS:
-- Use **bold text** for emphasis on key concepts
-- Use *italic text* for important terms
-- Use numbered lists when explaining steps or examples (1., 2., etc.)
-- Use bullet points and nested lists for organizing information hierarchically
-- **Use tables** for comparing data, showing examples, or organizing structured information
-  * Tables help students visualize relationships and patterns
-  * Example format:
-    | Concept | Description | Real-World Example |
-    |---------|-------------|-------------------|
-    | Photosynthesis | Process where plants make food | Growing vegetables in a garden |
-- Use `inline code` for technical terms, equations, or specific values
-- Use code blocks with triple backticks (```) for:
-  * Mathematical equations or formulas
-  * Step-by-step algorithms
-  * Data structures or models
-- Structure your response with clear paragraphs and headings when needed
-- Use horizontal rules (---) to separate major sections
-
-RESPONSE STRUCTURE:
-- Start with a clear, engaging explanation
-- Provide examples with numbered steps when helpful
-- End with practical applications
-
-SOURCE REQUIREMENTS:
-- ALWAYS include a SOURCES section at the END of your response
-- Use this exact format for sources:
-
-SOURCES:
-1. [Source Name](URL) - Brief description of what was used from this source
-2. [Source Name](URL) - Brief description...
-
-AVAILABLE EDUCATIONAL RESOURCES (include at least 1-2 specific sources per response):
-- Use ONLY the EXACT URLs from the official websites - DO NOT compose or modify URLs
-- For Khan Academy: Use the complete URL exactly as it appears on their site (e.g., https://www.khanacademy.org/partner-content/amnh/earthquakes-and-volcanoes/plate-tectonics)
-- For BBC Bitesize: Use complete URLs (e.g., https://www.bbc.co.uk/bitesize/guides/zscxn39/revision/3)
-- For other sites: Use complete, specific URLs rather than just domain names
-- Khan Academy (https://www.khanacademy.org) - use exact URLs from their content pages
-- BBC Bitesize (https://www.bbc.co.uk/bitesize) - use exact URLs from their guides
-- NASA Education (https://www.nasa.gov/learning-resources) - use complete NASA education resource URLs
-- National Geographic Education (https://www.nationalgeographic.com/education) - use complete article URLs
-- TED-Ed (https://ed.ted.com) - use complete lesson URLs
-- Wikipedia (https://en.wikipedia.org) - use complete article URLs for educational content only
-- Britannica (https://britannica.com) - use complete encyclopedia entry URLs
-- Official government education sites (.gov, .edu domains) - use complete program/lesson URLs when available
-
-IMPORTANT RESTRICTIONS:
-- DO NOT include any references or links in the main response text
-- Always put sources in the SOURCES section at the end
-- DO NOT use or reference open forum websites like Reddit, Quora, or social media
-- DO NOT use crowd-sourced content or discussion forums
-- ONLY use reputable educational sources from the approved list
-
-Keep your response focused on {subject} applications with clear formatting and proper source citations."""
-
-        # Determine API endpoint and headers based on provider
-        base_url, headers = _get_provider_config(provider, api_key)
-
-        # Call the appropriate AI service
-        response = requests.post(
-            f'{base_url}/chat/completions',
-            headers=headers,
-            json={
-                'model': model,
-                'messages': [
-                    {'role': 'system', 'content': context},
-                    {'role': 'user', 'content': user_message}
-                ],
-                'temperature': 0.7,
-            }
+        conversation = _prepare_conversation(user_id, data, model, subject, grade, user_message)
+
+        cache_key = _response_cache_key(provider, model, subject, grade, user_message, conversation)
+        cached = response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            _save_exchange(user_id, data, conversation, user_message, cached['response'], timestamp)
+            return Response(_replay_cached_stream(cached, conversation['id']),
+                            mimetype='text/event-stream', headers=sse_headers)
+
+        try:
+            response, target, used_key = _open_stream(route, conversation['messages'])
+        except CircuitOpenError as e:
+            return _retry_later_response(e, 503)
+        except (NoKeyAvailable, RateLimited) as e:
+            return _retry_later_response(e, 429)
+        except UpstreamError as e:
+            return jsonify({'error': str(e)}), 500
+
+        return Response(
+            _relay_stream(response, target, used_key, user_id, data, conversation, user_message, timestamp, cache_key),
+            mimetype='text/event-stream',
+            headers=sse_headers,
         )
+    except InvalidFallbackRoute as e:
+        return jsonify({'error': str(e)}), 400
+    except (RateLimited, BudgetExceeded) as e:
+        return _retry_later_response(e, 429)
+    except requests.Timeout:
+        return jsonify({'error': f'{provider} API timed out'}), 504
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        if response.status_code == 200:
-            result = response.json()
-            # Handle different response formats for different providers
-            if provider == 'Anthropic':
-                ai_message = result['content'][0]['text']
-            else:
-                ai_message = result['choices'][0]['message']['content']
-
-            # Extract token usage information from response
-            usage_info = {}
-            if 'usage' in result:
-                usage_data = result['usage']
-                # Handle different provider response formats
-                if provider == 'Anthropic':
-                    # Anthropic typically uses 'input_tokens' and 'output_tokens'
-                    input_tokens = usage_data.get('input_tokens', 0)
-                    output_tokens = usage_data.get('output_tokens', 0)
-                    total_tokens = input_tokens + output_tokens
-                else:
-                    # OpenAI/OpenRouter format
-                    input_tokens = usage_data.get('prompt_tokens', 0)
-                    output_tokens = usage_data.get('completion_tokens', 0)
-                    total_tokens = usage_data.get('total_tokens', input_tokens + output_tokens)
-
-                usage_info = {
-                    'input_tokens': input_tokens,
-                    'output_tokens': output_tokens,
-                    'total_tokens': total_tokens,
-                }
-
-            # Automatically save chat history
-            user_id = data_store.get_user_id_from_request(request)
-            conversation_id = f"{subject}_{grade}_{int(data.get('timestamp', 0))}"
-
-            # Build conversation data including this exchange
-            conversation_data = {
-                'subject': subject,
-                'grade': grade,
-                'timestamp': request.headers.get('X-Timestamp', data.get('timestamp')),
-                'last_message': {
-                    'user': user_message,
-                    'bot': ai_message,
-                    'timestamp': data.get('timestamp')
-                }
-            }
+def _open_stream(route, messages):
+    """Open a streaming completion, failing over along the route before the first byte; returns (response, target, api_key)"""
+    for index, target in enumerate(route):
+        last_target = index == len(route) - 1
+        payload = _build_stream_payload(target, messages)
 
-            # Try to save, but don't fail the response if storage fails
-            try:
-                data_store.save_chat_history(user_id, conversation_id, conversation_data)
-            except Exception as storage_error:
-                print(f"Warning: Chat history storage failed: {storage_error}")
-
-            response_data = {'response': ai_message}
-            if usage_info:
-                response_data['usage'] = usage_info
-            return jsonify(response_data)
-        else:
-            return jsonify({'error': f'Failed to get response from {provider} API (Status: {response.statusCode})'}), 500
+        def send(api_key, max_retries):
+            return provider_client.chat_completion(
+                target.provider, api_key, payload, stream=True, max_retries=max_retries if last_target else 0
+            )
+
+        def call():
+            response, api_key = _send_with_key(target, send)
+            if response.status_code != 200:
+                response.close()
+                raise UpstreamError(target.provider, response.status_code)
+            return response, api_key
+
+        try:
+            response, api_key = chat_breakers.call(target.provider, target.model, call)
+        except Exception as e:
+            if last_target or not is_failover_error(e):
+                raise
+            chat_router.record_failover()
+            continue
+        return response, target, api_key
+
+def _build_stream_payload(target, messages):
+    """Build the request body of a streaming completion"""
+    payload = _build_chat_payload(target.provider, target.model, messages)
+    payload['stream'] = True
+    if target.provider != 'Anthropic':
+        # Ask OpenAI-compatible APIs to report usage in the final chunk
+        payload['stream_options'] = {'include_usage': True}
+    return payload
+
+def _relay_stream(response, target, api_key, user_id, data, conversation, user_message, timestamp, cache_key=None):
+    """Relay upstream deltas as SSE events, then save the assembled answer"""
+    provider = target.provider
+    parts = []
+    usage_data = {}
+    try:
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            chunk = line[len('data:'):].strip()
+            if chunk == '[DONE]':
+                break
+
+            event = json.loads(chunk)
+            delta = _extract_stream_delta(provider, event, usage_data)
+            if delta:
+                parts.append(delta)
+                yield _sse_event({'delta': delta})
+
+        ai_message = ''.join(parts)
+        usage_info = _extract_usage(provider, usage_data)
+        _record_usage((user_id, data.get('subject', '')), target, api_key, usage_data, usage_info)
+        _save_exchange(user_id, data, conversation, user_message, ai_message, timestamp, usage_info)
+
+        # The client already assembled the text from the deltas
+        done_data = {'conversation_id': conversation['id']}
+        if usage_info:
+            done_data['usage'] = usage_info
+        if cache_key:
+            response_cache.put(cache_key, {'response': ai_message, 'usage': usage_info})
+        yield _sse_event(done_data, event='done')
+    except Exception as e:
+        yield _sse_event({'error': str(e)}, event='error')
+    finally:
+        response.close()
+
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    """Answer a list of {message, subject, grade} items concurrently, returning results in order"""
+    try:
+        data = request.get_json()
+        items = data.get('items') if isinstance(data, dict) else None
 
+        # Get settings from headers
+        api_key = request.headers.get('X-API-Key', '')
+        provider = request.headers.get('X-Provider', 'OpenRouter')
+        model = request.headers.get('X-Model', 'deepseek/deepseek-r1')
+
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'A non-empty list of items is required'}), 400
+        if len(items) > BATCH_MAX_ITEMS:
+            return jsonify({'error': f'A batch can contain at most {BATCH_MAX_ITEMS} items'}), 400
+
+        user_id = data_store.get_user_id_from_request(request)
+        timestamp = request.headers.get('X-Timestamp', data.get('timestamp'))
+        use_cache = _response_cache_enabled()
+        route = _chat_route(user_id, provider, api_key, model)
+        if route is None:
+            return jsonify({'error': 'API key is required. Please configure it in Settings.'}), 400
+        usage_limiter.admit_user(user_id)
+
+        # Never run more than BATCH_USER_CONCURRENCY of this user's items at once
+        slots = _acquire_batch_slots(user_id)
+        try:
+            futures = []
+            for index, item in enumerate(items):
+                slots.acquire()
+                future = batch_executor.submit(_run_batch_item, user_id, index, item, route, use_cache)
+                future.add_done_callback(lambda _: slots.release())
+                futures.append(future)
+            outcomes = [future.result() for future in futures]
+        finally:
+            _release_batch_slots(user_id)
+
+        # Save the whole batch to history in one group write
+        turns = []
+        conversations = {}
+        results = []
+        for item, (result, conversation, ai_message, usage_info) in zip(items, outcomes):
+            results.append(result)
+            if ai_message is None:
+                continue
+            item_data = dict(item, timestamp=data.get('timestamp'))
+            turn, conversation_data = _exchange_records(
+                item_data, conversation, item.get('message', ''), ai_message, timestamp, usage_info
+            )
+            turns.append((conversation['id'], turn))
+            conversations[conversation['id']] = conversation_data
+
+        usage_limiter.charge_user(user_id, sum((outcome[3] or {}).get('total_tokens', 0) for outcome in outcomes))
+        if conversations:
+            data_store.save_exchanges(user_id, turns, conversations)
+
+        return jsonify({'results': results})
+    except InvalidFallbackRoute as e:
+        return jsonify({'error': str(e)}), 400
+    except (RateLimited, BudgetExceeded) as e:
+        return _retry_later_response(e, 429)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def _get_provider_config(provider, api_key):
-    """Get the base URL and headers for different AI providers"""
-    if provider == 'OpenAI':
-        return (
-            'https://api.openai.com/v1',
-            {
-                'Authorization': f'Bearer {api_key}',
-                'Content-Type': 'application/json',
-            }
-        )
-    elif provider == 'Anthropic':
-        return (
-            'https://api.anthropic.com/v1',
-            {
-                'x-api-key': api_key,
-                'anthropic-version': '2023-06-01',
-                'Content-Type': 'application/json',
-            }
-        )
-    elif provider == 'GoogleAI Studio':
-        return (
-            'https://generativelanguage.googleapis.com/v1beta',
-            {
-                'x-goog-api-key': api_key,
-                'Content-Type': 'application/json',
-            }
-        )
-    elif provider == 'LiteLLM':
-        return (
-            'http://localhost:4000',  # Default LiteLLM proxy server
-            {
-                'Authorization': f'Bearer {api_key}',
-                'Content-Type': 'application/json',
-            }
+def _acquire_batch_slots(user_id):
+    """The user's batch concurrency semaphore, shared by their concurrent batches"""
+    with _batch_user_slots_lock:
+        entry = _batch_user_slots.get(user_id)
+        if entry is None:
+            entry = _batch_user_slots[user_id] = [threading.BoundedSemaphore(BATCH_USER_CONCURRENCY), 0]
+        entry[1] += 1
+        return entry[0]
+
+def _release_batch_slots(user_id):
+    """End one of the user's batches, dropping their semaphore once none is running"""
+    with _batch_user_slots_lock:
+        entry = _batch_user_slots[user_id]
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _batch_user_slots[user_id]
+
+def _run_batch_item(user_id, index, item, route, use_cache):
+    """Answer one batch item; returns (result, conversation, ai_message, usage_info)"""
+    provider, model = route[0].provider, route[0].model
+    if not isinstance(item, dict):
+        return {'index': index, 'error': 'Each item must be an object'}, None, None, None
+
+    user_message = item.get('message', '')
+    subject = item.get('subject', '')
+    grade = item.get('grade', '')
+    if not isinstance(user_message, str) or not user_message.strip():
+        return {'index': index, 'error': 'Each item needs a non-empty message'}, None, None, None
+    conversation = {
+        'id': f"{subject}_{grade}_batch_{os.urandom(6).hex()}",
+        'turn_count': 0,
+        'rolling_summary': None,
+        'usage': {},
+    }
+
+    try:
+        conversation['messages'], _ = context_window.build(
+            model, prompt_templates.system_prompt(subject, grade), [], user_message
         )
-    else:  # OpenRouter (default)
-        return (
-            'https://openrouter.ai/api/v1',
-            {
-                'Authorization': f'Bearer {api_key}',
-                'Content-Type': 'application/json',
-                'HTTP-Referer': 'flutter-app',
-                'X-Title': 'Real Life Applications App',
-            }
+        fingerprint = request_fingerprint(provider, model, subject, grade, user_message)
+        cached = response_cache.get(fingerprint) if use_cache else None
+        if cached is not None:
+            result = dict(_cached_response_data(cached), index=index, conversation_id=conversation['id'])
+            return result, conversation, cached['response'], None
+
+        (ai_message, usage_info, routing), shared = chat_flights.do(
+            fingerprint, lambda: _routed_chat(route, conversation['messages'], (user_id, subject))
         )
+        if use_cache and not shared:
+            response_cache.put(fingerprint, {'response': ai_message, 'usage': usage_info})
+
+        result = {'index': index, 'response': ai_message, 'conversation_id': conversation['id']}
+        if shared:
+            result['coalesced'] = True
+            usage_info = None
+        if usage_info:
+            result['usage'] = usage_info
+        if routing:
+            result['routing'] = routing
+        return result, conversation, ai_message, usage_info
+    except Exception as e:
+        return {'index': index, 'error': str(e)}, None, None, None
+
+def _complete_chat(target, messages, account, attempt=None):
+    """Call the target once, recording usage to account=(user_id, subject); returns (ai_message, usage_info)"""
+    provider = target.provider
+    payload = _build_chat_payload(provider, target.model, messages)
+
+    def send(api_key, max_retries):
+        if attempt is None:
+            return provider_client.chat_completion(provider, api_key, payload, max_retries=max_retries)
+        # Hedged attempts fail over instead of retrying, and stream the body so a cancel can close it
+        return attempt.bind(provider_client.chat_completion(provider, api_key, payload, stream=True, max_retries=0))
+
+    def call():
+        response, api_key = _send_with_key(target, send)
+        if response.status_code != 200:
+            response.close()
+            raise UpstreamError(provider, response.status_code)
+        return response, api_key
+
+    # Fails fast with CircuitOpenError while this provider/model is unhealthy
+    response, api_key = chat_breakers.call(provider, target.model, call)
+    result = response.json()
+    ai_message = _extract_ai_message(provider, result)
+
+    # Extract token usage information from response
+    usage_info = _extract_usage(provider, result.get('usage'))
+    _record_usage(account, target, api_key, result.get('usage'), usage_info)
+    return ai_message, usage_info
+
+def _record_usage(account, target, api_key, usage_data, usage_info):
+    """Charge a completed call to the key's credit and add it to the usage ledger"""
+    cost = request_cost(target.model, usage_data, usage_info, api_key_pool.prices)
+    if target.key_pool:
+        usage_limiter.charge_key(api_key, cost)
+    user_id, subject = account
+    for kind in ('input', 'output', 'cached'):
+        tokens = (usage_info or {}).get(f'{kind}_tokens', 0)
+        if tokens:
+            UPSTREAM_TOKENS.inc(tokens, target.provider, target.model, kind)
+    if cost:
+        UPSTREAM_COST.inc(cost, target.provider, target.model)
+    usage_ledger.record(user_id, target.provider, target.model, key_id(api_key or ''), subject, usage_info, cost)
+
+def _send_with_key(target, send):
+    """Call send(api_key, max_retries) with the target's key, rotating through its pool past 429s; returns (response, api_key)"""
+    if not target.key_pool:
+        usage_limiter.admit_key(target.api_key)
+        return send(target.api_key, None), target.api_key
+
+    tried = []
+    while True:
+        key = api_key_pool.acquire(target.provider, target.key_pool, exclude=tried)
+        tried.append(key.api_key)
+        more_keys = len(tried) < len(target.key_pool)
+
+        # With other keys left, a 429 moves on to the next key rather than retrying this one
+        response = send(key.api_key, 0 if more_keys else None)
+        api_key_pool.observe(key.api_key, response.status_code, response.headers)
+        if response.status_code == 429 and more_keys:
+            response.close()
+            continue
+        return response, key.api_key
+
+def _routed_chat(route, messages, account):
+    """Answer along the route, hedging and failing over when it has fallbacks; returns (ai_message, usage_info, routing)"""
+    if len(route) == 1:
+        return _complete_chat(route[0], messages, account) + (None,)
+
+    (ai_message, usage_info), routing = chat_router.run(
+        route, lambda attempt: _complete_chat(attempt.target, messages, account, attempt)
+    )
+    return ai_message, usage_info, routing
+
+def _chat_route(user_id, provider, api_key, model, headers=None):
+    """The requested provider followed by any fallback targets; None when the primary has no API key"""
+    primary = _route_target(user_id, provider, model, api_key)
+    if primary is None:
+        return None
+    route = [primary]
+
+    # e.g. X-Fallback-Route: [{"provider": "OpenAI", "model": "gpt-4o-mini"}]
+    headers = request.headers if headers is None else headers
+    if headers.get('X-Fallback-Route'):
+        fallbacks = parse_fallback_route(headers['X-Fallback-Route'])  # a bad header is the client's error (400)
+    else:
+        fallbacks = _default_fallbacks()
+    for entry in fallbacks:
+        fallback_provider = entry.get('provider')
+        fallback_model = entry.get('model')
+        if not fallback_provider or not fallback_model:
+            continue
+        fallback_key = entry.get('api_key') or (api_key if fallback_provider == provider else None)
+        target = _route_target(user_id, fallback_provider, fallback_model, fallback_key)
+        if target is not None and target not in route:
+            route.append(target)
+    return route
+
+def _default_fallbacks():
+    """Fallback entries from CHAT_FALLBACK_ROUTE; a malformed value is ignored"""
+    value = os.environ.get('CHAT_FALLBACK_ROUTE')
+    if not value:
+        return []
+    try:
+        return parse_fallback_route(value)
+    except InvalidFallbackRoute as e:
+        print(f"Warning: Ignoring CHAT_FALLBACK_ROUTE: {e}")
+        return []
+
+def _route_target(user_id, provider, model, api_key):
+    """Target that rotates through the user's stored keys for the provider, unless a key they never stored was sent"""
+    stored_keys = _stored_keys(user_id, provider)
+    if api_key and api_key not in {key.api_key for key in stored_keys}:
+        return RouteTarget(provider, model, api_key)
+    if not stored_keys:
+        return None
+    return RouteTarget(provider, model, api_key or None, tuple(stored_keys))
+
+def _stored_keys(user_id, provider):
+    """The user's stored API keys for a provider"""
+    return [
+        PooledKey(key_data['unique_key'], key_data['api_key'], key_data.get('credit_limit'))
+        for key_data in data_store.get_api_keys_formatted(user_id)
+        if key_data['provider'] == provider and key_data.get('api_key')
+    ]
+
+def _retry_later_response(error, status_code):
+    """Error response with a Retry-After hint (open circuit, exhausted keys, rate limit or budget)"""
+    return jsonify({'error': str(error)}), status_code, {'Retry-After': str(int(error.retry_after) + 1)}
+
+def _replay_cached_stream(cached, conversation_id):
+    """Send a cached answer as a single delta followed by the done event"""
+    cached_data = dict(_cached_response_data(cached), conversation_id=conversation_id)
+    yield _sse_event({'delta': cached_data.pop('response')})
+    yield _sse_event(cached_data, event='done')
+
+def _response_cache_enabled(headers=None):
+    """Whether this request may use the response cache (it is off, or the client bypassed it)"""
+    if response_cache is None:
+        return False
+    headers = request.headers if headers is None else headers
+    if headers.get('X-Cache-Bypass', '').lower() in ('1', 'true', 'yes'):
+        return False
+    return 'no-cache' not in headers.get('Cache-Control', '')
+
+def _response_cache_key(provider, model, subject, grade, user_message, conversation, headers=None):
+    """Cache key for this request, or None if the cache is off, bypassed or the question is a follow-up"""
+    if conversation['turn_count'] > 0 or not _response_cache_enabled(headers):
+        return None
+    return request_fingerprint(provider, model, subject, grade, user_message)
+
+def _cached_response_data(cached):
+    """Response body for a cached answer: no tokens were spent on this request"""
+    return {
+        'response': cached['response'],
+        'cached': True,
+        'usage': {'input_tokens': 0, 'output_tokens': 0, 'total_tokens': 0},
+        'cached_usage': cached.get('usage') or {},
+    }
+
+def _extract_stream_delta(provider, event, usage_data):
+    """Return the text delta of one streamed chunk, collecting usage as it appears"""
+    if provider == 'Anthropic':
+        event_type = event.get('type')
+        if event_type == 'message_start':
+            usage_data.update(event.get('message', {}).get('usage', {}))
+        elif event_type == 'message_delta':
+            usage_data.update(event.get('usage', {}))
+        elif event_type == 'content_block_delta':
+            return event.get('delta', {}).get('text', '')
+        return ''
+
+    if event.get('usage'):
+        usage_data.update(event['usage'])
+    choices = event.get('choices') or []
+    if choices:
+        return choices[0].get('delta', {}).get('content') or ''
+    return ''
+
+def _sse_event(payload, event=None):
+    """Format a Server-Sent Event"""
+    prefix = f'event: {event}\n' if event else ''
+    return f'{prefix}data: {json.dumps(payload)}\n\n'
+
+def _build_chat_payload(provider, model, messages):
+    """Build the chat completion request body"""
+    return {
+        'model': model,
+        'messages': prompt_templates.mark_cacheable(provider, messages),
+        'temperature': 0.7,
+    }
+
+def _prepare_conversation(user_id, data, model, subject, grade, user_message):
+    """Load the conversation's earlier turns and build the upstream messages"""
+    conversation_id = data.get('conversation_id') or f"{subject}_{grade}_{int(data.get('timestamp', 0))}"
+    turns = data_store.get_conversation_turns(user_id, conversation_id)
+    if not turns and data_store.restore_archived(user_id, conversation_id):
+        # Continuing an archived conversation brings it back to the hot store
+        turns = data_store.get_conversation_turns(user_id, conversation_id)
+    previous = data_store.get_chat_history(user_id, conversation_id) if turns else {}
+
+    messages, rolling_summary = context_window.build(
+        model, prompt_templates.system_prompt(subject, grade), turns, user_message, previous.get('rolling_summary')
+    )
+    return {
+        'id': conversation_id,
+        'turn_count': len(turns),
+        'messages': messages,
+        'rolling_summary': rolling_summary,
+        'usage': previous.get('usage') or {},
+    }
+
+def _extract_ai_message(provider, result):
+    """Get the answer text from a completion response"""
+    # Handle different response formats for different providers
+    if provider == 'Anthropic':
+        return result['content'][0]['text']
+    return result['choices'][0]['message']['content']
+
+def _extract_usage(provider, usage_data):
+    """Normalize the token usage block of a provider response"""
+    if not usage_data:
+        return {}
+
+    # Handle different provider response formats
+    if provider == 'Anthropic':
+        # Anthropic typically uses 'input_tokens' and 'output_tokens'; cache reads and writes are counted apart
+        input_tokens = (usage_data.get('input_tokens', 0) + usage_data.get('cache_read_input_tokens', 0)
+                        + usage_data.get('cache_creation_input_tokens', 0))
+        output_tokens = usage_data.get('output_tokens', 0)
+        total_tokens = input_tokens + output_tokens
+    else:
+        # OpenAI/OpenRouter format
+        input_tokens = usage_data.get('prompt_tokens', 0)
+        output_tokens = usage_data.get('completion_tokens', 0)
+        total_tokens = usage_data.get('total_tokens', input_tokens + output_tokens)
+
+    usage_info = {
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'total_tokens': total_tokens,
+    }
+    # Input tokens served from the provider's prompt cache (already included in input_tokens)
+    cached = cached_tokens(usage_data)
+    if cached:
+        usage_info['cached_tokens'] = cached
+    return usage_info
+
+def _save_exchange(user_id, data, conversation, user_message, ai_message, timestamp, usage_info=None):
+    """Save one question/answer exchange to the user's chat history"""
+    turn, conversation_data = _exchange_records(data, conversation, user_message, ai_message, timestamp, usage_info)
+    usage_limiter.charge_user(user_id, (usage_info or {}).get('total_tokens', 0))
+
+    # Try to save, but don't fail the response if storage fails
+    try:
+        data_store.save_exchanges(user_id, [(conversation['id'], turn)], {conversation['id']: conversation_data})
+    except Exception as storage_error:
+        print(f"Warning: Chat history storage failed: {storage_error}")
+
+def _exchange_records(data, conversation, user_message, ai_message, timestamp, usage_info=None):
+    """Build the transcript turn and the updated conversation record for one exchange"""
+    subject = data.get('subject', '')
+    grade = data.get('grade', '')
+    turn = {
+        'user': user_message,
+        'bot': ai_message,
+        'timestamp': data.get('timestamp')
+    }
+    if usage_info:
+        turn['usage'] = usage_info
+
+    # Build conversation data including this exchange
+    conversation_data = {
+        'subject': subject,
+        'grade': grade,
+        'timestamp': timestamp,
+        'last_message': turn,
+        'turn_count': conversation['turn_count'] + 1,
+    }
+    if conversation.get('rolling_summary'):
+        conversation_data['rolling_summary'] = conversation['rolling_summary']
+
+    # Running token totals for the whole conversation
+    totals = dict(conversation.get('usage') or {})
+    for field, value in (usage_info or {}).items():
+        totals[field] = totals.get(field, 0) + value
+    if totals:
+        conversation_data['usage'] = totals
+
+    return dict(turn), conversation_data
 
 @app.route('/api/chat/completion', methods=['POST'])
 def chat_completion():
@@ -254,6 +873,34 @@ def chat_completion():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/upstream/stats', methods=['GET'])
+def get_upstream_stats():
+    """Connection pool, retry and hedging counters for the AI providers"""
+    return jsonify({'upstream': provider_client.stats(), 'routing': chat_router.stats()})
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text exposition of the shared metrics registry"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/upstream/circuits', methods=['GET'])
+def get_upstream_circuits():
+    """Circuit breaker state per provider and model"""
+    return jsonify({'circuits': chat_breakers.states()})
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Hit/miss counters for the response cache and the storage view cache"""
+    return jsonify({
+        'response_cache': response_cache.stats() if response_cache is not None else None,
+        'storage_cache': data_store.get_cache_stats(),
+        'history_writes': data_store.get_write_queue_stats(),
+        'history_archive': data_store.get_compaction_stats(),
+        'single_flight': chat_flights.stats(),
+        'jobs': chat_jobs.stats(),
+        'prompts': prompt_templates.stats(),
+    })
+
 # API Key Management Endpoints
 @app.route('/api/keys', methods=['POST'])
 def save_api_key():
@@ -291,6 +938,58 @@ def get_api_keys():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/keys/pool', methods=['GET'])
+def get_api_key_pool():
+    """Rotation state of the current user's stored keys, grouped by provider"""
+    try:
+        user_id = data_store.get_user_id_from_request(request)
+        providers = {}
+        for key_data in data_store.get_api_keys_formatted(user_id):
+            providers.setdefault(key_data['provider'], []).append(
+                PooledKey(key_data['unique_key'], key_data.get('api_key') or '', key_data.get('credit_limit'))
+            )
+        return jsonify({'pool': {provider: api_key_pool.describe(keys) for provider, keys in providers.items()}})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/limits', methods=['GET'])
+def get_usage_limits():
+    """The current user's token budget and remaining request allowance"""
+    try:
+        user_id = data_store.get_user_id_from_request(request)
+        return jsonify({'limits': usage_limiter.user_usage(user_id)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/usage', methods=['GET'])
+def get_usage():
+    """Token and cost totals for the current user (?granularity=day|hour&start=...&end=...&group_by=model,period)"""
+    try:
+        user_id = data_store.get_user_id_from_request(request)
+        start = request.args.get('start')
+        end = request.args.get('end')
+        group_by = [dimension for dimension in request.args.get('group_by', '').split(',') if dimension]
+        try:
+            usage = usage_ledger.query(
+                user_id,
+                granularity=request.args.get('granularity', 'day'),
+                start=parse_time(start) if start else None,
+                end=parse_time(end) if end else None,
+                group_by=group_by,
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        # Show stored keys by name rather than by hash
+        if 'key' in group_by:
+            key_names = {key_id(key_data['api_key']): key_data['unique_key']
+                         for key_data in data_store.get_api_keys_formatted(user_id) if key_data.get('api_key')}
+            for row in usage['usage']:
+                row['key'] = key_names.get(row['key'], row['key'])
+        return jsonify(usage)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/keys/<provider>', methods=['DELETE'])
 def delete_api_key(provider):
     """Delete an API key for a specific provider"""
@@ -328,11 +1027,142 @@ def save_chat_history():
 
 @app.route('/api/history', methods=['GET'])
 def get_chat_history():
-    """Get all chat history for the current user"""
+    """Get all chat history for the current user, or one page of summaries"""
+    try:
+        user_id = data_store.get_user_id_from_request(request)
+        # Taken before the read, so a write that lands meanwhile moves it past the response's ETag
+        generation = data_store.history_generation(user_id)
+
+        # Listing mode: ?limit=20&cursor=... (or &before=<timestamp>) returns compact summaries
+        if any(param in request.args for param in ('limit', 'cursor', 'before', 'summary')):
+            limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+            cursor, before = request.args.get('cursor'), request.args.get('before')
+            return history_responses.respond(
+                (user_id, limit, cursor, before), generation,
+                lambda: data_store.list_conversation_summaries(user_id, limit, cursor=cursor, before=before),
+                vary='X-User-ID, Accept-Encoding',
+            )
+
+        return history_responses.respond(
+            (user_id,), generation, lambda: data_store.get_chat_history(user_id), vary='X-User-ID, Accept-Encoding'
+        )
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/history/search', methods=['GET'])
+def search_chat_history():
+    """Full-text search over the current user's chat history"""
+    try:
+        user_id = data_store.get_user_id_from_request(request)
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'error': 'Search query (q) is required'}), 400
+
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        return jsonify(data_store.search_chat_history(
+            user_id, query, limit, subject=request.args.get('subject'), grade=request.args.get('grade')
+        ))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _ndjson_chunks(records):
+    """Serialize records as NDJSON, grouped into chunks of about EXPORT_CHUNK_BYTES"""
+    buffer = []
+    size = 0
+    for record in records:
+        line = json.dumps(record, default=str) + '\n'
+        buffer.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield ''.join(buffer).encode('utf-8')
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer).encode('utf-8')
+
+def _gzip_chunks(chunks):
+    """Gzip a stream of byte chunks incrementally"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31 = gzip container
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+@app.route('/api/history/export', methods=['GET'])
+def export_chat_history():
+    """Stream all of the current user's conversations as NDJSON (?gzip=1 to compress)"""
+    try:
+        user_id = data_store.get_user_id_from_request(request)
+        include_turns = request.args.get('turns', '1') != '0'
+        body = _ndjson_chunks(data_store.export_conversations(user_id, include_turns=include_turns))
+
+        if request.args.get('gzip', '0').lower() in ('1', 'true'):
+            body, mimetype, file_name = _gzip_chunks(body), 'application/gzip', 'chat_history.ndjson.gz'
+        else:
+            mimetype, file_name = 'application/x-ndjson', 'chat_history.ndjson'
+        return Response(body, mimetype=mimetype,
+                        headers={'Content-Disposition': f'attachment; filename="{file_name}"'})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/history/import', methods=['POST'])
+def import_chat_history():
+    """Import an NDJSON (optionally gzip) export into the current user's history, in batches"""
+    try:
+        user_id = data_store.get_user_id_from_request(request)
+        on_conflict = request.args.get('on_conflict', 'skip')
+        if on_conflict not in IMPORT_CONFLICT_MODES:
+            return jsonify({'error': f"on_conflict must be one of: {', '.join(IMPORT_CONFLICT_MODES)}"}), 400
+
+        stream = request.stream
+        if (request.headers.get('Content-Encoding', '').lower() == 'gzip'
+                or request.mimetype in ('application/gzip', 'application/x-gzip')):
+            stream = gzip.GzipFile(fileobj=stream)
+
+        totals = {'imported': 0, 'replaced': 0, 'skipped': 0, 'failed': 0}
+        errors = []
+        batch = []
+
+        def save_batch():
+            counts = data_store.import_conversations(user_id, batch, on_conflict)
+            for field, value in counts.items():
+                totals[field] += value
+            batch.clear()
+
+        for line_number, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict) or not record.get('conversation_id'):
+                    raise ValueError('each line must be a JSON object with a conversation_id')
+            except ValueError as e:
+                totals['failed'] += 1
+                if len(errors) < IMPORT_MAX_ERRORS:
+                    errors.append({'line': line_number, 'error': str(e)})
+                continue
+
+            batch.append(record)
+            if len(batch) >= HISTORY_IMPORT_BATCH:
+                save_batch()
+        if batch:
+            save_batch()
+
+        return jsonify(dict(totals, errors=errors))
+    except (OSError, EOFError) as e:
+        return jsonify({'error': f'Could not read the import stream: {e}'}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/history/archive', methods=['GET'])
+def get_archived_history():
+    """Summaries of the current user's archived conversations"""
     try:
         user_id = data_store.get_user_id_from_request(request)
-        history_data = data_store.get_chat_history(user_id)
-        return jsonify(history_data)
+        return jsonify(data_store.list_archived_conversations(user_id))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
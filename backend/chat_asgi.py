@@ -0,0 +1,397 @@
+"""
+Asyncio (ASGI) serving mode for the chat API.
+
+With Flask and requests, every in-flight chat holds an OS thread while it
+waits for the AI provider. This app serves /api/chat and /api/chat/stream on
+an event loop instead, so one process can keep thousands of chats in flight:
+- upstream calls go through aiohttp
+- hedging, failover and coalescing of identical questions run as tasks
+- blocking storage work is offloaded to a small thread pool
+- a client that disconnects has its chat cancelled and the upstream request closed
+
+Every other route is served by the Flask app from chat_api on worker threads.
+Routes, payloads and shared state (storage, limits, caches, metrics) are
+therefore the same in both modes.
+
+    pip install -r requirements-async.txt
+    uvicorn chat_asgi:app --host 0.0.0.0 --port 5001
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import requests
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+import chat_api
+from circuit_breaker import CircuitOpenError
+from key_pool import NoKeyAvailable
+from metrics import REGISTRY, stats_families
+from provider_client import AsyncProviderClient, UpstreamError
+from response_cache import request_fingerprint
+from routing import InvalidFallbackRoute, is_failover_error
+from singleflight import AsyncSingleFlight
+from usage_limits import BudgetExceeded, RateLimited
+
+# Pooled aiohttp connections to the AI providers
+provider_client = AsyncProviderClient()
+
+# Identical questions asked at the same moment share one upstream call
+chat_flights = AsyncSingleFlight()
+
+# Threads for the blocking storage and response cache calls of the async routes
+storage_executor = ThreadPoolExecutor(max_workers=int(os.environ.get('ASYNC_STORAGE_WORKERS', 16)),
+                                      thread_name_prefix='chat-storage')
+
+# Threads that run the Flask routes
+ASYNC_WSGI_WORKERS = int(os.environ.get('ASYNC_WSGI_WORKERS', 32))
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+
+class ClientDisconnected(Exception):
+    """The client went away before its answer was ready"""
+
+
+async def _offload(fn, *args):
+    """Run blocking storage work on the storage thread pool"""
+    return await asyncio.get_running_loop().run_in_executor(storage_executor, partial(fn, *args))
+
+
+async def _wait_for_disconnect(request):
+    # The body has been read, so the next message is the disconnect
+    while (await request.receive())['type'] != 'http.disconnect':
+        pass
+
+
+async def _cancel_on_disconnect(request, coroutine):
+    """Await coroutine, cancelling it if the client disconnects first"""
+    work = asyncio.ensure_future(coroutine)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request))
+    try:
+        await asyncio.wait({work, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if not work.done():
+            raise ClientDisconnected()
+        return work.result()
+    finally:
+        watcher.cancel()
+        work.cancel()
+
+
+def _user_id(request):
+    """The X-User-ID header or the client address, as DataStorage.get_user_id_from_request"""
+    user_id = request.headers.get('X-User-ID', request.client.host if request.client else None)
+    return user_id or 'anonymous'
+
+
+def _settings(request):
+    """(api_key, provider, model) from the request headers"""
+    headers = request.headers
+    return headers.get('X-API-Key', ''), headers.get('X-Provider', 'OpenRouter'), headers.get('X-Model', 'deepseek/deepseek-r1')
+
+
+def _error_response(message, status_code):
+    return JSONResponse({'error': message}, status_code)
+
+
+def _retry_later_response(error, status_code):
+    """Error response with a Retry-After hint (open circuit, exhausted keys, rate limit or budget)"""
+    return JSONResponse({'error': str(error)}, status_code, headers={'Retry-After': str(int(error.retry_after) + 1)})
+
+
+async def chat(request):
+    # Clients that ask for an event stream get the streaming variant
+    if parse_accept_header(request.headers.get('Accept'), MIMEAccept).best == 'text/event-stream':
+        return await chat_stream(request)
+
+    api_key, provider, model = _settings(request)
+    try:
+        data = await request.json()
+        user_id = _user_id(request)
+        timestamp = request.headers.get('X-Timestamp', data.get('timestamp'))
+        route = await _offload(chat_api._chat_route, user_id, provider, api_key, model, request.headers)
+        if route is None:
+            return _error_response('API key is required. Please configure it in Settings.', 400)
+        chat_api.usage_limiter.admit_user(user_id)
+        use_cache = chat_api._response_cache_enabled(request.headers)
+        return JSONResponse(await _cancel_on_disconnect(request, _answer_chat(user_id, data, route, timestamp, use_cache)))
+
+    except ClientDisconnected:
+        return _error_response('Client disconnected', 499)
+    except InvalidFallbackRoute as e:
+        return _error_response(str(e), 400)
+    except CircuitOpenError as e:
+        return _retry_later_response(e, 503)
+    except (NoKeyAvailable, RateLimited, BudgetExceeded) as e:
+        return _retry_later_response(e, 429)
+    except UpstreamError as e:
+        return _error_response(str(e), 500)
+    except requests.Timeout:
+        return _error_response(f'{provider} API timed out', 504)
+    except Exception as e:
+        return _error_response(str(e), 500)
+
+
+async def _answer_chat(user_id, data, route, timestamp, use_cache):
+    """Answer one chat message and save it to history; returns the response body"""
+    provider, model = route[0].provider, route[0].model
+    user_message = data.get('message', '')
+    subject = data.get('subject', '')
+    grade = data.get('grade', '')
+    conversation = await _offload(chat_api._prepare_conversation, user_id, data, model, subject, grade, user_message)
+
+    cache_key = None
+    if use_cache and conversation['turn_count'] == 0:
+        cache_key = request_fingerprint(provider, model, subject, grade, user_message)
+    cached = await _offload(chat_api.response_cache.get, cache_key) if cache_key else None
+    if cached is not None:
+        await _offload(chat_api._save_exchange, user_id, data, conversation, user_message, cached['response'], timestamp)
+        return dict(chat_api._cached_response_data(cached), conversation_id=conversation['id'])
+
+    # Follow-up questions depend on their own history, so they always go upstream
+    call = partial(_routed_chat, route, conversation['messages'], (user_id, subject))
+    if conversation['turn_count'] == 0:
+        flight_key = request_fingerprint(provider, model, subject, grade, user_message)
+        (ai_message, usage_info, routing), shared = await chat_flights.do(flight_key, call)
+    else:
+        (ai_message, usage_info, routing), shared = await call(), False
+
+    if cache_key and not shared:
+        await _offload(chat_api.response_cache.put, cache_key, {'response': ai_message, 'usage': usage_info})
+    await _offload(chat_api._save_exchange, user_id, data, conversation, user_message, ai_message, timestamp,
+                   None if shared else usage_info)
+    return chat_api._answer_response(conversation['id'], ai_message, usage_info, routing, shared)
+
+
+async def _routed_chat(route, messages, account):
+    """Answer along the route, hedging and failing over when it has fallbacks; returns (ai_message, usage_info, routing)"""
+    if len(route) == 1:
+        return await _complete_chat(route[0], messages, account) + (None,)
+
+    (ai_message, usage_info), routing = await chat_api.chat_router.run_async(
+        route, lambda attempt: _complete_chat(attempt.target, messages, account, hedged=True)
+    )
+    return ai_message, usage_info, routing
+
+
+async def _complete_chat(target, messages, account, hedged=False):
+    """Call the target once, recording usage to account=(user_id, subject); returns (ai_message, usage_info)"""
+    provider = target.provider
+    payload = chat_api._build_chat_payload(provider, target.model, messages)
+
+    async def send(api_key, max_retries):
+        # Hedged attempts fail over instead of retrying
+        return await provider_client.chat_completion(provider, api_key, payload,
+                                                     max_retries=0 if hedged else max_retries)
+
+    async def call():
+        response, api_key = await _send_with_key(target, send)
+        if response.status != 200:
+            response.close()
+            raise UpstreamError(provider, response.status)
+        return response, api_key
+
+    # Fails fast with CircuitOpenError while this provider/model is unhealthy
+    response, api_key = await chat_api.chat_breakers.call_async(provider, target.model, call)
+    result = await response.json(content_type=None)
+    ai_message = chat_api._extract_ai_message(provider, result)
+
+    usage_info = chat_api._extract_usage(provider, result.get('usage'))
+    chat_api._record_usage(account, target, api_key, result.get('usage'), usage_info)
+    return ai_message, usage_info
+
+
+async def _send_with_key(target, send):
+    """Await send(api_key, max_retries) with the target's key, rotating through its pool past 429s; returns (response, api_key)"""
+    if not target.key_pool:
+        chat_api.usage_limiter.admit_key(target.api_key)
+        return await send(target.api_key, None), target.api_key
+
+    tried = []
+    while True:
+        key = chat_api.api_key_pool.acquire(target.provider, target.key_pool, exclude=tried)
+        tried.append(key.api_key)
+        more_keys = len(tried) < len(target.key_pool)
+
+        # With other keys left, a 429 moves on to the next key rather than retrying this one
+        response = await send(key.api_key, 0 if more_keys else None)
+        chat_api.api_key_pool.observe(key.api_key, response.status, response.headers)
+        if response.status == 429 and more_keys:
+            response.close()
+            continue
+        return response, key.api_key
+
+
+async def chat_stream(request):
+    """Stream the AI answer token by token as Server-Sent Events"""
+    api_key, provider, model = _settings(request)
+    try:
+        data = await request.json()
+        user_message = data.get('message', '')
+        subject = data.get('subject', '')
+        grade = data.get('grade', '')
+
+        user_id = _user_id(request)
+        route = await _offload(chat_api._chat_route, user_id, provider, api_key, model, request.headers)
+        if route is None:
+            return _error_response('API key is required. Please configure it in Settings.', 400)
+        chat_api.usage_limiter.admit_user(user_id)
+        timestamp = request.headers.get('X-Timestamp', data.get('timestamp'))
+
+        conversation = await _offload(chat_api._prepare_conversation, user_id, data, model, subject, grade, user_message)
+
+        cache_key = chat_api._response_cache_key(provider, model, subject, grade, user_message, conversation,
+                                                 request.headers)
+        cached = await _offload(chat_api.response_cache.get, cache_key) if cache_key else None
+        if cached is not None:
+            await _offload(chat_api._save_exchange, user_id, data, conversation, user_message, cached['response'], timestamp)
+            return StreamingResponse(chat_api._replay_cached_stream(cached, conversation['id']),
+                                     media_type='text/event-stream', headers=SSE_HEADERS)
+
+        try:
+            response, target, used_key = await _cancel_on_disconnect(request, _open_stream(route, conversation['messages']))
+        except CircuitOpenError as e:
+            return _retry_later_response(e, 503)
+        except (NoKeyAvailable, RateLimited) as e:
+            return _retry_later_response(e, 429)
+        except UpstreamError as e:
+            return _error_response(str(e), 500)
+
+        # The server cancels the relay, closing the upstream stream, if the client disconnects
+        return StreamingResponse(
+            _relay_stream(response, target, used_key, user_id, data, conversation, user_message, timestamp, cache_key),
+            media_type='text/event-stream',
+            headers=SSE_HEADERS,
+        )
+    except ClientDisconnected:
+        return _error_response('Client disconnected', 499)
+    except InvalidFallbackRoute as e:
+        return _error_response(str(e), 400)
+    except (RateLimited, BudgetExceeded) as e:
+        return _retry_later_response(e, 429)
+    except requests.Timeout:
+        return _error_response(f'{provider} API timed out', 504)
+    except Exception as e:
+        return _error_response(str(e), 500)
+
+
+async def _open_stream(route, messages):
+    """Open a streaming completion, failing over along the route before the first byte; returns (response, target, api_key)"""
+    for index, target in enumerate(route):
+        last_target = index == len(route) - 1
+        payload = chat_api._build_stream_payload(target, messages)
+
+        async def send(api_key, max_retries):
+            return await provider_client.chat_completion(
+                target.provider, api_key, payload, stream=True, max_retries=max_retries if last_target else 0
+            )
+
+        async def call():
+            response, api_key = await _send_with_key(target, send)
+            if response.status != 200:
+                response.close()
+                raise UpstreamError(target.provider, response.status)
+            return response, api_key
+
+        try:
+            response, api_key = await chat_api.chat_breakers.call_async(target.provider, target.model, call)
+        except Exception as e:
+            if last_target or not is_failover_error(e):
+                raise
+            chat_api.chat_router.record_failover()
+            continue
+        return response, target, api_key
+
+
+async def _relay_stream(response, target, api_key, user_id, data, conversation, user_message, timestamp, cache_key=None):
+    """Relay upstream deltas as SSE events, then save the assembled answer"""
+    provider = target.provider
+    parts = []
+    usage_data = {}
+    try:
+        async for raw_line in response.content:
+            line = raw_line.decode('utf-8').strip()
+            if not line or not line.startswith('data:'):
+                continue
+            chunk = line[len('data:'):].strip()
+            if chunk == '[DONE]':
+                break
+
+            event = json.loads(chunk)
+            delta = chat_api._extract_stream_delta(provider, event, usage_data)
+            if delta:
+                parts.append(delta)
+                yield chat_api._sse_event({'delta': delta})
+
+        ai_message = ''.join(parts)
+        usage_info = chat_api._extract_usage(provider, usage_data)
+        chat_api._record_usage((user_id, data.get('subject', '')), target, api_key, usage_data, usage_info)
+        await _offload(chat_api._save_exchange, user_id, data, conversation, user_message, ai_message, timestamp, usage_info)
+
+        # The client already assembled the text from the deltas
+        done_data = {'conversation_id': conversation['id']}
+        if usage_info:
+            done_data['usage'] = usage_info
+        if cache_key:
+            await _offload(chat_api.response_cache.put, cache_key, {'response': ai_message, 'usage': usage_info})
+        yield chat_api._sse_event(done_data, event='done')
+    except Exception as e:
+        yield chat_api._sse_event({'error': str(e)}, event='error')
+    finally:
+        response.close()
+
+
+def _timed(rule, endpoint):
+    """Record the route's latency and status like the Flask request hooks do"""
+    async def timed_endpoint(request):
+        started = time.perf_counter()
+        response = await endpoint(request)
+        chat_api.HTTP_SECONDS.observe(time.perf_counter() - started, request.method, rule)
+        chat_api.HTTP_RESPONSES.inc(1, request.method, rule, response.status_code)
+        return response
+    return timed_endpoint
+
+
+def _collect_async_metrics():
+    """Gauges of the asyncio mode's own upstream client and coalescing"""
+    families = stats_families('chat_async_single_flight', chat_flights.stats(), 'Coalesced chat calls (asyncio mode)')
+    samples = {}
+    for endpoint, counters in provider_client.stats().items():
+        for field, value in counters.items():
+            samples.setdefault(field, []).append(('', {'endpoint': endpoint}, value))
+    families += [(f'chat_async_upstream_{field}', 'gauge', f'Upstream requests (asyncio mode): {field}', field_samples)
+                 for field, field_samples in samples.items()]
+    return families
+
+
+REGISTRY.register_collector(_collect_async_metrics)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    yield
+    await provider_client.aclose()
+    storage_executor.shutdown(wait=True)
+
+
+app = Starlette(
+    routes=[
+        Route('/api/chat', _timed('/api/chat', chat), methods=['POST']),
+        Route('/api/chat/stream', _timed('/api/chat/stream', chat_stream), methods=['POST']),
+        Mount('/', app=WSGIMiddleware(chat_api.app, workers=ASYNC_WSGI_WORKERS)),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan,
+)
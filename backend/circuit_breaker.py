@@ -0,0 +1,218 @@
+"""
+Circuit breakers for upstream AI calls, one per (provider, model).
+
+Each breaker keeps a rolling window of recent calls. When enough of them
+failed, or were slow, the breaker opens and calls fail fast instead of tying
+up a worker until the provider times out. After a cool-down it goes half-open
+and lets a few probe calls through: if they succeed it closes again, and if
+one fails it re-opens.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import requests
+
+from provider_client import UpstreamError
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class AttemptCancelled(Exception):
+    """The attempt lost the race and was cancelled"""
+
+
+class CircuitOpenError(Exception):
+    """The breaker for this provider/model is open, so the call was not attempted"""
+
+    def __init__(self, provider: str, model: str, retry_after: float):
+        super().__init__(f'{provider} API is temporarily unavailable for {model}, retry in {int(retry_after) + 1}s')
+        self.provider = provider
+        self.model = model
+        self.retry_after = retry_after
+
+
+def is_breaker_failure(error: Exception) -> bool:
+    """Failures that point at the provider: 5xx, timeouts and connection errors (not 4xx)"""
+    if isinstance(error, UpstreamError):
+        return error.status_code >= 500
+    return isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+
+class CircuitBreaker:
+    def __init__(self, provider: str, model: str, window: float, min_calls: int, error_rate: float,
+                 slow_call: float, slow_rate: float, open_seconds: float, half_open_probes: int):
+        self.provider = provider
+        self.model = model
+        self.window = window
+        self.min_calls = min_calls
+        self.error_rate = error_rate
+        self.slow_call = slow_call
+        self.slow_rate = slow_rate
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self.rejected = 0
+        self._calls = deque()  # (finished_at, failed, seconds)
+        self._probes_started = 0
+        self._probes_passed = 0
+        self._lock = threading.Lock()
+
+    def _trim(self, now: float):
+        while self._calls and self._calls[0][0] < now - self.window:
+            self._calls.popleft()
+
+    def _open(self, now: float):
+        self.state = OPEN
+        self.opened_at = now
+        self.times_opened += 1
+        self._calls.clear()
+
+    def before_call(self) -> bool:
+        """Admit a call or raise CircuitOpenError; returns True when the call is a half-open probe"""
+        now = time.monotonic()
+        with self._lock:
+            if self.state == OPEN and now - self.opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+                self._probes_started = 0
+                self._probes_passed = 0
+
+            if self.state == CLOSED:
+                return False
+            if self.state == HALF_OPEN and self._probes_started < self.half_open_probes:
+                self._probes_started += 1
+                return True
+
+            self.rejected += 1
+            retry_after = max(self.opened_at + self.open_seconds - now, 0)
+            raise CircuitOpenError(self.provider, self.model, retry_after)
+
+    def after_call(self, probe: bool, failed: bool, seconds: float):
+        """Record the outcome of an admitted call"""
+        now = time.monotonic()
+        with self._lock:
+            if probe:
+                if self.state != HALF_OPEN:
+                    return
+                if failed:
+                    self._open(now)
+                else:
+                    self._probes_passed += 1
+                    if self._probes_passed >= self.half_open_probes:
+                        self.state = CLOSED
+                        self._calls.clear()
+                return
+
+            if self.state != CLOSED:
+                return
+            self._calls.append((now, failed, seconds))
+            self._trim(now)
+            calls = len(self._calls)
+            if calls < self.min_calls:
+                return
+            failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+            slow = sum(1 for _, _, call_seconds in self._calls if call_seconds >= self.slow_call)
+            if failures / calls >= self.error_rate or slow / calls >= self.slow_rate:
+                self._open(now)
+
+    def release(self, probe: bool):
+        """End an admitted call that was abandoned before it had an outcome"""
+        with self._lock:
+            if probe and self.state == HALF_OPEN and self._probes_started > self._probes_passed:
+                self._probes_started -= 1  # let another call probe in its place
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            self._trim(now)
+            calls = len(self._calls)
+            failures = sum(1 for _, failed, _ in self._calls if failed)
+            slow = sum(1 for _, _, seconds in self._calls if seconds >= self.slow_call)
+            snapshot = {
+                'provider': self.provider,
+                'model': self.model,
+                'state': self.state,
+                'window_calls': calls,
+                'error_rate': round(failures / calls, 4) if calls else 0.0,
+                'slow_rate': round(slow / calls, 4) if calls else 0.0,
+                'times_opened': self.times_opened,
+                'rejected': self.rejected,
+            }
+            if self.state == OPEN:
+                snapshot['retry_after'] = round(max(self.opened_at + self.open_seconds - now, 0), 1)
+            return snapshot
+
+
+class CircuitBreakers:
+    def __init__(self, window: Optional[float] = None, min_calls: Optional[int] = None,
+                 error_rate: Optional[float] = None, slow_call: Optional[float] = None,
+                 slow_rate: Optional[float] = None, open_seconds: Optional[float] = None,
+                 half_open_probes: Optional[int] = None):
+        env = os.environ.get
+        self.settings = {
+            'window': window if window is not None else float(env('CIRCUIT_WINDOW', 60)),
+            'min_calls': min_calls if min_calls is not None else int(env('CIRCUIT_MIN_CALLS', 10)),
+            'error_rate': error_rate if error_rate is not None else float(env('CIRCUIT_ERROR_RATE', 0.5)),
+            'slow_call': slow_call if slow_call is not None else float(env('CIRCUIT_SLOW_CALL', 60)),
+            'slow_rate': slow_rate if slow_rate is not None else float(env('CIRCUIT_SLOW_RATE', 0.8)),
+            'open_seconds': open_seconds if open_seconds is not None else float(env('CIRCUIT_OPEN_SECONDS', 30)),
+            'half_open_probes': half_open_probes if half_open_probes is not None else int(env('CIRCUIT_HALF_OPEN_PROBES', 2)),
+        }
+        self._breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, provider: str, model: str) -> CircuitBreaker:
+        key = (provider, model)
+        with self._lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = self._breakers[key] = CircuitBreaker(provider, model, **self.settings)
+            return breaker
+
+    def call(self, provider: str, model: str, fn: Callable[[], Any]) -> Any:
+        """Run fn behind the (provider, model) breaker"""
+        breaker = self.get(provider, model)
+        probe = breaker.before_call()
+        started = time.monotonic()
+        try:
+            result = fn()
+        except AttemptCancelled:
+            # Lost hedge: says nothing about the provider, so only free the probe slot
+            breaker.release(probe)
+            raise
+        except Exception as e:
+            breaker.after_call(probe, is_breaker_failure(e), time.monotonic() - started)
+            raise
+        breaker.after_call(probe, False, time.monotonic() - started)
+        return result
+
+    async def call_async(self, provider: str, model: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Await fn() behind the (provider, model) breaker"""
+        breaker = self.get(provider, model)
+        probe = breaker.before_call()
+        started = time.monotonic()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            # Client gone or lost hedge: says nothing about the provider, so only free the probe slot
+            breaker.release(probe)
+            raise
+        except Exception as e:
+            breaker.after_call(probe, is_breaker_failure(e), time.monotonic() - started)
+            raise
+        breaker.after_call(probe, False, time.monotonic() - started)
+        return result
+
+    def states(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {f'{breaker.provider} {breaker.model}': breaker.snapshot() for breaker in breakers}
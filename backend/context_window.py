@@ -0,0 +1,104 @@
+"""
+Token-budgeted context window for multi-turn conversations.
+
+The upstream request is built from the system prompt, the most recent turns
+that fit the model's token budget, and the new question. Turns that no longer
+fit are collapsed into a short extractive rolling summary. The summary is
+extended incrementally and cached on the conversation record, so it is not
+rebuilt from the whole transcript on every message.
+"""
+
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+# Share of the budget reserved for the rolling summary once turns get dropped
+SUMMARY_SHARE = 0.25
+SUMMARY_QUESTION_CHARS = 100
+SUMMARY_ANSWER_CHARS = 160
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token plus message overhead)"""
+    return len(text) // 4 + 4
+
+
+def _first_sentence(text: str, limit: int) -> str:
+    text = ' '.join(text.split())
+    for end in ('. ', '? ', '! ', '\n'):
+        position = text.find(end)
+        if 0 < position < limit:
+            return text[:position + 1]
+    return text[:limit]
+
+
+def summarize_turn(turn: Dict[str, Any]) -> str:
+    """One summary line for an exchange"""
+    question = _first_sentence(turn.get('user', ''), SUMMARY_QUESTION_CHARS)
+    answer = _first_sentence(turn.get('bot', ''), SUMMARY_ANSWER_CHARS)
+    return f'- Student asked: {question} Tutor explained: {answer}'
+
+
+class ContextWindow:
+    def __init__(self, default_budget: Optional[int] = None, model_budgets: Optional[Dict[str, int]] = None):
+        self.default_budget = default_budget if default_budget is not None else int(
+            os.environ.get('CONTEXT_TOKEN_BUDGET', 6000))
+        if model_budgets is None:
+            # e.g. CONTEXT_TOKEN_BUDGETS='{"openai/gpt-4o-mini": 12000}'
+            model_budgets = json.loads(os.environ.get('CONTEXT_TOKEN_BUDGETS', '{}'))
+        self.model_budgets = model_budgets
+
+    def budget_for(self, model: str) -> int:
+        return int(self.model_budgets.get(model, self.default_budget))
+
+    def _fit_recent(self, turns: List[Dict[str, Any]], available: int) -> int:
+        """Number of most recent turns whose messages fit in `available` tokens"""
+        used = 0
+        count = 0
+        for turn in reversed(turns):
+            used += estimate_tokens(turn.get('user', '')) + estimate_tokens(turn.get('bot', ''))
+            if used > available:
+                break
+            count += 1
+        return count
+
+    def _rolling_summary(self, turns: List[Dict[str, Any]], collapsed: int,
+                         cached: Optional[Dict[str, Any]], budget: int) -> Dict[str, Any]:
+        """Summary of the first `collapsed` turns, extending the cached one where possible"""
+        if cached and 0 < cached.get('turns', 0) <= collapsed:
+            lines = cached.get('text', '').split('\n')
+            start = cached['turns']
+        else:
+            lines = []
+            start = 0
+        lines.extend(summarize_turn(turn) for turn in turns[start:collapsed])
+
+        # Keep the most recent lines that fit the summary budget
+        while len(lines) > 1 and estimate_tokens('\n'.join(lines)) > budget:
+            lines.pop(0)
+        return {'turns': collapsed, 'text': '\n'.join(lines)}
+
+    def build(self, model: str, system_prompt: str, turns: List[Dict[str, Any]], user_message: str,
+              cached_summary: Optional[Dict[str, Any]] = None) -> Tuple[List[Dict[str, str]], Optional[Dict[str, Any]]]:
+        """Return (messages, rolling_summary) for the next upstream request"""
+        budget = self.budget_for(model)
+        available = budget - estimate_tokens(system_prompt) - estimate_tokens(user_message)
+
+        recent = self._fit_recent(turns, available)
+        rolling_summary = None
+        if recent < len(turns):
+            summary_budget = int(budget * SUMMARY_SHARE)
+            recent = self._fit_recent(turns, available - summary_budget)
+            rolling_summary = self._rolling_summary(turns, len(turns) - recent, cached_summary, summary_budget)
+
+        messages = [{'role': 'system', 'content': system_prompt}]
+        if rolling_summary:
+            messages.append({
+                'role': 'system',
+                'content': 'Summary of the earlier part of this conversation:\n' + rolling_summary['text'],
+            })
+        for turn in turns[len(turns) - recent:]:
+            messages.append({'role': 'user', 'content': turn.get('user', '')})
+            messages.append({'role': 'assistant', 'content': turn.get('bot', '')})
+        messages.append({'role': 'user', 'content': user_message})
+        return messages, rolling_summary
@@ -0,0 +1,188 @@
+"""
+Per-user conversation view with a sorted timestamp index.
+
+Keeps a user's conversations keyed by ID plus an index of
+(timestamp, conversation_id) pairs kept in sorted order as conversations are
+saved and deleted, so listings and pages never need to re-sort the history. The full-text
+search index is built the first time the user searches and is then kept up
+to date by the same saves and deletes.
+"""
+
+import base64
+import bisect
+import json
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from search_index import SearchIndex, conversation_texts, turn_texts
+
+SNIPPET_LENGTH = 120
+
+
+def timestamp_key(conversation_data: Dict[str, Any]) -> str:
+    """Sortable form of a conversation timestamp"""
+    timestamp = conversation_data.get('timestamp')
+    return '' if timestamp is None else str(timestamp)
+
+
+def build_summary(conversation_id: str, conversation_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Compact listing entry for a conversation"""
+    subject = conversation_data.get('subject', '')
+    grade = conversation_data.get('grade', '')
+    messages = conversation_data.get('messages') or []
+    last_message = conversation_data.get('last_message') or {}
+
+    # Latest question asked in this conversation
+    question = last_message.get('user', '')
+    for message in reversed(messages):
+        if message.get('type') == 'user':
+            question = message.get('message', '')
+            break
+
+    usage = conversation_data.get('usage') or {}
+    return {
+        'conversation_id': conversation_id,
+        'subject': subject,
+        'grade': grade,
+        'timestamp': conversation_data.get('timestamp'),
+        'title': f'{subject} - Grade {grade}' if subject else 'Conversation',
+        'snippet': question[:SNIPPET_LENGTH],
+        'message_count': len(messages) if messages else 2 * conversation_data.get('turn_count', 1 if last_message else 0),
+        'input_tokens': usage.get('input_tokens', 0),
+        'output_tokens': usage.get('output_tokens', 0),
+        'total_tokens': usage.get('total_tokens', 0),
+    }
+
+
+def encode_cursor(entry: Tuple[str, str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(entry)).encode('utf-8')).decode('ascii')
+
+
+class InvalidCursor(ValueError):
+    """A page cursor that was not produced by encode_cursor"""
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        timestamp, conversation_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (TypeError, ValueError):
+        raise InvalidCursor('Invalid history cursor')
+    return str(timestamp), str(conversation_id)
+
+
+class ConversationView:
+    def __init__(self, conversations: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.conversations: Dict[str, Dict[str, Any]] = {}
+        self._index: List[Tuple[str, str]] = []  # sorted (timestamp, conversation_id)
+        self._search: Optional[SearchIndex] = None
+        self._search_lock = threading.Lock()
+
+        for conversation_id, conversation_data in (conversations or {}).items():
+            self.conversations[conversation_id] = conversation_data
+            self._index.append((timestamp_key(conversation_data), conversation_id))
+        self._index.sort()
+
+    def __len__(self) -> int:
+        return len(self.conversations)
+
+    def get(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        return self.conversations.get(conversation_id)
+
+    def put(self, conversation_id: str, conversation_data: Dict[str, Any]):
+        with self._search_lock:
+            existing = self._remove(conversation_id)
+            self.conversations[conversation_id] = conversation_data
+            bisect.insort(self._index, (timestamp_key(conversation_data), conversation_id))
+            if self._search is not None:
+                self._index_put(conversation_id, conversation_data, existing)
+
+    def _index_put(self, conversation_id: str, conversation_data: Dict[str, Any],
+                   existing: Optional[Dict[str, Any]]):
+        subject = conversation_data.get('subject', '')
+        grade = conversation_data.get('grade', '')
+        timestamp = timestamp_key(conversation_data)
+        # Server-saved records only carry their latest exchange, so a new exchange extends the
+        # indexed text; a record with the full message list replaces it
+        if (not conversation_data.get('messages') and existing is not None and conversation_id in self._search
+                and conversation_data.get('turn_count', 0) > existing.get('turn_count', 0)):
+            self._search.extend(conversation_id, turn_texts(conversation_data.get('last_message') or {}),
+                                subject, grade, timestamp)
+        else:
+            self._search.add(conversation_id, conversation_texts(conversation_data), subject, grade, timestamp)
+
+    def _remove(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        existing = self.conversations.pop(conversation_id, None)
+        if existing is None:
+            return None
+        entry = (timestamp_key(existing), conversation_id)
+        position = bisect.bisect_left(self._index, entry)
+        if position < len(self._index) and self._index[position] == entry:
+            del self._index[position]
+        return existing
+
+    def delete(self, conversation_id: str) -> bool:
+        with self._search_lock:
+            if self._search is not None:
+                self._search.remove(conversation_id)
+            return self._remove(conversation_id) is not None
+
+    def clear(self):
+        with self._search_lock:
+            self.conversations.clear()
+            self._index.clear()
+            if self._search is not None:
+                self._search.clear()
+
+    def search_index(self, load_turns: Callable[[str], List[Dict[str, Any]]]) -> SearchIndex:
+        """The search index, built on first use; `load_turns` supplies transcripts of multi-turn conversations"""
+        with self._search_lock:
+            if self._search is None:
+                search = SearchIndex()
+                for conversation_id, conversation_data in self.conversations.items():
+                    texts = conversation_texts(conversation_data)
+                    if not conversation_data.get('messages') and conversation_data.get('turn_count', 0) > 1:
+                        texts = [text for turn in load_turns(conversation_id) for text in turn_texts(turn)] or texts
+                    search.add(conversation_id, texts, conversation_data.get('subject', ''),
+                               conversation_data.get('grade', ''), timestamp_key(conversation_data))
+                self._search = search
+            return self._search
+
+    def search(self, load_turns: Callable[[str], List[Dict[str, Any]]], query: str, limit: int = 20,
+               subject: Optional[str] = None, grade: Optional[str] = None) -> Dict[str, Any]:
+        """Best-matching conversations for a query, as summaries with a snippet of the match"""
+        index = self.search_index(load_turns)
+        with self._search_lock:
+            total, hits = index.search(query, limit, subject=subject, grade=grade)
+            results = [dict(self.summary(hit['conversation_id']), **hit) for hit in hits]
+        return {'query': query, 'total': total, 'results': results}
+
+    def newest_first(self) -> Iterator[Dict[str, Any]]:
+        for _, conversation_id in reversed(self._index):
+            yield self.conversations[conversation_id]
+
+    def summary(self, conversation_id: str) -> Dict[str, Any]:
+        """Stored summary of a conversation (built on the fly for records saved before summaries existed)"""
+        conversation_data = self.conversations[conversation_id]
+        summary = conversation_data.get('summary')
+        if summary is None:
+            summary = build_summary(conversation_id, conversation_data)
+            conversation_data['summary'] = summary
+        return summary
+
+    def page(self, limit: int, cursor: Optional[str] = None,
+             before: Optional[str] = None) -> Dict[str, Any]:
+        """Newest-first page of summaries older than the cursor or `before` timestamp"""
+        if cursor:
+            end = bisect.bisect_left(self._index, decode_cursor(cursor))
+        elif before is not None:
+            end = bisect.bisect_left(self._index, (str(before),))
+        else:
+            end = len(self._index)
+
+        start = max(end - limit, 0)
+        entries = self._index[start:end]
+        summaries = [self.summary(conversation_id) for _, conversation_id in reversed(entries)]
+        return {
+            'conversations': summaries,
+            'next_cursor': encode_cursor(entries[0]) if start > 0 and entries else None,
+        }
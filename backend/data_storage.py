@@ -1,71 +1,287 @@
 """
 Data persistence layer for the Real Life Applications backend.
-Handles storage of API keys and chat history using JSON files.
+Handles storage of API keys and chat history through a pluggable storage
+engine (JSON files by default, or an indexed SQLite database).
 """
 
-import json
 import os
 import threading
+import time
 from datetime import datetime
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterator, List, Optional, Any, Callable, Tuple, Union
+
+from conversation_view import ConversationView, InvalidCursor, build_summary
+from history_archive import HistoryArchive, RetentionPolicy
+from metrics import REGISTRY, timed_acquire
+from safe_files import LOCK_WAIT
+from storage_backends import StorageBackend, create_backend
+from storage_cache import UserViewCache
+from write_behind import PendingWrites, WriteBehindQueue
+
+DURABILITY_MODES = ('sync', 'batched', 'async')
+IMPORT_CONFLICT_MODES = ('skip', 'replace', 'rename')
+
+STORAGE_ERRORS = REGISTRY.counter('storage_errors', 'Storage operations that failed and were logged', ('operation',))
 
 class DataStorage:
-    def __init__(self, data_dir: str = 'data'):
+    def __init__(self, data_dir: str = 'data', backend: Union[str, StorageBackend, None] = None,
+                 cache_max_users: Optional[int] = None, durability: Optional[str] = None,
+                 retention: Optional[RetentionPolicy] = None):
         self.data_dir = data_dir
         self._lock = threading.Lock()
         self._ensure_data_dir()
 
-        # File paths
+        # File paths used by the JSON engine
         self.api_keys_file = os.path.join(data_dir, 'api_keys.json')
         self.chat_history_file = os.path.join(data_dir, 'chat_history.json')
 
-        # Initialize data files if they don't exist
-        self._init_data_files()
+        # Select the storage engine (STORAGE_BACKEND=json|sqlite)
+        if backend is None:
+            backend = os.environ.get('STORAGE_BACKEND', 'json')
+        if isinstance(backend, str):
+            backend = create_backend(backend, data_dir)
+        self.backend = backend
+
+        # Parsed per-user views kept in memory (STORAGE_CACHE_MAX_USERS=0 disables)
+        if cache_max_users is None:
+            cache_max_users = int(os.environ.get('STORAGE_CACHE_MAX_USERS', 1000))
+        self._cache = UserViewCache(cache_max_users)
+
+        # How chat history writes reach storage (HISTORY_DURABILITY=sync|batched|async):
+        # sync writes before returning, batched waits for a shared group commit, async returns at once
+        self.durability = (durability or os.environ.get('HISTORY_DURABILITY', 'sync')).lower()
+        if self.durability not in DURABILITY_MODES:
+            raise ValueError(f"Unknown history durability '{self.durability}'. Choose one of: {', '.join(DURABILITY_MODES)}")
+        self._history_writes = None
+        if self.durability != 'sync':
+            self._history_writes = WriteBehindQueue(
+                self._commit_history,
+                flush_interval=float(os.environ.get('HISTORY_FLUSH_INTERVAL', 0.05)),
+                max_batch=int(os.environ.get('HISTORY_FLUSH_MAX_BATCH', 256)),
+            )
+
+        # Cold conversations are moved to compressed archive segments by a background compactor
+        self.retention = retention if retention is not None else RetentionPolicy()
+        self.archive = HistoryArchive(os.path.join(data_dir, 'archive'))
+        self.compactions = 0
+        self.archived = 0
+        self.last_compaction: Optional[str] = None
+        compact_interval = float(os.environ.get('HISTORY_COMPACT_INTERVAL', 3600))
+        if self.retention.enabled and compact_interval > 0:
+            threading.Thread(target=self._compact_loop, args=(compact_interval,),
+                             name='history-compactor', daemon=True).start()
 
     def _ensure_data_dir(self):
         """Ensure the data directory exists"""
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
 
-    def _init_data_files(self):
-        """Initialize data files with empty structures if they don't exist"""
-        # API keys file
-        if not os.path.exists(self.api_keys_file):
-            with open(self.api_keys_file, 'w') as f:
-                json.dump({}, f)
+    def _read_view(self, kind: str, user_id: str, loader: Callable[[str], Any]) -> Any:
+        """Return a user's parsed data, loading it from the backend only when the cache is stale"""
+        token = self.backend.version(kind)
+        view = self._cache.get(kind, user_id, token)
+        if view is None:
+            view = loader(user_id)
+            self._cache.put(kind, user_id, token, view)
+        return view
+
+    def _recorded_span(self, kind: str, writes: List[Tuple[str, tuple, tuple]]) -> Tuple[Optional[tuple], tuple]:
+        """(before, after) version tokens around our writes of a kind; before is None if another process wrote in between"""
+        span = [(before, after) for write_kind, before, after in writes if write_kind == kind]
+        if not span:
+            token = self.backend.version(kind)
+            return token, token
+        before = span[0][0]
+        for (_, previous_after), (next_before, _) in zip(span, span[1:]):
+            if next_before != previous_after:
+                before = None
+        return before, span[-1][1]
+
+    def _write(self, kind: str, user_id: str, write: Callable[[], Any], update: Callable[[Any], None]) -> Any:
+        """Run a backend write and apply the same change to the cached view"""
+        with timed_acquire(self._lock, LOCK_WAIT, 'data_storage'):
+            with self.backend.record_writes() as writes:
+                result = write()
+            before, after = self._recorded_span(kind, writes)
+            self._cache.write_through(kind, user_id, before, after, update)
+            return result
+
+    def _write_users(self, kind: str, write: Callable[[], Any], updates: Dict[str, Callable[[Any], None]]) -> Any:
+        """Run one backend write covering several users and apply each user's change to their cached view"""
+        with timed_acquire(self._lock, LOCK_WAIT, 'data_storage'):
+            with self.backend.record_writes() as writes:
+                result = write()
+            before, after = self._recorded_span(kind, writes)
+            for user_id, update in updates.items():
+                self._cache.write_through(kind, user_id, before, after, update)
+                before = after
+            return result
+
+    def _commit_history(self, users: Dict[str, PendingWrites]):
+        """Commit one batch of queued history writes: transcripts first, then conversation records"""
+        turns = {user_id: pending.turns for user_id, pending in users.items() if pending.turns}
+        if turns:
+            with timed_acquire(self._lock, LOCK_WAIT, 'data_storage'):
+                self.backend.append_turns_batch(turns)
+
+        conversations = {user_id: pending.conversations for user_id, pending in users.items() if pending.conversations}
+        if conversations:
+            self._write_users(
+                StorageBackend.CONVERSATIONS,
+                lambda: self.backend.put_conversations_batch(conversations),
+                {user_id: self._view_update(user_conversations) for user_id, user_conversations in conversations.items()},
+            )
+
+    @staticmethod
+    def _view_update(conversations: Dict[str, Dict[str, Any]]) -> Callable[[ConversationView], None]:
+        def update(view):
+            for conversation_id, conversation_data in conversations.items():
+                view.put(conversation_id, dict(conversation_data))
+        return update
+
+    def _queue_history(self, user_id: str, conversations: Optional[Dict[str, Dict[str, Any]]] = None,
+                       turns: Optional[List[Tuple[str, Dict[str, Any]]]] = None) -> bool:
+        batch = self._history_writes.put(user_id, conversations=conversations, turns=turns)
+        if self.durability == 'batched':
+            return self._history_writes.wait(batch)
+        return True
+
+    def _read_your_writes(self, user_id: str):
+        """Commit a user's queued history writes before reading their history"""
+        if self._history_writes is not None:
+            self._history_writes.flush_user(user_id)
+
+    def flush(self):
+        """Commit every queued history write (called on shutdown)"""
+        if self._history_writes is not None:
+            self._history_writes.flush()
+
+    def get_write_queue_stats(self) -> Optional[Dict[str, int]]:
+        """Counters of the history write-behind queue, or None in sync mode"""
+        if self._history_writes is None:
+            return None
+        return dict(self._history_writes.stats(), durability=self.durability)
+
+    def _compact_loop(self, interval: float):
+        while True:
+            time.sleep(interval)
+            self.compact()
+
+    def compact(self, user_ids: Optional[List[str]] = None) -> int:
+        """Move conversations outside the retention policy into the archive; returns how many moved"""
+        moved = 0
+        for user_id in (user_ids if user_ids is not None else self.backend.list_users()):
+            try:
+                moved += self._compact_user(user_id)
+            except Exception as e:
+                STORAGE_ERRORS.inc(1, 'compact')
+                print(f"Warning: History compaction failed for a user: {e}")
+        self.compactions += 1
+        self.archived += moved
+        self.last_compaction = datetime.now().isoformat()
+        return moved
+
+    def _compact_user(self, user_id: str) -> int:
+        self._read_your_writes(user_id)
+        cold = self.retention.select_cold(self.backend.list_conversations(user_id))
+        if not cold:
+            return 0
+
+        records = []
+        for conversation in cold:
+            record = dict(conversation)
+            turns = self.backend.get_turns(user_id, record['conversation_id'])
+            if turns:
+                record['turns'] = turns
+            records.append(record)
+
+        # Archive first: a crash in between leaves a conversation in both tiers, never in neither
+        self.archive.append(user_id, records)
+        moved: List[str] = []
+        changed: List[str] = []
+
+        def delete_unchanged():
+            # Turns and saves take the same lock, so nothing lands between this check and the delete
+            current = {conversation['conversation_id']: conversation
+                       for conversation in self.backend.list_conversations(user_id)}
+            for record in records:
+                conversation_id = record['conversation_id']
+                snapshot = {key: value for key, value in record.items() if key != 'turns'}
+                if (current.get(conversation_id) == snapshot
+                        and len(self.backend.get_turns(user_id, conversation_id)) == len(record.get('turns') or [])):
+                    moved.append(conversation_id)
+                else:
+                    changed.append(conversation_id)
+            return self.backend.delete_conversations(user_id, moved) if moved else 0
+
+        def update(view):
+            for conversation_id in moved:
+                view.delete(conversation_id)
 
-        # Chat history file
-        if not os.path.exists(self.chat_history_file):
-            with open(self.chat_history_file, 'w') as f:
-                json.dump({}, f)
+        count = self._write(StorageBackend.CONVERSATIONS, user_id, delete_unchanged, update)
+        # Saved to since the snapshot: the hot copy is newer, so drop the archived one
+        for conversation_id in changed:
+            self.archive.delete(user_id, conversation_id)
+        return count
 
-    def _load_json_file(self, file_path: str) -> Dict[str, Any]:
-        """Safely load JSON data from file"""
+    def restore_archived(self, user_id: str, conversation_id: str) -> bool:
+        """Move an archived conversation back to the hot store (before it is continued); False if not archived"""
         try:
-            with open(file_path, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {}
+            record = self.archive.get(user_id, conversation_id)
+            if record is None:
+                return False
+            turns = [(conversation_id, turn) for turn in record.pop('turns', None) or []]
+            record.pop('archived', None)
+
+            def write():
+                if turns:
+                    self.backend.append_turns(user_id, turns)
+                self.backend.put_conversations(user_id, {conversation_id: record})
+
+            # Hot copy first, like compaction: a crash in between leaves both, never neither
+            self._write(StorageBackend.CONVERSATIONS, user_id, write, self._view_update({conversation_id: record}))
+            self.archive.delete(user_id, conversation_id)
+            return True
+        except Exception as e:
+            STORAGE_ERRORS.inc(1, 'restore_archived')
+            print(f"Error restoring archived conversation: {e}")
+            return False
 
-    def _save_json_file(self, file_path: str, data: Dict[str, Any]):
-        """Safely save JSON data to file"""
-        with self._lock:
-            with open(file_path, 'w') as f:
-                json.dump(data, f, indent=2, default=str)
+    def get_compaction_stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.retention.enabled,
+            'runs': self.compactions,
+            'archived': self.archived,
+            'last_run': self.last_compaction,
+        }
+
+    def _user_api_keys(self, user_id: str) -> Dict[str, Any]:
+        return self._read_view(StorageBackend.API_KEYS, user_id, self.backend.get_user_api_keys)
+
+    def _user_conversations(self, user_id: str) -> ConversationView:
+        return self._read_view(
+            StorageBackend.CONVERSATIONS, user_id,
+            lambda uid: ConversationView(self.backend.get_user_conversations(uid)),
+        )
+
+    def history_generation(self, user_id: str) -> Tuple[int, int]:
+        """Token that moves whenever the user's conversations may have changed (taken before reading them)"""
+        self._read_your_writes(user_id)
+        kind = StorageBackend.CONVERSATIONS
+        return self._cache.generation(kind, user_id, self.backend.version(kind))
+
+    def get_cache_stats(self) -> Dict[str, int]:
+        """Hit/miss counters of the in-memory view cache"""
+        return self._cache.stats()
 
     # API Key Management
     def save_api_key(self, user_id: str, key_name: str, provider: str, api_key: str, credit_limit: Optional[float] = None) -> bool:
         """Save an API key with metadata for a user"""
         try:
-            data = self._load_json_file(self.api_keys_file)
-
-            if user_id not in data:
-                data[user_id] = {}
-
             # Create a unique key using provider + key_name
             unique_key = f"{provider}_{key_name}"
 
-            data[user_id][unique_key] = {
+            key_data = {
                 'key_name': key_name,
                 'provider': provider,
                 'api_key': api_key,
@@ -73,9 +289,14 @@ class DataStorage:
                 'updated_at': datetime.now().isoformat()
             }
 
-            self._save_json_file(self.api_keys_file, data)
+            self._write(
+                StorageBackend.API_KEYS, user_id,
+                lambda: self.backend.put_api_key(user_id, unique_key, key_data),
+                lambda view: view.__setitem__(unique_key, dict(key_data)),
+            )
             return True
         except Exception as e:
+            STORAGE_ERRORS.inc(1, 'save_api_key')
             print(f"Error saving API key: {e}")
             return False
 
@@ -86,26 +307,25 @@ class DataStorage:
     def get_api_key(self, user_id: str, provider: str) -> Optional[str]:
         """Get an API key for a user and provider"""
         try:
-            data = self._load_json_file(self.api_keys_file)
-            return data.get(user_id, {}).get(provider, {}).get('api_key')
+            return self._user_api_keys(user_id).get(provider, {}).get('api_key')
         except Exception as e:
+            STORAGE_ERRORS.inc(1, 'get_api_key')
             print(f"Error retrieving API key: {e}")
             return None
 
     def get_all_api_keys(self, user_id: str) -> Dict[str, Any]:
         """Get all API keys for a user"""
         try:
-            data = self._load_json_file(self.api_keys_file)
-            return data.get(user_id, {})
+            return dict(self._user_api_keys(user_id))
         except Exception as e:
+            STORAGE_ERRORS.inc(1, 'get_all_api_keys')
             print(f"Error retrieving API keys: {e}")
             return {}
 
     def get_api_keys_formatted(self, user_id: str) -> List[Dict[str, Any]]:
         """Get all API keys for a user formatted as a list with metadata"""
         try:
-            data = self._load_json_file(self.api_keys_file)
-            user_keys = data.get(user_id, {})
+            user_keys = self._user_api_keys(user_id)
 
             formatted_keys = []
             for unique_key, key_data in user_keys.items():
@@ -137,14 +357,14 @@ class DataStorage:
             formatted_keys.sort(key=lambda x: (x['provider'], x['key_name']))
             return formatted_keys
         except Exception as e:
+            STORAGE_ERRORS.inc(1, 'get_api_keys_formatted')
             print(f"Error retrieving formatted API keys: {e}")
             return []
 
     def get_api_key_by_name(self, user_id: str, key_name: str, provider: str) -> Optional[Dict[str, Any]]:
         """Get a specific API key by name and provider"""
         try:
-            data = self._load_json_file(self.api_keys_file)
-            user_keys = data.get(user_id, {})
+            user_keys = self._user_api_keys(user_id)
             unique_key = f"{provider}_{key_name}"
 
             if unique_key in user_keys:
@@ -154,98 +374,282 @@ class DataStorage:
 
             return None
         except Exception as e:
+            STORAGE_ERRORS.inc(1, 'get_api_key_by_name')
             print(f"Error retrieving API key by name: {e}")
             return None
 
     def delete_api_key(self, user_id: str, provider: str) -> bool:
         """Delete an API key for a user and provider"""
         try:
-            data = self._load_json_file(self.api_keys_file)
-
-            if user_id in data and provider in data[user_id]:
-                del data[user_id][provider]
-
-                # Remove user entry if no keys left
-                if not data[user_id]:
-                    del data[user_id]
-
-                self._save_json_file(self.api_keys_file, data)
-                return True
-            return False
+            return self._write(
+                StorageBackend.API_KEYS, user_id,
+                lambda: self.backend.delete_api_key(user_id, provider),
+                lambda view: view.pop(provider, None),
+            )
         except Exception as e:
+            STORAGE_ERRORS.inc(1, 'delete_api_key')
             print(f"Error deleting API key: {e}")
             return False
 
     # Chat History Management
     def save_chat_history(self, user_id: str, conversation_id: str, conversation_data: Dict[str, Any]) -> bool:
         """Save a chat conversation for a user"""
-        try:
-            data = self._load_json_file(self.chat_history_file)
-
-            if user_id not in data:
-                data[user_id] = {}
+        return self.save_chat_histories(user_id, {conversation_id: conversation_data})
 
+    @staticmethod
+    def _prepare_conversations(conversations: Dict[str, Dict[str, Any]]):
+        for conversation_id, conversation_data in conversations.items():
             # Add/update metadata
             if 'timestamp' not in conversation_data:
                 conversation_data['timestamp'] = datetime.now().isoformat()
 
             conversation_data['conversation_id'] = conversation_id
 
-            # Store by conversation ID
-            data[user_id][conversation_id] = conversation_data
+            # Listing summary is computed once here rather than on every read
+            conversation_data.pop('summary', None)
+            conversation_data['summary'] = build_summary(conversation_id, conversation_data)
+
+    @staticmethod
+    def _without_summary(conversation: Dict[str, Any]) -> Dict[str, Any]:
+        """A stored record as clients see it: the listing summary is internal"""
+        return {key: value for key, value in conversation.items() if key != 'summary'}
+
+    @staticmethod
+    def _prepare_turns(turns: List[Tuple[str, Dict[str, Any]]]):
+        for _, turn in turns:
+            if 'timestamp' not in turn:
+                turn['timestamp'] = datetime.now().isoformat()
 
-            self._save_json_file(self.chat_history_file, data)
+    def save_chat_histories(self, user_id: str, conversations: Dict[str, Dict[str, Any]]) -> bool:
+        """Save several chat conversations for a user in one group write"""
+        try:
+            self._prepare_conversations(conversations)
+            if self._history_writes is not None:
+                return self._queue_history(user_id, conversations=conversations)
+
+            # Store by conversation ID
+            self._write(
+                StorageBackend.CONVERSATIONS, user_id,
+                lambda: self.backend.put_conversations(user_id, conversations),
+                self._view_update(conversations),
+            )
             return True
         except Exception as e:
+            STORAGE_ERRORS.inc(1, 'save_chat_histories')
+            print(f"Error saving chat history: {e}")
+            return False
+
+    def save_exchanges(self, user_id: str, turns: List[Tuple[str, Dict[str, Any]]],
+                       conversations: Dict[str, Dict[str, Any]]) -> bool:
+        """Append transcript turns and save the updated conversation records together"""
+        if self._history_writes is None:
+            return self.append_conversation_turns(user_id, turns) and self.save_chat_histories(user_id, conversations)
+        try:
+            self._prepare_turns(turns)
+            self._prepare_conversations(conversations)
+            return self._queue_history(user_id, conversations=conversations, turns=turns)
+        except Exception as e:
+            STORAGE_ERRORS.inc(1, 'save_exchanges')
             print(f"Error saving chat history: {e}")
             return False
 
     def get_chat_history(self, user_id: str, conversation_id: Optional[str] = None) -> Dict[str, Any]:
         """Get chat history for a user (all conversations or specific one)"""
         try:
-            data = self._load_json_file(self.chat_history_file)
-            user_data = data.get(user_id, {})
+            self._read_your_writes(user_id)
+            user_data = self._user_conversations(user_id)
 
             if conversation_id:
-                return user_data.get(conversation_id, {})
+                conversation = user_data.get(conversation_id)
+                if conversation is None:
+                    # Cold conversations are read back from the archive on demand
+                    conversation = self.archive.get(user_id, conversation_id)
+                    if conversation is not None:
+                        conversation['archived'] = True
+                return self._without_summary(conversation) if conversation else {}
             else:
                 # Return all conversations sorted by timestamp (newest first)
-                conversations = list(user_data.values())
-                conversations.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
-                return {'conversations': conversations}
+                return {'conversations': [self._without_summary(conversation) for conversation in user_data.newest_first()]}
         except Exception as e:
+            STORAGE_ERRORS.inc(1, 'get_chat_history')
             print(f"Error retrieving chat history: {e}")
             return {}
 
-    def delete_chat_history(self, user_id: str, conversation_id: str) -> bool:
-        """Delete a specific chat conversation"""
+    def list_conversation_summaries(self, user_id: str, limit: int = 20, cursor: Optional[str] = None,
+                                    before: Optional[str] = None) -> Dict[str, Any]:
+        """Get one newest-first page of conversation summaries for a user; raises InvalidCursor for a bad cursor"""
         try:
-            data = self._load_json_file(self.chat_history_file)
+            self._read_your_writes(user_id)
+            return self._user_conversations(user_id).page(limit, cursor=cursor, before=before)
+        except InvalidCursor:
+            raise
+        except Exception as e:
+            STORAGE_ERRORS.inc(1, 'list_conversation_summaries')
+            print(f"Error listing chat history: {e}")
+            return {'conversations': [], 'next_cursor': None}
 
-            if user_id in data and conversation_id in data[user_id]:
-                del data[user_id][conversation_id]
+    def search_chat_history(self, user_id: str, query: str, limit: int = 20, subject: Optional[str] = None,
+                            grade: Optional[str] = None) -> Dict[str, Any]:
+        """Full-text search over a user's conversations, best match first"""
+        try:
+            self._read_your_writes(user_id)
+            view = self._user_conversations(user_id)
+            return view.search(lambda conversation_id: self.backend.get_turns(user_id, conversation_id),
+                               query, limit, subject=subject, grade=grade)
+        except Exception as e:
+            STORAGE_ERRORS.inc(1, 'search_chat_history')
+            print(f"Error searching chat history: {e}")
+            return {'query': query, 'total': 0, 'results': []}
 
-                self._save_json_file(self.chat_history_file, data)
-                return True
+    def append_conversation_turn(self, user_id: str, conversation_id: str, turn: Dict[str, Any]) -> bool:
+        """Append one exchange to a conversation's transcript without rewriting it"""
+        return self.append_conversation_turns(user_id, [(conversation_id, turn)])
+
+    def append_conversation_turns(self, user_id: str, turns: List[Tuple[str, Dict[str, Any]]]) -> bool:
+        """Append (conversation_id, turn) pairs to their transcripts in one group write"""
+        try:
+            self._prepare_turns(turns)
+            if self._history_writes is not None:
+                return self._queue_history(user_id, turns=turns)
+            with timed_acquire(self._lock, LOCK_WAIT, 'data_storage'):
+                self.backend.append_turns(user_id, turns)
+            return True
+        except Exception as e:
+            STORAGE_ERRORS.inc(1, 'append_conversation_turns')
+            print(f"Error appending conversation turns: {e}")
             return False
+
+    def get_conversation_turns(self, user_id: str, conversation_id: str) -> List[Dict[str, Any]]:
+        """Get every exchange of a conversation, oldest first"""
+        try:
+            self._read_your_writes(user_id)
+            return self.backend.get_turns(user_id, conversation_id)
         except Exception as e:
+            STORAGE_ERRORS.inc(1, 'get_conversation_turns')
+            print(f"Error retrieving conversation turns: {e}")
+            return []
+
+    def delete_chat_history(self, user_id: str, conversation_id: str) -> bool:
+        """Delete a specific chat conversation"""
+        try:
+            self._read_your_writes(user_id)
+            deleted = self._write(
+                StorageBackend.CONVERSATIONS, user_id,
+                lambda: self.backend.delete_conversation(user_id, conversation_id),
+                lambda view: view.delete(conversation_id),
+            )
+            return self.archive.delete(user_id, conversation_id) or deleted
+        except Exception as e:
+            STORAGE_ERRORS.inc(1, 'delete_chat_history')
             print(f"Error deleting chat history: {e}")
             return False
 
     def clear_all_chat_history(self, user_id: str) -> bool:
         """Clear all chat history for a user"""
         try:
-            data = self._load_json_file(self.chat_history_file)
-
-            if user_id in data:
-                del data[user_id]
-                self._save_json_file(self.chat_history_file, data)
-                return True
-            return False
+            self._read_your_writes(user_id)
+            cleared = self._write(
+                StorageBackend.CONVERSATIONS, user_id,
+                lambda: self.backend.clear_conversations(user_id),
+                lambda view: view.clear(),
+            )
+            return self.archive.clear(user_id) or cleared
         except Exception as e:
+            STORAGE_ERRORS.inc(1, 'clear_all_chat_history')
             print(f"Error clearing chat history: {e}")
             return False
 
+    def export_conversations(self, user_id: str, include_turns: bool = True) -> Iterator[Dict[str, Any]]:
+        """Yield a user's conversations newest first, each with its transcript turns, one at a time"""
+        self._read_your_writes(user_id)
+        for conversation in self.backend.iter_conversations(user_id):
+            conversation.pop('summary', None)  # derived, rebuilt on import
+            if include_turns and conversation.get('conversation_id'):
+                turns = self.backend.get_turns(user_id, conversation['conversation_id'])
+                if turns:
+                    conversation['turns'] = turns
+            yield conversation
+
+        for record in self.archive.iter_records(user_id):
+            record.pop('summary', None)
+            if not include_turns:
+                record.pop('turns', None)
+            yield record
+
+    def list_archived_conversations(self, user_id: str) -> Dict[str, Any]:
+        """Summaries of a user's archived conversations, newest first"""
+        try:
+            return {'conversations': self.archive.list(user_id)}
+        except Exception as e:
+            STORAGE_ERRORS.inc(1, 'list_archived_conversations')
+            print(f"Error listing archived chat history: {e}")
+            return {'conversations': []}
+
+    def import_conversations(self, user_id: str, records: List[Dict[str, Any]],
+                             on_conflict: str = 'skip') -> Dict[str, int]:
+        """Save one batch of exported conversations; `on_conflict` decides what happens to existing IDs
+
+        Counts are per conversation: `imported` new ones, `replaced` stored ones
+        that were overwritten, `skipped` records left out.
+        """
+        if on_conflict not in IMPORT_CONFLICT_MODES:
+            raise ValueError(f"on_conflict must be one of: {', '.join(IMPORT_CONFLICT_MODES)}")
+
+        self._read_your_writes(user_id)
+        existing = self._user_conversations(user_id).conversations
+        archived = set(self.archive.conversation_ids(user_id))
+        counts = {'imported': 0, 'replaced': 0, 'skipped': 0}
+        conversations: Dict[str, Dict[str, Any]] = {}
+        turns: List[Tuple[str, Dict[str, Any]]] = []
+        replaced: List[str] = []
+        for record in records:
+            record = dict(record)
+            conversation_id = str(record['conversation_id'])
+            record_turns = record.pop('turns', None) or []
+            stored = conversation_id in existing or conversation_id in archived
+            if stored or conversation_id in conversations:
+                if on_conflict == 'skip':
+                    counts['skipped'] += 1
+                    continue
+                if on_conflict == 'rename':
+                    conversation_id = f"{conversation_id}_imported_{os.urandom(4).hex()}"
+                    counts['imported'] += 1
+                else:
+                    if conversation_id not in conversations:
+                        counts['replaced'] += 1
+                        replaced.append(conversation_id)
+                    # A later line for the same conversation supersedes its earlier turns too
+                    turns = [turn for turn in turns if turn[0] != conversation_id]
+            else:
+                counts['imported'] += 1
+            conversations[conversation_id] = record
+            turns.extend((conversation_id, turn) for turn in record_turns)
+
+        if conversations:
+            self._prepare_turns(turns)
+            self._prepare_conversations(conversations)
+            superseded = [conversation_id for conversation_id in replaced if conversation_id in existing]
+
+            def write():
+                # Records first: if they cannot be saved, the stored conversations are left as they were
+                self.backend.put_conversations(user_id, conversations)
+                if superseded:
+                    self.backend.delete_turns(user_id, superseded)
+                if turns:
+                    self.backend.append_turns(user_id, turns)
+
+            # Written directly rather than through the write-behind queue, so nothing is dropped before it lands
+            try:
+                self._write(StorageBackend.CONVERSATIONS, user_id, write, self._view_update(conversations))
+            except Exception as e:
+                STORAGE_ERRORS.inc(1, 'import_conversations')
+                raise RuntimeError(f'Failed to save imported conversations: {e}') from e
+
+        # The imported copy is stored, so archived copies it replaces can go
+        for conversation_id in set(replaced) & archived:
+            self.archive.delete(user_id, conversation_id)
+        return counts
+
     # Utility method to get a user ID (for now using a simple identifier)
     def get_user_id_from_request(self, request) -> str:
         """Extract or generate a user ID from the request"""
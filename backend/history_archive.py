@@ -0,0 +1,193 @@
+"""
+Retention policies and the compressed archive tier for chat history.
+
+A RetentionPolicy picks a user's cold conversations: older than a maximum
+age, beyond the newest N conversations, or beyond a per-user byte budget. The
+compactor moves them, with their transcripts, out of the hot store into
+HistoryArchive. The archive keeps append-only gzip segments per user, each
+holding small gzip members of NDJSON records. A per-user index maps every
+archived conversation to its segment and member offset, so one conversation
+can be read back by decompressing a single member.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+from safe_files import FileLock, atomic_write, fsync_dir
+
+INDEX_FILE = 'index.json'
+MEMBER_RECORDS = 64  # records per gzip member, the unit read back on demand
+
+
+def _parse_timestamp(value: Any) -> Optional[float]:
+    """Seconds since the epoch from an ISO string or an epoch number (the app sends milliseconds)"""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)) or str(value).strip().replace('.', '', 1).isdigit():
+        seconds = float(value)
+        # Anything past ~2286 in seconds is taken to be milliseconds
+        return seconds / 1000 if seconds > 1e10 else seconds
+    try:
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+class RetentionPolicy:
+    def __init__(self, max_age_days: Optional[float] = None, max_conversations: Optional[int] = None,
+                 max_bytes: Optional[int] = None):
+        env = os.environ.get
+        # 0 turns a limit off
+        self.max_age_days = max_age_days if max_age_days is not None else float(env('HISTORY_MAX_AGE_DAYS', 0))
+        self.max_conversations = max_conversations if max_conversations is not None else int(
+            env('HISTORY_MAX_CONVERSATIONS', 0))
+        self.max_bytes = max_bytes if max_bytes is not None else int(env('HISTORY_MAX_BYTES', 0))
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_age_days or self.max_conversations or self.max_bytes)
+
+    def select_cold(self, conversations: List[Dict[str, Any]], now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Conversations (given newest first) that fall outside the policy"""
+        now = now if now is not None else datetime.now().timestamp()
+        cutoff = now - self.max_age_days * 86400 if self.max_age_days else None
+        cold = []
+        size = 0
+        for position, conversation in enumerate(conversations):
+            size += len(json.dumps(conversation, separators=(',', ':'), default=str))
+            timestamp = _parse_timestamp(conversation.get('timestamp'))
+            if ((cutoff is not None and timestamp is not None and timestamp < cutoff)
+                    or (self.max_conversations and position >= self.max_conversations)
+                    or (self.max_bytes and size > self.max_bytes)):
+                cold.append(conversation)
+        return cold
+
+
+class HistoryArchive:
+    def __init__(self, archive_dir: str, segment_bytes: Optional[int] = None):
+        self.archive_dir = archive_dir
+        self.segment_bytes = segment_bytes if segment_bytes is not None else int(
+            os.environ.get('ARCHIVE_SEGMENT_BYTES', 8 * 1024 * 1024))
+        os.makedirs(archive_dir, exist_ok=True)
+        # One writer at a time across threads and worker processes; readers go lock-free
+        # because segments are append-only and the index is replaced atomically
+        self._lock = FileLock(os.path.join(archive_dir, '.lock'), 'archive')
+
+    def _user_dir(self, user_id: str) -> str:
+        return os.path.join(self.archive_dir, hashlib.sha1(user_id.encode('utf-8')).hexdigest())
+
+    def _load_index(self, user_id: str) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(self._user_dir(user_id), INDEX_FILE), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'segments': [], 'conversations': {}}
+
+    def _save_index(self, user_id: str, index: Dict[str, Any]):
+        atomic_write(os.path.join(self._user_dir(user_id), INDEX_FILE), json.dumps(index, separators=(',', ':')))
+
+    def append(self, user_id: str, records: List[Dict[str, Any]]):
+        """Append conversation records (with their `turns`) to the user's active segment"""
+        if not records:
+            return
+        user_dir = self._user_dir(user_id)
+        with self._lock.exclusive():
+            os.makedirs(user_dir, exist_ok=True)
+            index = self._load_index(user_id)
+            segments = index['segments']
+            if not segments or os.path.getsize(os.path.join(user_dir, segments[-1])) >= self.segment_bytes:
+                segments.append(f'segment-{len(segments) + 1:06d}.ndjson.gz')
+            segment = segments[-1]
+
+            with open(os.path.join(user_dir, segment), 'ab') as f:
+                for start in range(0, len(records), MEMBER_RECORDS):
+                    members = records[start:start + MEMBER_RECORDS]
+                    offset = f.tell()
+                    f.write(gzip.compress(''.join(
+                        json.dumps(record, separators=(',', ':'), default=str) + '\n' for record in members
+                    ).encode('utf-8')))
+                    for record in members:
+                        index['conversations'][record['conversation_id']] = {
+                            'segment': segment,
+                            'offset': offset,
+                            'summary': record.get('summary'),
+                            'timestamp': record.get('timestamp'),
+                        }
+                f.flush()
+                os.fsync(f.fileno())
+            fsync_dir(user_dir)
+            self._save_index(user_id, index)
+
+    def _read_member(self, path: str, offset: int) -> List[Dict[str, Any]]:
+        decompressor = zlib.decompressobj(31)
+        data = []
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while not decompressor.eof:
+                chunk = f.read(64 * 1024)
+                if not chunk:
+                    break
+                data.append(decompressor.decompress(chunk))
+        return [json.loads(line) for line in b''.join(data).splitlines() if line.strip()]
+
+    def get(self, user_id: str, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """One archived conversation with its turns, or None"""
+        entry = self._load_index(user_id)['conversations'].get(conversation_id)
+        if entry is None:
+            return None
+        path = os.path.join(self._user_dir(user_id), entry['segment'])
+        for record in self._read_member(path, entry['offset']):
+            if record.get('conversation_id') == conversation_id:
+                return record
+        return None
+
+    def list(self, user_id: str) -> List[Dict[str, Any]]:
+        """Summaries of the user's archived conversations, newest first"""
+        entries = self._load_index(user_id)['conversations']
+        ordered = sorted(entries.items(), key=lambda item: str(item[1].get('timestamp') or ''), reverse=True)
+        return [entry.get('summary') or {'conversation_id': conversation_id, 'timestamp': entry.get('timestamp')}
+                for conversation_id, entry in ordered]
+
+    def iter_records(self, user_id: str) -> Iterator[Dict[str, Any]]:
+        """Yield every live archived record one member at a time"""
+        index = self._load_index(user_id)
+        live = index['conversations']
+        members = sorted({(entry['segment'], entry['offset']) for entry in live.values()})
+        for segment, offset in members:
+            for record in self._read_member(os.path.join(self._user_dir(user_id), segment), offset):
+                entry = live.get(record.get('conversation_id'))
+                # Skip records superseded by a later archive of the same conversation
+                if entry is not None and (entry['segment'], entry['offset']) == (segment, offset):
+                    yield record
+
+    def delete(self, user_id: str, conversation_id: str) -> bool:
+        """Forget an archived conversation; segments with no live records left are removed"""
+        with self._lock.exclusive():
+            index = self._load_index(user_id)
+            entry = index['conversations'].pop(conversation_id, None)
+            if entry is None:
+                return False
+            self._save_index(user_id, index)
+
+            segment = entry['segment']
+            still_used = any(other['segment'] == segment for other in index['conversations'].values())
+            if not still_used and segment != index['segments'][-1]:
+                os.remove(os.path.join(self._user_dir(user_id), segment))
+            return True
+
+    def clear(self, user_id: str) -> bool:
+        with self._lock.exclusive():
+            user_dir = self._user_dir(user_id)
+            if not os.path.exists(user_dir):
+                return False
+            shutil.rmtree(user_dir, ignore_errors=True)
+            return True
+
+    def conversation_ids(self, user_id: str) -> List[str]:
+        return list(self._load_index(user_id)['conversations'])
@@ -0,0 +1,186 @@
+"""
+Conditional GET, ETags and compression for JSON GET endpoints.
+
+Static payloads (the subject catalog) are serialized, tagged and compressed
+once at startup. Per-user payloads are tagged with a hash of their body,
+remembered per storage generation: while the generation has not moved, a
+request whose If-None-Match still matches is answered with 304 Not Modified
+before the data is read or serialized. Hashing the body (rather than using
+the generation itself) keeps the tags valid across restarts and worker
+processes.
+
+Bodies of at least HTTP_COMPRESS_MIN_BYTES are sent gzip (or brotli, when the
+optional `brotli` package is installed) compressed, as the client's
+Accept-Encoding allows. Each encoding gets its own strong ETag.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from flask import Response, request
+
+try:
+    import brotli  # optional: br is only offered when installed
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.environ.get('HTTP_COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = int(os.environ.get('HTTP_GZIP_LEVEL', 6))
+STATIC_MAX_AGE = int(os.environ.get('HTTP_STATIC_MAX_AGE', 3600))
+
+# Preferred first when the client accepts several with the same quality
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+STATIC_CACHE_CONTROL = f'public, max-age={STATIC_MAX_AGE}'
+PRIVATE_CACHE_CONTROL = 'private, no-cache'  # browsers keep a copy but revalidate it every time
+
+
+def serialize(payload: Any) -> bytes:
+    return json.dumps(payload, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def compress(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body)
+    if encoding == 'gzip':
+        return gzip.compress(body, GZIP_LEVEL, mtime=0)
+    return body
+
+
+def body_tag(body: bytes) -> str:
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def _negotiate(size: int) -> Optional[str]:
+    """Content encoding for a body of this size, or None to send it as is"""
+    if size < COMPRESS_MIN_BYTES:
+        return None
+    return request.accept_encodings.best_match(ENCODINGS)
+
+
+def _variant_tag(tag: str, encoding: Optional[str]) -> str:
+    return f'{tag}-{encoding}' if encoding else tag
+
+
+def _matches(tag: str) -> bool:
+    """Whether the client already holds the data behind a tag, in any encoding"""
+    if_none_match = request.if_none_match
+    if not if_none_match:
+        return False
+    return any(if_none_match.contains_weak(_variant_tag(tag, encoding)) for encoding in (None,) + ENCODINGS)
+
+
+def _headers(response: Response, tag: str, cache_control: str, vary: str) -> Response:
+    response.set_etag(tag)
+    response.headers['Cache-Control'] = cache_control
+    response.headers['Vary'] = vary
+    return response
+
+
+def not_modified(tag: str, cache_control: str, vary: str = 'Accept-Encoding') -> Response:
+    return _headers(Response(status=304), tag, cache_control, vary)
+
+
+def json_response(body: bytes, tag: str, encoding: Optional[str], cache_control: str,
+                  vary: str = 'Accept-Encoding') -> Response:
+    """Send an already serialized (and possibly compressed) JSON body"""
+    response = Response(body, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return _headers(response, _variant_tag(tag, encoding), cache_control, vary)
+
+
+class StaticResponse:
+    """A JSON payload serialized, tagged and compressed once, for data that does not change while running"""
+
+    def __init__(self, payload: Any, cache_control: str = STATIC_CACHE_CONTROL):
+        self.cache_control = cache_control
+        self.body = serialize(payload)
+        self.tag = body_tag(self.body)
+        self.bodies = {None: self.body}
+        if len(self.body) >= COMPRESS_MIN_BYTES:
+            self.bodies.update({encoding: compress(self.body, encoding) for encoding in ENCODINGS})
+
+    def respond(self) -> Response:
+        encoding = _negotiate(len(self.body))
+        if _matches(self.tag):
+            return not_modified(_variant_tag(self.tag, encoding), self.cache_control)
+        return json_response(self.bodies[encoding], self.tag, encoding, self.cache_control)
+
+
+class ConditionalResponses:
+    """ETags of per-user JSON responses, remembered per (key, generation) in LRU order"""
+
+    def __init__(self, max_entries: Optional[int] = None):
+        if max_entries is None:
+            max_entries = int(os.environ.get('HTTP_ETAG_CACHE_SIZE', 10000))
+        self.max_entries = max_entries
+        self._tags = OrderedDict()  # (key, generation) -> (tag, body size)
+        self._lock = threading.Lock()
+
+        # Counters
+        self.not_modified = 0  # answered with 304 without reading the data
+        self.revalidated = 0  # data read, but the client already had it
+        self.sent = 0
+        self.compressed_bytes_saved = 0
+
+    def _known(self, entry: Tuple[Hashable, Hashable]) -> Optional[Tuple[str, int]]:
+        with self._lock:
+            known = self._tags.get(entry)
+            if known is not None:
+                self._tags.move_to_end(entry)
+            return known
+
+    def _remember(self, entry: Tuple[Hashable, Hashable], tag: str, size: int):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._tags[entry] = (tag, size)
+            self._tags.move_to_end(entry)
+            while len(self._tags) > self.max_entries:
+                self._tags.popitem(last=False)
+
+    def respond(self, key: Hashable, generation: Hashable, load: Callable[[], Any],
+                cache_control: str = PRIVATE_CACHE_CONTROL, vary: str = 'Accept-Encoding') -> Response:
+        """JSON response for load(), or 304 if the client's ETag matches
+
+        `generation` must be taken before the data is loaded, and move whenever
+        the data behind `key` may have changed.
+        """
+        entry = (key, generation)
+        known = self._known(entry)
+        if known is not None and _matches(known[0]):
+            with self._lock:
+                self.not_modified += 1
+            return not_modified(_variant_tag(known[0], _negotiate(known[1])), cache_control, vary)
+
+        body = serialize(load())
+        tag = body_tag(body)
+        self._remember(entry, tag, len(body))
+        encoding = _negotiate(len(body))
+        if _matches(tag):
+            with self._lock:
+                self.revalidated += 1
+            return not_modified(_variant_tag(tag, encoding), cache_control, vary)
+
+        compressed = compress(body, encoding)
+        with self._lock:
+            self.sent += 1
+            self.compressed_bytes_saved += len(body) - len(compressed)
+        return json_response(compressed, tag, encoding, cache_control, vary)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'tags': len(self._tags),
+                'max_tags': self.max_entries,
+                'not_modified': self.not_modified,
+                'revalidated': self.revalidated,
+                'sent': self.sent,
+                'compressed_bytes_saved': self.compressed_bytes_saved,
+            }
@@ -0,0 +1,149 @@
+"""
+Background job runner for long chat generations.
+
+Jobs wait in a bounded queue and run on a fixed pool of worker threads, so
+the request that submitted them returns at once. Clients poll (or long-poll)
+for the result. Queued or running jobs can be cancelled, and finished jobs
+are dropped once their result has been kept for the configured TTL.
+"""
+
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobQueueFull(Exception):
+    """No room left in the job queue"""
+
+
+class JobCancelled(Exception):
+    """Raised by job functions that notice they were cancelled"""
+
+
+class Job:
+    def __init__(self, owner: str, fn: Callable[['Job'], Any]):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.fn = fn
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.cancel_requested = False
+        self.done = threading.Event()
+
+    def to_dict(self) -> Dict[str, Any]:
+        job_data = {'job_id': self.id, 'status': self.status, 'created_at': self.created_at}
+        if self.finished_at is not None:
+            job_data['finished_at'] = self.finished_at
+        if self.cancel_requested and self.status == RUNNING:
+            job_data['cancel_requested'] = True
+        if self.status == SUCCEEDED:
+            job_data['result'] = self.result
+        elif self.status == FAILED:
+            job_data['error'] = self.error
+        return job_data
+
+
+class JobManager:
+    def __init__(self, workers: int = 4, queue_size: int = 100, result_ttl: float = 600):
+        self.result_ttl = result_ttl
+        self._queue: 'queue.Queue[Job]' = queue.Queue(maxsize=queue_size)
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+        for index in range(workers):
+            threading.Thread(target=self._worker, name=f'chat-job-worker-{index}', daemon=True).start()
+
+    def submit(self, owner: str, fn: Callable[[Job], Any]) -> Job:
+        """Queue a job; raises JobQueueFull when the queue is at capacity"""
+        self._expire()
+        job = Job(owner, fn)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise JobQueueFull()
+        return job
+
+    def get(self, owner: str, job_id: str, wait: float = 0) -> Optional[Job]:
+        """Look up a job of this owner, optionally waiting up to `wait` seconds for it to finish"""
+        self._expire()
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or job.owner != owner:
+            return None
+        if wait > 0:
+            job.done.wait(wait)
+        return job
+
+    def cancel(self, owner: str, job_id: str) -> Optional[Job]:
+        """Cancel a queued or running job; finished jobs are left as they are"""
+        job = self.get(owner, job_id)
+        if job is None:
+            return None
+        with self._lock:
+            if job.status not in FINISHED_STATES:
+                job.cancel_requested = True
+                if job.status == QUEUED:
+                    self._finish(job, CANCELLED)
+        return job
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished_at = time.time()
+        job.done.set()
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                if job.status != QUEUED:
+                    continue
+                job.status = RUNNING
+
+            try:
+                result = job.fn(job)
+            except JobCancelled:
+                status, result = CANCELLED, None
+            except Exception as e:
+                job.error = str(e)
+                status, result = FAILED, None
+            else:
+                status = CANCELLED if job.cancel_requested else SUCCEEDED
+
+            with self._lock:
+                job.result = result
+                self._finish(job, status)
+
+    def _expire(self):
+        """Drop finished jobs whose result has been kept longer than the TTL"""
+        cutoff = time.time() - self.result_ttl
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            counts = {state: 0 for state in (QUEUED, RUNNING) + FINISHED_STATES}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        counts['queue_size'] = self._queue.qsize()
+        counts['queue_capacity'] = self._queue.maxsize
+        return counts
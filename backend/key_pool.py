@@ -0,0 +1,211 @@
+"""
+Server-side pool of a user's stored API keys for a provider.
+
+Every pooled key carries in-memory state learned from the provider's responses:
+the rate-limit headroom parsed from its rate-limit headers and a cool-down
+after it was answered with 429. Its request rate and the credit spent on it
+are held by the UsageLimiter. Each request picks the usable key with the most
+headroom, least recently used first among equals, so traffic rotates across
+keys instead of draining one until it is throttled.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from usage_limits import RateLimited, UsageLimiter
+
+DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|s|m|h)')
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+# (remaining, limit, reset) header names per kind of limit
+RATE_LIMIT_HEADERS = [
+    ('x-ratelimit-remaining-requests', 'x-ratelimit-limit-requests', 'x-ratelimit-reset-requests'),
+    ('x-ratelimit-remaining-tokens', 'x-ratelimit-limit-tokens', 'x-ratelimit-reset-tokens'),
+    ('x-ratelimit-remaining', 'x-ratelimit-limit', 'x-ratelimit-reset'),
+    ('anthropic-ratelimit-requests-remaining', 'anthropic-ratelimit-requests-limit', 'anthropic-ratelimit-requests-reset'),
+    ('anthropic-ratelimit-tokens-remaining', 'anthropic-ratelimit-tokens-limit', 'anthropic-ratelimit-tokens-reset'),
+]
+
+
+class PooledKey(NamedTuple):
+    unique_key: str
+    api_key: str
+    credit_limit: Optional[float]
+
+
+class NoKeyAvailable(Exception):
+    """Every pooled key is cooling down, at its request rate limit or out of credit"""
+
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(f'All API keys for {provider} are rate limited or over their credit limit')
+        self.provider = provider
+        self.retry_after = retry_after
+
+
+def parse_reset(value: str, now: float) -> Optional[float]:
+    """Wall-clock time a rate-limit window resets, from a duration, epoch or RFC 3339 value"""
+    value = value.strip()
+    try:
+        number = float(value)
+    except ValueError:
+        pass
+    else:
+        if number > 1e12:  # epoch milliseconds (OpenRouter)
+            return number / 1000
+        if number > 1e9:  # epoch seconds
+            return number
+        return now + number
+
+    parts = DURATION_PART.findall(value)
+    if parts and ''.join(amount + unit for amount, unit in parts) == value:  # e.g. "6m0s", "20ms"
+        return now + sum(float(amount) * DURATION_UNITS[unit] for amount, unit in parts)
+
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def parse_rate_limit_headers(headers) -> Tuple[Optional[float], Optional[float]]:
+    """(headroom 0..1, reset time) from provider rate-limit headers, or (None, None) without any"""
+    now = time.time()
+    headroom = None
+    reset_at = None
+    for remaining_name, limit_name, reset_name in RATE_LIMIT_HEADERS:
+        try:
+            remaining = float(headers[remaining_name])
+            limit = float(headers[limit_name])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if limit <= 0:
+            continue
+
+        fraction = max(min(remaining / limit, 1.0), 0.0)
+        if headroom is None or fraction < headroom:
+            headroom = fraction
+            reset_at = parse_reset(headers[reset_name], now) if headers.get(reset_name) else None
+    return headroom, reset_at
+
+
+def request_cost(model: str, usage_data: Optional[Dict[str, Any]], usage_info: Optional[Dict[str, Any]],
+                 prices: Dict[str, float]) -> float:
+    """Credit spent by one request: the provider's reported cost, else tokens times the model price"""
+    if usage_data and isinstance(usage_data.get('cost'), (int, float)):
+        return float(usage_data['cost'])
+    price = prices.get(model)
+    if price is None or not usage_info:
+        return 0.0
+    return usage_info.get('total_tokens', 0) / 1000 * price
+
+
+class _KeyState:
+    def __init__(self):
+        self.headroom = 1.0
+        self.headroom_until = 0.0
+        self.cooldown_until = 0.0
+        self.last_used = 0.0
+        self.requests = 0
+        self.rate_limited = 0
+
+
+class KeyPool:
+    def __init__(self, limiter: Optional[UsageLimiter] = None, cooldown: Optional[float] = None,
+                 headroom_ttl: Optional[float] = None, prices: Optional[Dict[str, float]] = None):
+        env = os.environ.get
+        self.limiter = limiter if limiter is not None else UsageLimiter()
+        self.cooldown = cooldown if cooldown is not None else float(env('KEY_COOLDOWN', 30))
+        self.headroom_ttl = headroom_ttl if headroom_ttl is not None else float(env('KEY_HEADROOM_TTL', 60))
+        if prices is None:
+            # Price per 1k tokens, used when the provider does not report a cost,
+            # e.g. MODEL_PRICES='{"openai/gpt-4o-mini": 0.0006}'
+            prices = json.loads(env('MODEL_PRICES', '{}'))
+        self.prices = prices
+        self._states: Dict[str, _KeyState] = {}
+        self._lock = threading.Lock()
+
+    def _state(self, api_key: str) -> _KeyState:
+        state = self._states.get(api_key)
+        if state is None:
+            state = self._states[api_key] = _KeyState()
+        return state
+
+    def _headroom(self, state: _KeyState, now: float) -> float:
+        # Headroom learned from an old response says nothing once its window has reset
+        return state.headroom if now < state.headroom_until else 1.0
+
+    def acquire(self, provider: str, keys: Iterable[PooledKey], exclude: Iterable[str] = ()) -> PooledKey:
+        """Pick the usable key with the most headroom; raises NoKeyAvailable when none is left"""
+        now = time.time()
+        excluded = set(exclude)
+        ranked = []
+        retry_after = None
+        with self._lock:
+            for key in keys:
+                if key.api_key in excluded:
+                    continue
+                state = self._state(key.api_key)
+                if state.cooldown_until > now:
+                    wait = state.cooldown_until - now
+                    retry_after = wait if retry_after is None else min(retry_after, wait)
+                    continue
+                ranked.append(((-self._headroom(state, now), state.last_used), key))
+        ranked.sort(key=lambda ranked_key: ranked_key[0])
+
+        for _, key in ranked:
+            if self.limiter.key_over_credit(key.api_key, key.credit_limit):
+                continue
+            try:
+                self.limiter.admit_key(key.api_key)
+            except RateLimited as e:
+                retry_after = e.retry_after if retry_after is None else min(retry_after, e.retry_after)
+                continue
+
+            with self._lock:
+                state = self._state(key.api_key)
+                state.last_used = now
+                state.requests += 1
+            return key
+
+        raise NoKeyAvailable(provider, retry_after if retry_after is not None else self.cooldown)
+
+    def observe(self, api_key: str, status_code: int, headers) -> None:
+        """Learn from a provider response: rate-limit headroom, and a cool-down on 429"""
+        now = time.time()
+        headroom, reset_at = parse_rate_limit_headers(headers)
+        with self._lock:
+            state = self._state(api_key)
+            if headroom is not None:
+                state.headroom = headroom
+                state.headroom_until = reset_at if reset_at is not None else now + self.headroom_ttl
+            if status_code == 429:
+                state.rate_limited += 1
+                cooldown_until = now + self.cooldown
+                retry_after = headers.get('Retry-After')
+                if retry_after:
+                    cooldown_until = parse_reset(retry_after, now) or cooldown_until
+                elif reset_at is not None:
+                    cooldown_until = reset_at
+                state.cooldown_until = cooldown_until
+
+    def describe(self, keys: Iterable[PooledKey]) -> List[Dict[str, Any]]:
+        """Pool state of the given keys, without the secrets"""
+        now = time.time()
+        described = []
+        with self._lock:
+            for key in keys:
+                state = self._states.get(key.api_key) or _KeyState()
+                described.append({
+                    'unique_key': key.unique_key,
+                    'headroom': round(self._headroom(state, now), 4),
+                    'cooldown_remaining': round(max(state.cooldown_until - now, 0), 1),
+                    'spent': round(self.limiter.key_spent(key.api_key), 6),
+                    'credit_limit': key.credit_limit,
+                    'requests': state.requests,
+                    'rate_limited': state.rate_limited,
+                })
+        return described
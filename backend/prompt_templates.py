@@ -0,0 +1,90 @@
+"""
+Tutor system prompts, compiled from template files.
+
+The system prompt is split into a static part that is the same for every
+request (`prompts/tutor_instructions.txt`) and a short per-request context
+(`prompts/tutor_context.txt`, with `$subject` and `$grade` placeholders). The
+files are read once at startup and each (subject, grade) prompt is built once
+and memoized. The static part comes first so every request shares the same
+prefix, which providers with prefix caching (OpenAI, and OpenRouter and
+Anthropic with `cache_control` breakpoints) can serve from their cache at a
+reduced price.
+"""
+
+import copy
+import os
+from functools import lru_cache
+from string import Template
+from typing import Any, Dict, List, Optional, Set
+
+PROMPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts')
+CACHE_CONTROL = {'type': 'ephemeral'}
+
+
+def _read(template_dir: str, name: str) -> str:
+    with open(os.path.join(template_dir, name), 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+
+def _text_parts(text: str, cached: bool) -> List[Dict[str, Any]]:
+    part: Dict[str, Any] = {'type': 'text', 'text': text}
+    if cached:
+        part['cache_control'] = CACHE_CONTROL
+    return [part]
+
+
+def cached_tokens(usage_data: Optional[Dict[str, Any]]) -> int:
+    """Input tokens a provider reports as served from its prompt cache"""
+    if not usage_data:
+        return 0
+    details = usage_data.get('prompt_tokens_details') or {}
+    return int(details.get('cached_tokens') or usage_data.get('cache_read_input_tokens') or 0)
+
+
+class PromptTemplates:
+    def __init__(self, template_dir: Optional[str] = None, cache_providers: Optional[Set[str]] = None,
+                 max_prompts: Optional[int] = None):
+        env = os.environ.get
+        self.template_dir = template_dir or env('PROMPT_TEMPLATE_DIR', PROMPT_DIR)
+        if cache_providers is None:
+            # Providers that accept cache_control breakpoints in message content
+            cache_providers = {p.strip() for p in env('PROMPT_CACHE_PROVIDERS', 'Anthropic,OpenRouter').split(',')}
+        self.cache_providers = {p for p in cache_providers if p}
+        max_prompts = max_prompts if max_prompts is not None else int(env('PROMPT_CACHE_SIZE', 256))
+
+        self.instructions = _read(self.template_dir, 'tutor_instructions.txt')
+        self.context = Template(_read(self.template_dir, 'tutor_context.txt'))
+        self.tutor = lru_cache(maxsize=max_prompts)(self._compile)
+
+    def _compile(self, subject: str, grade: str) -> str:
+        """System prompt for one (subject, grade): the static instructions, then the context"""
+        context = self.context.substitute(subject=subject, grade=grade)
+        return f'{self.instructions}\n\n{context}'
+
+    def system_prompt(self, subject: Any, grade: Any) -> str:
+        """Memoized system prompt for the educational tutor"""
+        return self.tutor(str(subject), str(grade))
+
+    def mark_cacheable(self, provider: str, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Messages with cache_control breakpoints for providers that support them
+
+        One breakpoint ends the static instructions, shared by every conversation.
+        A second ends the earlier turns, so the next message in the same
+        conversation reads them from the cache.
+        """
+        if provider not in self.cache_providers or not messages:
+            return messages
+        messages = copy.copy(messages)
+        first = messages[0]
+        if first.get('role') == 'system' and isinstance(first.get('content'), str) \
+                and first['content'].startswith(self.instructions):
+            context = first['content'][len(self.instructions):].lstrip('\n')
+            parts = _text_parts(self.instructions, True) + (_text_parts(context, False) if context else [])
+            messages[0] = dict(first, content=parts)
+        if len(messages) > 2 and messages[-2].get('role') == 'assistant' and isinstance(messages[-2].get('content'), str):
+            messages[-2] = dict(messages[-2], content=_text_parts(messages[-2]['content'], True))
+        return messages
+
+    def stats(self) -> Dict[str, int]:
+        info = self.tutor.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize}
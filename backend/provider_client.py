@@ -0,0 +1,306 @@
+"""
+Upstream HTTP client for the AI providers.
+
+Keeps one pooled, keep-alive requests.Session per (provider, base_url) so
+repeated chats reuse TCP/TLS connections, applies connect/read timeouts, and
+retries connection failures and 429/5xx responses with jittered backoff.
+AsyncProviderClient does the same on aiohttp for the asyncio serving mode.
+"""
+
+import asyncio
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import aiohttp  # optional: only the asyncio serving mode (chat_asgi.py) needs it
+except ImportError:
+    aiohttp = None
+
+from metrics import REGISTRY
+
+# Statuses worth retrying: rate limited or upstream trouble
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+UPSTREAM_SECONDS = REGISTRY.histogram(
+    'chat_upstream_request_seconds', 'Time until an AI provider returned response headers', ('provider', 'model'))
+UPSTREAM_RESPONSES = REGISTRY.counter(
+    'chat_upstream_responses', 'AI provider responses by HTTP status (error: no response)', ('provider', 'model', 'status'))
+UPSTREAM_RETRIES = REGISTRY.counter('chat_upstream_retries', 'Retried AI provider requests', ('provider',))
+
+
+class UpstreamError(Exception):
+    """The provider answered with a non-200 status"""
+
+    def __init__(self, provider: str, status_code: int):
+        super().__init__(f'Failed to get response from {provider} API (Status: {status_code})')
+        self.provider = provider
+        self.status_code = status_code
+
+
+def get_provider_config(provider, api_key):
+    """Get the base URL and headers for different AI providers"""
+    if provider == 'OpenAI':
+        return (
+            'https://api.openai.com/v1',
+            {
+                'Authorization': f'Bearer {api_key}',
+                'Content-Type': 'application/json',
+            }
+        )
+    elif provider == 'Anthropic':
+        return (
+            'https://api.anthropic.com/v1',
+            {
+                'x-api-key': api_key,
+                'anthropic-version': '2023-06-01',
+                'Content-Type': 'application/json',
+            }
+        )
+    elif provider == 'GoogleAI Studio':
+        return (
+            'https://generativelanguage.googleapis.com/v1beta',
+            {
+                'x-goog-api-key': api_key,
+                'Content-Type': 'application/json',
+            }
+        )
+    elif provider == 'LiteLLM':
+        return (
+            'http://localhost:4000',  # Default LiteLLM proxy server
+            {
+                'Authorization': f'Bearer {api_key}',
+                'Content-Type': 'application/json',
+            }
+        )
+    else:  # OpenRouter (default)
+        return (
+            'https://openrouter.ai/api/v1',
+            {
+                'Authorization': f'Bearer {api_key}',
+                'Content-Type': 'application/json',
+                'HTTP-Referer': 'flutter-app',
+                'X-Title': 'Real Life Applications App',
+            }
+        )
+
+
+class ProviderClient:
+    def __init__(self, pool_size: Optional[int] = None, connect_timeout: Optional[float] = None,
+                 read_timeout: Optional[float] = None, max_retries: Optional[int] = None,
+                 backoff_base: Optional[float] = None, backoff_max: Optional[float] = None):
+        env = os.environ.get
+        self.pool_size = pool_size if pool_size is not None else int(env('UPSTREAM_POOL_SIZE', 20))
+        self.connect_timeout = connect_timeout if connect_timeout is not None else float(env('UPSTREAM_CONNECT_TIMEOUT', 5))
+        self.read_timeout = read_timeout if read_timeout is not None else float(env('UPSTREAM_READ_TIMEOUT', 120))
+        self.max_retries = max_retries if max_retries is not None else int(env('UPSTREAM_MAX_RETRIES', 2))
+        self.backoff_base = backoff_base if backoff_base is not None else float(env('UPSTREAM_BACKOFF_BASE', 0.5))
+        self.backoff_max = backoff_max if backoff_max is not None else float(env('UPSTREAM_BACKOFF_MAX', 8))
+
+        self._sessions: Dict[Tuple[str, str], requests.Session] = {}
+        self._retries: Dict[Tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+
+    def _session(self, provider: str, base_url: str) -> requests.Session:
+        """Get (or create) the pooled session for a provider endpoint"""
+        key = (provider, base_url)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=0)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[key] = session
+                self._retries[key] = 0
+            return session
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response] = None) -> float:
+        """Full-jitter exponential backoff, honouring Retry-After when the provider sends it"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_max)
+                except ValueError:
+                    pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def post(self, provider: str, base_url: str, path: str, headers: Dict[str, str],
+             payload: Dict[str, Any], stream: bool = False,
+             max_retries: Optional[int] = None) -> requests.Response:
+        """POST to a provider with pooling, timeouts and bounded retries"""
+        session = self._session(provider, base_url)
+        url = f'{base_url}{path}'
+        if max_retries is None:
+            max_retries = self.max_retries
+
+        model = str(payload.get('model', ''))
+        for attempt in range(max_retries + 1):
+            started = time.perf_counter()
+            try:
+                response = session.post(url, headers=headers, json=payload, stream=stream,
+                                        timeout=(self.connect_timeout, self.read_timeout))
+            except requests.ConnectionError:
+                UPSTREAM_RESPONSES.inc(1, provider, model, 'error')
+                # Nothing reached the provider, so it is safe to try again
+                if attempt == max_retries:
+                    raise
+                delay = self._backoff(attempt)
+            except requests.RequestException:
+                UPSTREAM_RESPONSES.inc(1, provider, model, 'error')
+                raise
+            else:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - started, provider, model)
+                UPSTREAM_RESPONSES.inc(1, provider, model, response.status_code)
+                if response.status_code not in RETRY_STATUSES or attempt == max_retries:
+                    return response
+                delay = self._backoff(attempt, response)
+                response.close()
+
+            with self._lock:
+                self._retries[(provider, base_url)] += 1
+            UPSTREAM_RETRIES.inc(1, provider)
+            time.sleep(delay)
+
+    def chat_completion(self, provider: str, api_key: str, payload: Dict[str, Any],
+                        stream: bool = False, max_retries: Optional[int] = None) -> requests.Response:
+        """Send a chat completion request to a provider"""
+        base_url, headers = get_provider_config(provider, api_key)
+        return self.post(provider, base_url, '/chat/completions', headers, payload,
+                         stream=stream, max_retries=max_retries)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Connection reuse counters per provider endpoint"""
+        with self._lock:
+            sessions = list(self._sessions.items())
+            retries = dict(self._retries)
+
+        stats = {}
+        for (provider, base_url), session in sessions:
+            requests_sent = 0
+            connections_opened = 0
+            for adapter in set(session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for pool_key in list(pools.keys()):
+                    pool = pools.get(pool_key)
+                    if pool is not None:
+                        requests_sent += pool.num_requests
+                        connections_opened += pool.num_connections
+
+            stats[f'{provider} {base_url}'] = {
+                'requests': requests_sent,
+                'connections_opened': connections_opened,
+                'connections_reused': max(requests_sent - connections_opened, 0),
+                'retries': retries.get((provider, base_url), 0),
+            }
+        return stats
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+def _requests_error(error: Exception) -> requests.RequestException:
+    """The requests exception matching an aiohttp error, so breakers and failover treat both alike"""
+    if isinstance(error, aiohttp.ConnectionTimeoutError):
+        return requests.ConnectTimeout(str(error))
+    if isinstance(error, asyncio.TimeoutError):
+        return requests.Timeout(str(error))
+    return requests.ConnectionError(str(error))
+
+
+class AsyncProviderClient(ProviderClient):
+    """Coroutine version of ProviderClient on pooled aiohttp sessions"""
+
+    def __init__(self, max_connections: Optional[int] = None, **settings):
+        if aiohttp is None:
+            raise RuntimeError('The asyncio serving mode needs aiohttp: pip install -r requirements-async.txt')
+        super().__init__(**settings)
+        # Connections per provider endpoint; requests beyond this wait for a free one
+        self.max_connections = max_connections if max_connections is not None else int(
+            os.environ.get('ASYNC_UPSTREAM_MAX_CONNECTIONS', 1000))
+        self._clients: Dict[Tuple[str, str], 'aiohttp.ClientSession'] = {}
+        self._requests: Dict[Tuple[str, str], int] = {}
+
+    def _client(self, provider: str, base_url: str) -> 'aiohttp.ClientSession':
+        """Get (or create) the pooled session for a provider endpoint; call from the event loop"""
+        key = (provider, base_url)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = aiohttp.ClientSession(
+                    connector=aiohttp.TCPConnector(limit=self.max_connections),
+                    timeout=aiohttp.ClientTimeout(total=None, connect=self.connect_timeout, sock_read=self.read_timeout),
+                )
+                self._clients[key] = client
+                self._retries[key] = 0
+                self._requests[key] = 0
+            return client
+
+    async def post(self, provider: str, base_url: str, path: str, headers: Dict[str, str],
+                   payload: Dict[str, Any], stream: bool = False,
+                   max_retries: Optional[int] = None) -> 'aiohttp.ClientResponse':
+        """POST to a provider with pooling, timeouts and bounded retries; read the body unless streaming"""
+        client = self._client(provider, base_url)
+        url = f'{base_url}{path}'
+        if max_retries is None:
+            max_retries = self.max_retries
+
+        model = str(payload.get('model', ''))
+        for attempt in range(max_retries + 1):
+            started = time.perf_counter()
+            with self._lock:
+                self._requests[(provider, base_url)] += 1
+            try:
+                response = await client.post(url, headers=headers, json=payload)
+                if not stream:
+                    await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                UPSTREAM_RESPONSES.inc(1, provider, model, 'error')
+                error = _requests_error(e)
+                # Nothing reached the provider, so it is safe to try again
+                if not isinstance(error, requests.ConnectionError) or attempt == max_retries:
+                    raise error from e
+                delay = self._backoff(attempt)
+            else:
+                UPSTREAM_SECONDS.observe(time.perf_counter() - started, provider, model)
+                UPSTREAM_RESPONSES.inc(1, provider, model, response.status)
+                if response.status not in RETRY_STATUSES or attempt == max_retries:
+                    return response
+                delay = self._backoff(attempt, response)
+                response.close()
+
+            with self._lock:
+                self._retries[(provider, base_url)] += 1
+            UPSTREAM_RETRIES.inc(1, provider)
+            await asyncio.sleep(delay)
+
+    async def chat_completion(self, provider: str, api_key: str, payload: Dict[str, Any],
+                              stream: bool = False, max_retries: Optional[int] = None) -> 'aiohttp.ClientResponse':
+        """Send a chat completion request to a provider"""
+        base_url, headers = get_provider_config(provider, api_key)
+        return await self.post(provider, base_url, '/chat/completions', headers, payload,
+                               stream=stream, max_retries=max_retries)
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Request and retry counters per provider endpoint"""
+        with self._lock:
+            return {
+                f'{provider} {base_url}': {'requests': count, 'retries': self._retries.get((provider, base_url), 0)}
+                for (provider, base_url), count in self._requests.items()
+            }
+
+    async def aclose(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            await client.close()
@@ -0,0 +1,123 @@
+"""
+Response cache for repeated tutor questions.
+
+Answers are keyed on (provider, model, subject, grade, normalized message)
+and held in a bounded in-memory LRU with a TTL. An optional SQLite file acts
+as a second, larger tier that survives restarts.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+def normalize_message(message: str) -> str:
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    return ' '.join(message.lower().split()).rstrip('?!. ')
+
+
+def request_fingerprint(provider: str, model: str, subject: str, grade: str, message: str) -> str:
+    """Stable key identifying equivalent tutor requests"""
+    key_parts = [provider, model, subject, str(grade), normalize_message(message)]
+    return hashlib.sha256(json.dumps(key_parts).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 1000, ttl: float = 86400, disk_path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires_at, entry)
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._disk = None
+        if disk_path:
+            self._disk = sqlite3.connect(disk_path, check_same_thread=False)
+            with self._disk:
+                self._disk.execute(
+                    'CREATE TABLE IF NOT EXISTS responses '
+                    '(key TEXT PRIMARY KEY, expires_at REAL NOT NULL, data TEXT NOT NULL)'
+                )
+                self._disk.execute(
+                    'CREATE INDEX IF NOT EXISTS idx_responses_expires_at ON responses (expires_at)'
+                )
+
+    def _remember(self, key: str, expires_at: float, entry: Dict[str, Any]):
+        self._entries[key] = (expires_at, entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached entry, or None if missing or expired"""
+        now = time.time()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                expires_at, entry = cached
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry
+                del self._entries[key]
+
+            if self._disk is not None:
+                row = self._disk.execute(
+                    'SELECT expires_at, data FROM responses WHERE key = ?', (key,)
+                ).fetchone()
+                if row is not None and row[0] > now:
+                    entry = json.loads(row[1])
+                    self._remember(key, row[0], entry)
+                    self.disk_hits += 1
+                    return entry
+
+            self.misses += 1
+            return None
+
+    def put(self, key: str, entry: Dict[str, Any]):
+        """Store an entry in memory (and on disk when the disk tier is enabled)"""
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, entry)
+            if self._disk is not None:
+                with self._disk:
+                    self._disk.execute(
+                        'INSERT OR REPLACE INTO responses (key, expires_at, data) VALUES (?, ?, ?)',
+                        (key, expires_at, json.dumps(entry)),
+                    )
+                    self._disk.execute('DELETE FROM responses WHERE expires_at <= ?', (time.time(),))
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+            }
+
+
+def create_response_cache(data_dir: str = 'data') -> Optional[ResponseCache]:
+    """Build the response cache from RESPONSE_CACHE_* settings (disabled unless opted in)"""
+    if os.environ.get('RESPONSE_CACHE_ENABLED', '').lower() not in ('1', 'true', 'yes'):
+        return None
+
+    disk_path = None
+    if os.environ.get('RESPONSE_CACHE_DISK', '').lower() in ('1', 'true', 'yes'):
+        disk_path = os.path.join(data_dir, 'response_cache.db')
+
+    return ResponseCache(
+        max_entries=int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1000)),
+        ttl=float(os.environ.get('RESPONSE_CACHE_TTL', 86400)),
+        disk_path=disk_path,
+    )
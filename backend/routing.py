@@ -0,0 +1,294 @@
+"""
+Hedged routing across an ordered list of AI providers.
+
+A route is the requested provider/model followed by fallback targets. The
+primary is called first; if it has not answered within a hedge delay derived
+from its own observed p95 latency, the same request also goes to the next
+target and the first good answer wins. A target that fails with a connection
+error, a timeout or a 429/5xx hands the request straight to the next one.
+Attempts that lose the race are cancelled and their answers discarded.
+run_async does the same with asyncio tasks for the asyncio serving mode.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import requests
+
+from circuit_breaker import AttemptCancelled, CircuitOpenError
+from key_pool import NoKeyAvailable
+from provider_client import RETRY_STATUSES, UpstreamError
+
+
+class RouteTarget(NamedTuple):
+    provider: str
+    model: str
+    api_key: Optional[str]
+    key_pool: Tuple[Any, ...] = ()  # stored keys to rotate through instead of api_key
+
+
+class InvalidFallbackRoute(ValueError):
+    """A fallback route that is not a JSON list of {"provider", "model"} objects"""
+
+
+def parse_fallback_route(value: str) -> List[Dict[str, Any]]:
+    """Fallback entries from the JSON form [{"provider": "OpenAI", "model": "gpt-4o-mini", "api_key": "..."}]"""
+    try:
+        entries = json.loads(value)
+    except ValueError:
+        raise InvalidFallbackRoute('Fallback route must be valid JSON')
+    if not isinstance(entries, list) or not all(
+            isinstance(entry, dict) and all(isinstance(entry.get(field, ''), str)
+                                            for field in ('provider', 'model', 'api_key'))
+            for entry in entries):
+        raise InvalidFallbackRoute('Fallback route must be a JSON list of {"provider", "model"} objects')
+    return entries
+
+
+class Attempt:
+    """One call to one target; cancelling it closes the upstream response it is reading"""
+
+    def __init__(self, target: RouteTarget):
+        self.target = target
+        self.started = time.monotonic()
+        self.cancelled = threading.Event()
+        self._response = None
+        self._lock = threading.Lock()
+
+    def bind(self, response: requests.Response) -> requests.Response:
+        """Register the open response so a later cancel can close it"""
+        with self._lock:
+            self._response = response
+            cancelled = self.cancelled.is_set()
+        if cancelled:
+            response.close()
+            raise AttemptCancelled()
+        return response
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled.set()
+            response = self._response
+        if response is not None:
+            response.close()
+
+
+def is_failover_error(error: Exception) -> bool:
+    """Errors that say the target is unavailable rather than that the request is bad"""
+    if isinstance(error, UpstreamError):
+        return error.status_code in RETRY_STATUSES
+    return isinstance(error, (requests.ConnectionError, requests.Timeout, CircuitOpenError, NoKeyAvailable))
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class HedgedRouter:
+    def __init__(self, workers: Optional[int] = None, default_delay: Optional[float] = None,
+                 min_delay: Optional[float] = None, min_samples: Optional[int] = None,
+                 window: int = 200):
+        env = os.environ.get
+        self.default_delay = default_delay if default_delay is not None else float(env('HEDGE_DEFAULT_DELAY', 10))
+        self.min_delay = min_delay if min_delay is not None else float(env('HEDGE_MIN_DELAY', 1))
+        self.min_samples = min_samples if min_samples is not None else int(env('HEDGE_MIN_SAMPLES', 20))
+        self.window = window
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers if workers is not None else int(env('HEDGE_WORKERS', 32)),
+            thread_name_prefix='chat-hedge',
+        )
+        self._latencies: Dict[Tuple[str, str], deque] = {}
+        self._lock = threading.Lock()
+
+        # Counters
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def record_latency(self, target: RouteTarget, seconds: float):
+        key = (target.provider, target.model)
+        with self._lock:
+            samples = self._latencies.get(key)
+            if samples is None:
+                samples = self._latencies[key] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def record_failover(self):
+        with self._lock:
+            self.failovers += 1
+
+    def hedge_delay(self, target: RouteTarget) -> float:
+        """Seconds to wait for a target before hedging: its p95, or the default until enough samples exist"""
+        with self._lock:
+            samples = list(self._latencies.get((target.provider, target.model), ()))
+        if len(samples) < self.min_samples:
+            return self.default_delay
+        return max(percentile(samples, 0.95), self.min_delay)
+
+    def _timed(self, attempt: Attempt, call: Callable[[Attempt], Any]) -> Any:
+        if attempt.cancelled.is_set():
+            raise AttemptCancelled()
+        try:
+            result = call(attempt)
+        except AttemptCancelled:
+            # Keep slow losers in the samples too, or the p95 would only ever see the fast answers
+            self.record_latency(attempt.target, time.monotonic() - attempt.started)
+            raise
+        self.record_latency(attempt.target, time.monotonic() - attempt.started)
+        return result
+
+    def run(self, targets: List[RouteTarget], call: Callable[[Attempt], Any]) -> Tuple[Any, Dict[str, Any]]:
+        """Run call(attempt) along the route; returns (result, routing info for the winner)"""
+        with self._lock:
+            self.requests += 1
+
+        pending = {}
+        launched = []
+        hedged = False
+        failovers = 0
+        last_error = None
+
+        def launch():
+            attempt = Attempt(targets[len(launched)])
+            launched.append(attempt)
+            pending[self._executor.submit(self._timed, attempt, call)] = attempt
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if len(launched) < len(targets):
+                    newest = launched[-1]
+                    timeout = max(newest.started + self.hedge_delay(newest.target) - time.monotonic(), 0)
+
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    # The newest attempt is slower than usual: race the next target against it
+                    hedged = True
+                    with self._lock:
+                        self.hedges += 1
+                    launch()
+                    continue
+
+                for future in done:
+                    attempt = pending.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        last_error = e
+                        if is_failover_error(e) and len(launched) < len(targets) and not pending:
+                            failovers += 1
+                            self.record_failover()
+                            launch()
+                        continue
+
+                    if hedged and attempt is not launched[0]:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return result, {
+                        'provider': attempt.target.provider,
+                        'model': attempt.target.model,
+                        'hedged': hedged,
+                        'failovers': failovers,
+                    }
+            raise last_error
+        finally:
+            for attempt in pending.values():
+                attempt.cancel()
+
+    async def _timed_async(self, attempt: Attempt, call: Callable[[Attempt], Awaitable[Any]]) -> Any:
+        try:
+            result = await call(attempt)
+        except asyncio.CancelledError:
+            self.record_latency(attempt.target, time.monotonic() - attempt.started)
+            raise
+        self.record_latency(attempt.target, time.monotonic() - attempt.started)
+        return result
+
+    async def run_async(self, targets: List[RouteTarget],
+                        call: Callable[[Attempt], Awaitable[Any]]) -> Tuple[Any, Dict[str, Any]]:
+        """Coroutine version of run: each attempt is a task, and losing tasks are cancelled"""
+        with self._lock:
+            self.requests += 1
+
+        pending = {}
+        launched = []
+        hedged = False
+        failovers = 0
+        last_error = None
+
+        def launch():
+            attempt = Attempt(targets[len(launched)])
+            launched.append(attempt)
+            pending[asyncio.ensure_future(self._timed_async(attempt, call))] = attempt
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if len(launched) < len(targets):
+                    newest = launched[-1]
+                    timeout = max(newest.started + self.hedge_delay(newest.target) - time.monotonic(), 0)
+
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    with self._lock:
+                        self.hedges += 1
+                    launch()
+                    continue
+
+                for task in done:
+                    attempt = pending.pop(task)
+                    error = task.exception()
+                    if error is not None:
+                        last_error = error
+                        if is_failover_error(error) and len(launched) < len(targets) and not pending:
+                            failovers += 1
+                            self.record_failover()
+                            launch()
+                        continue
+
+                    if hedged and attempt is not launched[0]:
+                        with self._lock:
+                            self.hedge_wins += 1
+                    return task.result(), {
+                        'provider': attempt.target.provider,
+                        'model': attempt.target.model,
+                        'hedged': hedged,
+                        'failovers': failovers,
+                    }
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            latencies = {key: list(samples) for key, samples in self._latencies.items()}
+            stats = {
+                'requests': self.requests,
+                'hedges': self.hedges,
+                'hedge_wins': self.hedge_wins,
+                'failovers': self.failovers,
+                'hedge_rate': round(self.hedges / self.requests, 4) if self.requests else 0.0,
+            }
+
+        targets = {}
+        for (provider, model), samples in latencies.items():
+            targets[f'{provider} {model}'] = {
+                'samples': len(samples),
+                'p50': round(percentile(samples, 0.5), 3),
+                'p95': round(percentile(samples, 0.95), 3),
+                'hedge_delay': round(self.hedge_delay(RouteTarget(provider, model, '')), 3),
+            }
+        stats['targets'] = targets
+        return stats
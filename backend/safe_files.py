@@ -0,0 +1,140 @@
+"""
+Crash-safe and multi-process-safe file helpers for the storage engines.
+
+Whole-file writes go to a temporary file in the same directory, are fsynced
+and then renamed over the target, so a reader or a crash only ever sees the
+old or the new contents, never a half-written file. FileLock serialises
+writers across processes (several WSGI workers on one host) with an advisory
+lock on a sidecar ".lock" file: fcntl.flock on POSIX, msvcrt.locking on
+Windows. Readers of renamed files need no lock because every rename swaps in
+a complete file; appenders and readers of append-only files use exclusive
+and shared locks respectively.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from metrics import REGISTRY
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+LOCK_WAIT = REGISTRY.histogram('storage_lock_wait_seconds', 'Time spent waiting to acquire a storage lock', ('lock',))
+
+
+class FileLock:
+    """Advisory inter-process lock on `path` (created if missing), also exclusive between threads"""
+
+    def __init__(self, path: str, name: Optional[str] = None):
+        self.path = path
+        self.name = name or os.path.basename(path)
+        # flock locks belong to each open() of the file, so threads already exclude each
+        # other on POSIX; msvcrt locks do not, so Windows also takes a thread lock
+        self._thread_lock = threading.Lock() if fcntl is None else None
+
+    def acquire(self, shared: bool = False) -> int:
+        started = time.perf_counter()
+        if self._thread_lock is not None:
+            self._thread_lock.acquire()
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                else:
+                    # msvcrt has no shared locks and LK_LOCK gives up after ~10 seconds
+                    while True:
+                        try:
+                            msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError:
+                            time.sleep(0.05)
+            except BaseException:
+                os.close(fd)
+                raise
+        except BaseException:
+            if self._thread_lock is not None:
+                self._thread_lock.release()
+            raise
+        LOCK_WAIT.observe(time.perf_counter() - started, self.name)
+        return fd
+
+    def release(self, fd: int):
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(fd)
+            if self._thread_lock is not None:
+                self._thread_lock.release()
+
+    def exclusive(self) -> '_Held':
+        return _Held(self, shared=False)
+
+    def shared(self) -> '_Held':
+        return _Held(self, shared=True)
+
+
+class _Held:
+    def __init__(self, lock: FileLock, shared: bool):
+        self.lock = lock
+        self.shared = shared
+        self._fd = None
+
+    def __enter__(self):
+        self._fd = self.lock.acquire(self.shared)
+        return self
+
+    def __exit__(self, *exc):
+        self.lock.release(self._fd)
+        return False
+
+
+def fsync_dir(path: str):
+    """Persist a rename or new file in `path` (a no-op where directories cannot be opened)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path: str, text: str):
+    """Replace `path` with `text` via temp file + fsync + rename"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    fsync_dir(directory)
+
+
+def append_lines(path: str, lines):
+    """Append lines in one write and fsync them"""
+    with open(path, 'a') as f:
+        f.write(''.join(lines))
+        f.flush()
+        os.fsync(f.fileno())
@@ -0,0 +1,172 @@
+"""
+Per-user inverted index for full-text search over chat history.
+
+Maps each term to the conversations containing it and how often, so a query
+only touches the postings of its own terms instead of every message. Results
+are ranked with BM25, can be filtered by subject and grade, and come with a
+snippet around the first match. Conversations are added, extended with new
+exchanges, or removed one at a time as history is saved and deleted.
+"""
+
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+TOKEN = re.compile(r'[a-z0-9]+')
+STOPWORDS = frozenset(
+    'a an and are as at be but by do does for from how i if in is it me my of on or so that the this to was '
+    'what when where which who why will with you your'.split()
+)
+SNIPPET_LENGTH = 160
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    return [term for term in TOKEN.findall(text.lower()) if term not in STOPWORDS]
+
+
+def conversation_texts(conversation_data: Dict[str, Any]) -> List[str]:
+    """User and bot message texts stored on a conversation record"""
+    messages = conversation_data.get('messages')
+    if messages:
+        return [str(message.get('message', '')) for message in messages if message.get('type') in ('user', 'bot')]
+    return turn_texts(conversation_data.get('last_message') or {})
+
+
+def turn_texts(turn: Dict[str, Any]) -> List[str]:
+    return [str(turn[field]) for field in ('user', 'bot') if turn.get(field)]
+
+
+def make_snippet(text: str, terms: Iterable[str]) -> str:
+    """Window of the text around the first query term it contains"""
+    lowered = text.lower()
+    start = None
+    for match in TOKEN.finditer(lowered):
+        if match.group() in terms:
+            start = match.start()
+            break
+    if start is None or len(text) <= SNIPPET_LENGTH:
+        return text[:SNIPPET_LENGTH]
+
+    start = max(min(start - SNIPPET_LENGTH // 4, len(text) - SNIPPET_LENGTH), 0)
+    snippet = text[start:start + SNIPPET_LENGTH]
+    return ('…' if start > 0 else '') + snippet + ('…' if start + SNIPPET_LENGTH < len(text) else '')
+
+
+class _Document:
+    def __init__(self, subject: str, grade: str, timestamp: str):
+        self.subject = subject
+        self.grade = grade
+        self.timestamp = timestamp
+        self.texts: List[str] = []
+        self.terms: Counter = Counter()
+        self.length = 0
+
+
+class SearchIndex:
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, int]] = {}  # term -> {conversation_id: term frequency}
+        self._documents: Dict[str, _Document] = {}
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self._documents)
+
+    def __contains__(self, conversation_id: str) -> bool:
+        return conversation_id in self._documents
+
+    def add(self, conversation_id: str, texts: List[str], subject: str = '', grade: str = '', timestamp: str = ''):
+        """Index a conversation, replacing whatever was indexed for it before"""
+        self.remove(conversation_id)
+        self._documents[conversation_id] = _Document(str(subject or ''), str(grade or ''), timestamp)
+        self.extend(conversation_id, texts)
+
+    def extend(self, conversation_id: str, texts: List[str], subject: Optional[str] = None,
+               grade: Optional[str] = None, timestamp: Optional[str] = None):
+        """Add new message texts (e.g. the latest exchange) to an indexed conversation"""
+        document = self._documents.get(conversation_id)
+        if document is None:
+            self.add(conversation_id, texts, subject or '', grade or '', timestamp or '')
+            return
+        if subject is not None:
+            document.subject = str(subject)
+        if grade is not None:
+            document.grade = str(grade)
+        if timestamp is not None:
+            document.timestamp = timestamp
+
+        terms = Counter()
+        for text in texts:
+            terms.update(tokenize(text))
+        document.texts.extend(texts)
+        document.terms.update(terms)
+        document.length += sum(terms.values())
+        self._total_length += sum(terms.values())
+        for term, count in terms.items():
+            postings = self._postings.setdefault(term, {})
+            postings[conversation_id] = postings.get(conversation_id, 0) + count
+
+    def remove(self, conversation_id: str) -> bool:
+        document = self._documents.pop(conversation_id, None)
+        if document is None:
+            return False
+        for term in document.terms:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(conversation_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= document.length
+        return True
+
+    def clear(self):
+        self._postings.clear()
+        self._documents.clear()
+        self._total_length = 0
+
+    def search(self, query: str, limit: int = 20, subject: Optional[str] = None,
+               grade: Optional[str] = None) -> Tuple[int, List[Dict[str, Any]]]:
+        """(number of matches, best `limit` matches) for a query, best first"""
+        terms = set(tokenize(query))
+        if not terms or not self._documents:
+            return 0, []
+
+        subject = subject.lower() if subject else None
+        grade = grade.lower() if grade else None
+        document_count = len(self._documents)
+        average_length = self._total_length / document_count or 1
+
+        scores: Dict[str, float] = {}
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (document_count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for conversation_id, frequency in postings.items():
+                document = self._documents[conversation_id]
+                if subject is not None and document.subject.lower() != subject:
+                    continue
+                if grade is not None and document.grade.lower() != grade:
+                    continue
+                norm = frequency + K1 * (1 - B + B * document.length / average_length)
+                scores[conversation_id] = scores.get(conversation_id, 0.0) + idf * frequency * (K1 + 1) / norm
+
+        # Best score first, newest first among equals
+        ranked = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], self._documents[item[0]].timestamp))
+        results = []
+        for conversation_id, score in ranked:
+            document = self._documents[conversation_id]
+            matched = sorted(term for term in terms if term in document.terms)
+            text = next((text for text in document.texts if set(tokenize(text)) & terms), '')
+            results.append({
+                'conversation_id': conversation_id,
+                'score': round(score, 4),
+                'matched_terms': matched,
+                'snippet': make_snippet(text, terms),
+            })
+        return len(scores), results
@@ -0,0 +1,129 @@
+"""
+Single-flight coalescing of identical in-flight calls.
+
+The first caller for a key runs the function; callers that arrive with the
+same key while it is still running wait for that call and share its result
+instead of starting their own. An error is not shared: it may come from the
+leader's own API key or limits, so each waiting caller then makes its own
+call.
+"""
+
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+        # Counters
+        self.leaders = 0
+        self.coalesced = 0
+        self.retried = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Run fn once per key at a time; returns (result, shared)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is None:
+                return call.result, True
+            with self._lock:
+                self.retried += 1
+            return fn(), False
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+                'retried': self.retried,
+            }
+
+
+class _AsyncCall:
+    def __init__(self, task: 'asyncio.Future'):
+        self.task = task
+        self.waiters = 0
+
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines on one event loop; the shared call is cancelled once all its callers are"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _AsyncCall] = {}
+
+        # Counters
+        self.leaders = 0
+        self.coalesced = 0
+        self.retried = 0
+
+    def _forget(self, key: Hashable, call: _AsyncCall):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Await fn() once per key at a time; returns (result, shared)"""
+        call = self._calls.get(key)
+        leader = call is None
+        if leader:
+            call = self._calls[key] = _AsyncCall(asyncio.ensure_future(fn()))
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), not leader
+        except asyncio.CancelledError:
+            if call.waiters == 1:
+                call.task.cancel()
+            raise
+        except Exception:
+            if leader:
+                raise
+        finally:
+            call.waiters -= 1
+
+        # The shared call failed: make our own rather than take on the leader's error
+        self.retried += 1
+        return await fn(), False
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            'in_flight': len(self._calls),
+            'leaders': self.leaders,
+            'coalesced': self.coalesced,
+            'retried': self.retried,
+        }
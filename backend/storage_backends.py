@@ -0,0 +1,626 @@
+"""
+Storage engines used by DataStorage.
+
+The JSON engine keeps the original whole-file layout (api_keys.json and
+chat_history.json). Its writers hold an inter-process lock and replace files
+atomically, so several worker processes can share one data directory. The SQLite engine stores one row per API key and per
+conversation, indexed on (user_id, conversation_id) and (user_id, timestamp),
+so single-conversation reads and writes no longer touch the rest of the data.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Any, Tuple
+
+from metrics import REGISTRY
+from safe_files import FileLock, append_lines, atomic_write
+
+STORAGE_SECONDS = REGISTRY.histogram(
+    'storage_operation_seconds', 'Time spent in storage engine operations', ('backend', 'operation'))
+
+
+class StorageBackend:
+    """Interface implemented by every storage engine"""
+
+    name = 'base'
+
+    # Data kinds, used for change tracking
+    API_KEYS = 'api_keys'
+    CONVERSATIONS = 'conversations'
+
+    def __init__(self):
+        self._recorded = threading.local()
+
+    def version(self, kind: str) -> tuple:
+        """Token that changes whenever the stored data of a kind changes"""
+        raise NotImplementedError
+
+    @contextmanager
+    def record_writes(self) -> Iterator[List[Tuple[str, tuple, tuple]]]:
+        """Collect (kind, before, after) version tokens of every write this thread makes in the block
+
+        The tokens are read while the write holds the engine's inter-process
+        lock, so `before` shows whether another process wrote since we last looked.
+        """
+        self._recorded.writes = writes = []
+        try:
+            yield writes
+        finally:
+            self._recorded.writes = None
+
+    def _record_write(self, kind: str, before: tuple, after: tuple):
+        writes = getattr(self._recorded, 'writes', None)
+        if writes is not None:
+            writes.append((kind, before, after))
+
+    # API keys
+    def get_user_api_keys(self, user_id: str) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def put_api_key(self, user_id: str, unique_key: str, key_data: Dict[str, Any]):
+        raise NotImplementedError
+
+    def delete_api_key(self, user_id: str, unique_key: str) -> bool:
+        raise NotImplementedError
+
+    # Conversations
+    def get_conversation(self, user_id: str, conversation_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def get_user_conversations(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        """Return all conversations for a user keyed by conversation ID"""
+        raise NotImplementedError
+
+    def list_conversations(self, user_id: str) -> List[Dict[str, Any]]:
+        """Return all conversations for a user, newest first"""
+        raise NotImplementedError
+
+    def iter_conversations(self, user_id: str) -> Iterator[Dict[str, Any]]:
+        """Yield a user's conversations newest first (engines that can stream rows override this)"""
+        return iter(self.list_conversations(user_id))
+
+    def put_conversation(self, user_id: str, conversation_id: str, conversation_data: Dict[str, Any]):
+        raise NotImplementedError
+
+    def put_conversations(self, user_id: str, conversations: Dict[str, Dict[str, Any]]):
+        """Save several conversations of a user in one group write"""
+        raise NotImplementedError
+
+    def put_conversations_batch(self, conversations_by_user: Dict[str, Dict[str, Dict[str, Any]]]):
+        """Save conversations of several users in one group write"""
+        for user_id, conversations in conversations_by_user.items():
+            self.put_conversations(user_id, conversations)
+
+    def delete_conversation(self, user_id: str, conversation_id: str) -> bool:
+        raise NotImplementedError
+
+    def delete_conversations(self, user_id: str, conversation_ids: List[str]) -> int:
+        """Delete several conversations and their transcripts in one group write"""
+        raise NotImplementedError
+
+    def list_users(self) -> List[str]:
+        """IDs of every user with stored conversations"""
+        raise NotImplementedError
+
+    def clear_conversations(self, user_id: str) -> bool:
+        raise NotImplementedError
+
+    # Transcripts (append-only turns of a conversation)
+    def append_turn(self, user_id: str, conversation_id: str, turn: Dict[str, Any]):
+        raise NotImplementedError
+
+    def append_turns(self, user_id: str, turns: List[Tuple[str, Dict[str, Any]]]):
+        """Append (conversation_id, turn) pairs in one group write"""
+        raise NotImplementedError
+
+    def append_turns_batch(self, turns_by_user: Dict[str, List[Tuple[str, Dict[str, Any]]]]):
+        """Append turns of several users in one group write"""
+        for user_id, turns in turns_by_user.items():
+            self.append_turns(user_id, turns)
+
+    def get_turns(self, user_id: str, conversation_id: str) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def delete_turns(self, user_id: str, conversation_ids: List[str]):
+        """Drop the transcripts of several conversations"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class JsonBackend(StorageBackend):
+    """Original engine: one JSON document per data type, rewritten on every change"""
+
+    name = 'json'
+
+    def __init__(self, data_dir: str):
+        super().__init__()
+        self.data_dir = data_dir
+        self.api_keys_file = os.path.join(data_dir, 'api_keys.json')
+        self.chat_history_file = os.path.join(data_dir, 'chat_history.json')
+        self._files = {self.API_KEYS: self.api_keys_file, self.CONVERSATIONS: self.chat_history_file}
+        self._generations = {self.API_KEYS: 0, self.CONVERSATIONS: 0}
+        self.transcripts_dir = os.path.join(data_dir, 'transcripts')
+        os.makedirs(self.transcripts_dir, exist_ok=True)
+
+        # Writers of a file serialise on its lock, across threads and worker processes.
+        # Readers take no lock: files are only ever replaced whole by an atomic rename.
+        self._locks = {kind: FileLock(file_path + '.lock', os.path.basename(file_path))
+                       for kind, file_path in self._files.items()}
+        self._transcripts_lock = FileLock(os.path.join(self.transcripts_dir, '.lock'), 'transcripts')
+        self._init_data_files()
+
+    def _init_data_files(self):
+        """Initialize data files with empty structures if they don't exist"""
+        for kind, file_path in self._files.items():
+            with self._locks[kind].exclusive():
+                if not os.path.exists(file_path):
+                    atomic_write(file_path, '{}')
+
+    def _load_json_file(self, file_path: str) -> Dict[str, Any]:
+        """Safely load JSON data from file"""
+        try:
+            with STORAGE_SECONDS.time(self.name, 'load'), open(file_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_json_file(self, kind: str, data: Dict[str, Any]):
+        """Atomically replace a data file (the caller holds its lock)"""
+        # Compact separators: pretty-printing roughly doubled the file size
+        with STORAGE_SECONDS.time(self.name, 'serialize'):
+            text = json.dumps(data, separators=(',', ':'), default=str)
+        with STORAGE_SECONDS.time(self.name, 'write'):
+            atomic_write(self._files[kind], text)
+        self._generations[kind] += 1
+
+    def version(self, kind: str) -> tuple:
+        # Writes from other processes show up as a new inode/mtime/size, our own as a new generation
+        try:
+            stat = os.stat(self._files[kind])
+            return (stat.st_ino, stat.st_mtime_ns, stat.st_size, self._generations[kind])
+        except FileNotFoundError:
+            return (0, 0, 0, self._generations[kind])
+
+    @contextmanager
+    def _writing(self, kind: str):
+        """Hold a data file's write lock, recording its version tokens around the write"""
+        with self._locks[kind].exclusive():
+            before = self.version(kind)
+            yield
+            after = self.version(kind)
+        self._record_write(kind, before, after)
+
+    def get_user_api_keys(self, user_id: str) -> Dict[str, Any]:
+        return self._load_json_file(self.api_keys_file).get(user_id, {})
+
+    def put_api_key(self, user_id: str, unique_key: str, key_data: Dict[str, Any]):
+        with self._writing(self.API_KEYS):
+            data = self._load_json_file(self.api_keys_file)
+            data.setdefault(user_id, {})[unique_key] = key_data
+            self._save_json_file(self.API_KEYS, data)
+
+    def delete_api_key(self, user_id: str, unique_key: str) -> bool:
+        with self._writing(self.API_KEYS):
+            data = self._load_json_file(self.api_keys_file)
+            if user_id not in data or unique_key not in data[user_id]:
+                return False
+
+            del data[user_id][unique_key]
+
+            # Remove user entry if no keys left
+            if not data[user_id]:
+                del data[user_id]
+
+            self._save_json_file(self.API_KEYS, data)
+            return True
+
+    def get_conversation(self, user_id: str, conversation_id: str) -> Optional[Dict[str, Any]]:
+        return self._load_json_file(self.chat_history_file).get(user_id, {}).get(conversation_id)
+
+    def get_user_conversations(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        return self._load_json_file(self.chat_history_file).get(user_id, {})
+
+    def list_conversations(self, user_id: str) -> List[Dict[str, Any]]:
+        conversations = list(self._load_json_file(self.chat_history_file).get(user_id, {}).values())
+        conversations.sort(key=lambda x: x.get('timestamp', ''), reverse=True)
+        return conversations
+
+    def put_conversation(self, user_id: str, conversation_id: str, conversation_data: Dict[str, Any]):
+        self.put_conversations(user_id, {conversation_id: conversation_data})
+
+    def put_conversations(self, user_id: str, conversations: Dict[str, Dict[str, Any]]):
+        self.put_conversations_batch({user_id: conversations})
+
+    def put_conversations_batch(self, conversations_by_user: Dict[str, Dict[str, Dict[str, Any]]]):
+        with self._writing(self.CONVERSATIONS):
+            data = self._load_json_file(self.chat_history_file)
+            for user_id, conversations in conversations_by_user.items():
+                data.setdefault(user_id, {}).update(conversations)
+            self._save_json_file(self.CONVERSATIONS, data)
+
+    def delete_conversation(self, user_id: str, conversation_id: str) -> bool:
+        with self._writing(self.CONVERSATIONS):
+            data = self._load_json_file(self.chat_history_file)
+            if user_id not in data or conversation_id not in data[user_id]:
+                return False
+
+            del data[user_id][conversation_id]
+            self._save_json_file(self.CONVERSATIONS, data)
+
+        self.delete_turns(user_id, [conversation_id])
+        return True
+
+    def delete_conversations(self, user_id: str, conversation_ids: List[str]) -> int:
+        with self._writing(self.CONVERSATIONS):
+            data = self._load_json_file(self.chat_history_file)
+            conversations = data.get(user_id, {})
+            deleted = [conversation_id for conversation_id in conversation_ids
+                       if conversations.pop(conversation_id, None) is not None]
+            if deleted:
+                self._save_json_file(self.CONVERSATIONS, data)
+
+        self.delete_turns(user_id, deleted)
+        return len(deleted)
+
+    def list_users(self) -> List[str]:
+        return list(self._load_json_file(self.chat_history_file))
+
+    def clear_conversations(self, user_id: str) -> bool:
+        with self._writing(self.CONVERSATIONS):
+            data = self._load_json_file(self.chat_history_file)
+            if user_id not in data:
+                return False
+
+            del data[user_id]
+            self._save_json_file(self.CONVERSATIONS, data)
+
+        with self._transcripts_lock.exclusive():
+            shutil.rmtree(self._transcript_dir(user_id), ignore_errors=True)
+        return True
+
+    def _transcript_dir(self, user_id: str) -> str:
+        # User and conversation IDs come from clients, so hash them into safe file names
+        return os.path.join(self.transcripts_dir, hashlib.sha1(user_id.encode('utf-8')).hexdigest())
+
+    def _transcript_file(self, user_id: str, conversation_id: str) -> str:
+        file_name = hashlib.sha1(conversation_id.encode('utf-8')).hexdigest() + '.jsonl'
+        return os.path.join(self._transcript_dir(user_id), file_name)
+
+    def append_turn(self, user_id: str, conversation_id: str, turn: Dict[str, Any]):
+        self.append_turns(user_id, [(conversation_id, turn)])
+
+    def append_turns(self, user_id: str, turns: List[Tuple[str, Dict[str, Any]]]):
+        self.append_turns_batch({user_id: turns})
+
+    def append_turns_batch(self, turns_by_user: Dict[str, List[Tuple[str, Dict[str, Any]]]]):
+        lines_by_file: Dict[str, List[str]] = {}
+        for user_id, turns in turns_by_user.items():
+            for conversation_id, turn in turns:
+                lines_by_file.setdefault(self._transcript_file(user_id, conversation_id), []).append(
+                    json.dumps(turn, default=str) + '\n')
+
+        with self._transcripts_lock.exclusive(), STORAGE_SECONDS.time(self.name, 'append_turns'):
+            for transcript_file, lines in lines_by_file.items():
+                os.makedirs(os.path.dirname(transcript_file), exist_ok=True)
+                append_lines(transcript_file, lines)
+
+    def delete_turns(self, user_id: str, conversation_ids: List[str]):
+        with self._transcripts_lock.exclusive():
+            for conversation_id in conversation_ids:
+                transcript_file = self._transcript_file(user_id, conversation_id)
+                if os.path.exists(transcript_file):
+                    os.remove(transcript_file)
+
+    def get_turns(self, user_id: str, conversation_id: str) -> List[Dict[str, Any]]:
+        try:
+            with self._transcripts_lock.shared(), open(self._transcript_file(user_id, conversation_id), 'r') as f:
+                lines = [line for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+        turns = []
+        for line in lines:
+            try:
+                turns.append(json.loads(line))
+            except json.JSONDecodeError:
+                # A crash mid-append can leave a torn last line; the turns before it are intact
+                continue
+        return turns
+
+
+class SqliteBackend(StorageBackend):
+    """Embedded indexed engine: one row per API key and per conversation"""
+
+    name = 'sqlite'
+
+    SCHEMA = (
+        """CREATE TABLE IF NOT EXISTS api_keys (
+            user_id TEXT NOT NULL,
+            unique_key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (user_id, unique_key)
+        )""",
+        """CREATE TABLE IF NOT EXISTS conversations (
+            user_id TEXT NOT NULL,
+            conversation_id TEXT NOT NULL,
+            timestamp TEXT NOT NULL DEFAULT '',
+            data TEXT NOT NULL,
+            PRIMARY KEY (user_id, conversation_id)
+        )""",
+        """CREATE INDEX IF NOT EXISTS idx_conversations_user_timestamp
+            ON conversations (user_id, timestamp)""",
+        """CREATE TABLE IF NOT EXISTS turns (
+            user_id TEXT NOT NULL,
+            conversation_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (user_id, conversation_id, seq)
+        )""",
+    )
+
+    def __init__(self, data_dir: str, db_file: str = 'storage.db'):
+        super().__init__()
+        self.data_dir = data_dir
+        self.db_path = os.path.join(data_dir, db_file)
+        self._lock = threading.Lock()
+        # Other worker processes may hold the write lock; wait for it rather than failing
+        self._conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._generations = {self.API_KEYS: 0, self.CONVERSATIONS: 0}
+        with self._conn:
+            for statement in self.SCHEMA:
+                self._conn.execute(statement)
+
+    @staticmethod
+    def _timestamp_key(conversation_data: Dict[str, Any]) -> str:
+        timestamp = conversation_data.get('timestamp')
+        return '' if timestamp is None else str(timestamp)
+
+    def _query(self, sql: str, params=()) -> List[tuple]:
+        with self._lock, STORAGE_SECONDS.time(self.name, 'query'):
+            return self._conn.execute(sql, params).fetchall()
+
+    def _execute(self, kind: str, sql: str, params=()) -> int:
+        with self._writing(kind):
+            return self._conn.execute(sql, params).rowcount
+
+    def _version(self, kind: str) -> tuple:
+        # data_version only moves for commits made through other connections
+        data_version = self._conn.execute('PRAGMA data_version').fetchone()[0]
+        return (data_version, self._generations[kind])
+
+    def version(self, kind: str) -> tuple:
+        with self._lock:
+            return self._version(kind)
+
+    @contextmanager
+    def _writing(self, kind: str, operation: str = 'write'):
+        """One transaction holding the database write lock, recording the version tokens around it"""
+        with self._lock, STORAGE_SECONDS.time(self.name, operation):
+            with self._conn:
+                # Take the write lock up front, so no other process can commit between here and our commit
+                self._conn.execute('BEGIN IMMEDIATE')
+                before = self._version(kind)
+                yield
+                # Our own commit leaves data_version alone; the generation marks it
+                self._generations[kind] += 1
+                after = self._version(kind)
+            self._record_write(kind, before, after)
+
+    def get_user_api_keys(self, user_id: str) -> Dict[str, Any]:
+        rows = self._query('SELECT unique_key, data FROM api_keys WHERE user_id = ?', (user_id,))
+        return {unique_key: json.loads(data) for unique_key, data in rows}
+
+    def put_api_key(self, user_id: str, unique_key: str, key_data: Dict[str, Any]):
+        self._execute(
+            self.API_KEYS,
+            'INSERT OR REPLACE INTO api_keys (user_id, unique_key, data) VALUES (?, ?, ?)',
+            (user_id, unique_key, json.dumps(key_data, default=str)),
+        )
+
+    def delete_api_key(self, user_id: str, unique_key: str) -> bool:
+        return self._execute(
+            self.API_KEYS,
+            'DELETE FROM api_keys WHERE user_id = ? AND unique_key = ?', (user_id, unique_key)
+        ) > 0
+
+    def get_conversation(self, user_id: str, conversation_id: str) -> Optional[Dict[str, Any]]:
+        rows = self._query(
+            'SELECT data FROM conversations WHERE user_id = ? AND conversation_id = ?',
+            (user_id, conversation_id),
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def get_user_conversations(self, user_id: str) -> Dict[str, Dict[str, Any]]:
+        rows = self._query(
+            'SELECT conversation_id, data FROM conversations WHERE user_id = ?', (user_id,)
+        )
+        return {conversation_id: json.loads(data) for conversation_id, data in rows}
+
+    def list_conversations(self, user_id: str) -> List[Dict[str, Any]]:
+        rows = self._query(
+            'SELECT data FROM conversations WHERE user_id = ? ORDER BY timestamp DESC',
+            (user_id,),
+        )
+        return [json.loads(data) for (data,) in rows]
+
+    def iter_conversations(self, user_id: str) -> Iterator[Dict[str, Any]]:
+        # A separate read connection streams rows from one snapshot without holding the shared lock
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            cursor = conn.execute(
+                'SELECT data FROM conversations WHERE user_id = ? ORDER BY timestamp DESC',
+                (user_id,),
+            )
+            for (data,) in cursor:
+                yield json.loads(data)
+        finally:
+            conn.close()
+
+    def put_conversation(self, user_id: str, conversation_id: str, conversation_data: Dict[str, Any]):
+        self.put_conversations(user_id, {conversation_id: conversation_data})
+
+    def put_conversations(self, user_id: str, conversations: Dict[str, Dict[str, Any]]):
+        self.put_conversations_batch({user_id: conversations})
+
+    def put_conversations_batch(self, conversations_by_user: Dict[str, Dict[str, Dict[str, Any]]]):
+        rows = [
+            (user_id, conversation_id, self._timestamp_key(conversation_data),
+             json.dumps(conversation_data, default=str))
+            for user_id, conversations in conversations_by_user.items()
+            for conversation_id, conversation_data in conversations.items()
+        ]
+        with self._writing(self.CONVERSATIONS):
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO conversations (user_id, conversation_id, timestamp, data) '
+                'VALUES (?, ?, ?, ?)',
+                rows,
+            )
+
+    def delete_conversation(self, user_id: str, conversation_id: str) -> bool:
+        deleted = self._execute(
+            self.CONVERSATIONS,
+            'DELETE FROM conversations WHERE user_id = ? AND conversation_id = ?',
+            (user_id, conversation_id),
+        ) > 0
+        self._execute(
+            self.CONVERSATIONS,
+            'DELETE FROM turns WHERE user_id = ? AND conversation_id = ?',
+            (user_id, conversation_id),
+        )
+        return deleted
+
+    def delete_conversations(self, user_id: str, conversation_ids: List[str]) -> int:
+        rows = [(user_id, conversation_id) for conversation_id in conversation_ids]
+        with self._writing(self.CONVERSATIONS):
+            deleted = self._conn.executemany(
+                'DELETE FROM conversations WHERE user_id = ? AND conversation_id = ?', rows
+            ).rowcount
+            self._conn.executemany('DELETE FROM turns WHERE user_id = ? AND conversation_id = ?', rows)
+        return deleted
+
+    def list_users(self) -> List[str]:
+        return [user_id for (user_id,) in self._query('SELECT DISTINCT user_id FROM conversations')]
+
+    def clear_conversations(self, user_id: str) -> bool:
+        cleared = self._execute(
+            self.CONVERSATIONS, 'DELETE FROM conversations WHERE user_id = ?', (user_id,)
+        ) > 0
+        self._execute(self.CONVERSATIONS, 'DELETE FROM turns WHERE user_id = ?', (user_id,))
+        return cleared
+
+    def append_turn(self, user_id: str, conversation_id: str, turn: Dict[str, Any]):
+        self.append_turns(user_id, [(conversation_id, turn)])
+
+    def append_turns(self, user_id: str, turns: List[Tuple[str, Dict[str, Any]]]):
+        self.append_turns_batch({user_id: turns})
+
+    def append_turns_batch(self, turns_by_user: Dict[str, List[Tuple[str, Dict[str, Any]]]]):
+        with self._lock, self._conn, STORAGE_SECONDS.time(self.name, 'append_turns'):
+            self._conn.executemany(
+                'INSERT INTO turns (user_id, conversation_id, seq, data) '
+                'SELECT ?, ?, COALESCE(MAX(seq), 0) + 1, ? FROM turns '
+                'WHERE user_id = ? AND conversation_id = ?',
+                [(user_id, conversation_id, json.dumps(turn, default=str), user_id, conversation_id)
+                 for user_id, turns in turns_by_user.items()
+                 for conversation_id, turn in turns],
+            )
+
+    def get_turns(self, user_id: str, conversation_id: str) -> List[Dict[str, Any]]:
+        rows = self._query(
+            'SELECT data FROM turns WHERE user_id = ? AND conversation_id = ? ORDER BY seq',
+            (user_id, conversation_id),
+        )
+        return [json.loads(data) for (data,) in rows]
+
+    def delete_turns(self, user_id: str, conversation_ids: List[str]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'DELETE FROM turns WHERE user_id = ? AND conversation_id = ?',
+                [(user_id, conversation_id) for conversation_id in conversation_ids],
+            )
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+BACKENDS = {
+    JsonBackend.name: JsonBackend,
+    SqliteBackend.name: SqliteBackend,
+}
+
+
+def create_backend(name: str, data_dir: str) -> StorageBackend:
+    """Instantiate a storage engine by name ('json' or 'sqlite')"""
+    try:
+        backend_class = BACKENDS[name.lower()]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend '{name}'. Choose one of: {', '.join(BACKENDS)}")
+    return backend_class(data_dir)
+
+
+def migrate_json_to_sqlite(data_dir: str = 'data') -> Dict[str, int]:
+    """One-shot copy of api_keys.json and chat_history.json into the SQLite engine"""
+    source = JsonBackend(data_dir)
+    target = SqliteBackend(data_dir)
+
+    api_keys = source._load_json_file(source.api_keys_file)
+    chat_history = source._load_json_file(source.chat_history_file)
+
+    key_rows = [
+        (user_id, unique_key, json.dumps(key_data, default=str))
+        for user_id, user_keys in api_keys.items()
+        for unique_key, key_data in user_keys.items()
+    ]
+    conversation_rows = [
+        (user_id, conversation_id, target._timestamp_key(conversation),
+         json.dumps(conversation, default=str))
+        for user_id, conversations in chat_history.items()
+        for conversation_id, conversation in conversations.items()
+    ]
+
+    turn_rows = [
+        (user_id, conversation_id, seq, json.dumps(turn, default=str))
+        for user_id, conversations in chat_history.items()
+        for conversation_id in conversations
+        for seq, turn in enumerate(source.get_turns(user_id, conversation_id), start=1)
+    ]
+
+    with target._lock, target._conn:
+        target._conn.executemany(
+            'INSERT OR REPLACE INTO turns (user_id, conversation_id, seq, data) VALUES (?, ?, ?, ?)',
+            turn_rows,
+        )
+        target._conn.executemany(
+            'INSERT OR REPLACE INTO api_keys (user_id, unique_key, data) VALUES (?, ?, ?)',
+            key_rows,
+        )
+        target._conn.executemany(
+            'INSERT OR REPLACE INTO conversations (user_id, conversation_id, timestamp, data) '
+            'VALUES (?, ?, ?, ?)',
+            conversation_rows,
+        )
+    target.close()
+
+    return {'api_keys': len(key_rows), 'conversations': len(conversation_rows), 'turns': len(turn_rows)}
+
+
+if __name__ == '__main__':
+    # Usage: python storage_backends.py migrate [data_dir]
+    if len(sys.argv) < 2 or sys.argv[1] != 'migrate':
+        print('Usage: python storage_backends.py migrate [data_dir]')
+        sys.exit(1)
+
+    counts = migrate_json_to_sqlite(sys.argv[2] if len(sys.argv) > 2 else 'data')
+    print(f"Migrated {counts['api_keys']} API keys, {counts['conversations']} conversations "
+          f"and {counts['turns']} conversation turns to SQLite")
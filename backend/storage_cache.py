@@ -0,0 +1,118 @@
+"""
+In-memory, write-through cache of parsed per-user storage views.
+
+Each cached view is tagged with the backend version token of its data kind.
+Reads only go back to the storage engine when that token moves (another
+process changed the file, or the generation counter was bumped without a
+matching write-through), and cold users are evicted in LRU order.
+
+The cache also counts writes per user, so callers can tell whether a user's
+data may have changed since they last looked (see `generation`) without
+reading it.
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+
+class UserViewCache:
+    def __init__(self, max_users: int = 1000):
+        self.max_users = max_users
+        self._views = OrderedDict()  # (kind, user_id) -> view
+        self._versions: Dict[str, Hashable] = {}  # kind -> token the cached views match
+        self._epochs: Dict[str, int] = {}  # kind -> changes seen that were not our own writes
+        self._generations: Dict[Tuple[str, str], int] = {}  # (kind, user_id) -> own writes this epoch
+        self._lock = threading.Lock()
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_users > 0
+
+    def _check_version(self, kind: str, token: Hashable):
+        """Drop every view of a kind whose data changed underneath us"""
+        if self._versions.get(kind) != token:
+            stale = [key for key in self._views if key[0] == kind]
+            for key in stale:
+                del self._views[key]
+            if stale:
+                self.invalidations += 1
+            self._versions[kind] = token
+            # Any user's data may have changed: start a new epoch with fresh write counts
+            self._epochs[kind] = self._epochs.get(kind, 0) + 1
+            for key in [key for key in self._generations if key[0] == kind]:
+                del self._generations[key]
+
+    def get(self, kind: str, user_id: str, token: Hashable) -> Optional[Any]:
+        """Return the cached view for a user, or None if missing or stale"""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            self._check_version(kind, token)
+            view = self._views.get((kind, user_id))
+            if view is None:
+                self.misses += 1
+                return None
+
+            self._views.move_to_end((kind, user_id))
+            self.hits += 1
+            return view
+
+    def put(self, kind: str, user_id: str, token: Hashable, view: Any):
+        """Store a freshly loaded view, unless the data has moved on since the token was taken"""
+        if not self.enabled:
+            return
+
+        with self._lock:
+            if self._versions.get(kind) != token:
+                return
+
+            self._views[(kind, user_id)] = view
+            self._views.move_to_end((kind, user_id))
+            while len(self._views) > self.max_users:
+                self._views.popitem(last=False)
+                self.evictions += 1
+
+    def write_through(self, kind: str, user_id: str, before: Optional[Hashable], after: Hashable,
+                      update: Callable[[Any], None]):
+        """Apply a write that moved the data from version `before` to `after` (None: unknown, others wrote too)"""
+        with self._lock:
+            self._generations[(kind, user_id)] = self._generations.get((kind, user_id), 0) + 1
+            if before is None or self._versions.get(kind) != before:
+                # Someone else changed the data too; start over from disk
+                self._check_version(kind, after)
+                return
+
+            self._versions[kind] = after
+            view = self._views.get((kind, user_id))
+            if view is not None:
+                update(view)
+
+    def generation(self, kind: str, user_id: str, token: Hashable) -> Tuple[int, int]:
+        """(epoch, writes) pair that moves whenever a user's data of a kind may have changed
+
+        Own writes bump the user's count; a change made elsewhere (another
+        process) starts a new epoch for every user. Tracked even when the
+        cache holds no views.
+        """
+        with self._lock:
+            self._check_version(kind, token)
+            return self._epochs[kind], self._generations.get((kind, user_id), 0)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'users': len(self._views),
+                'max_users': self.max_users,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,39 @@
+import os
+import sys
+import unittest
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from circuit_breaker import CLOSED, HALF_OPEN, CircuitBreakers  # noqa: E402
+from routing import AttemptCancelled  # noqa: E402
+
+
+def fail():
+    raise requests.ConnectionError('refused')
+
+
+def cancelled():
+    raise AttemptCancelled()
+
+
+class HalfOpenTest(unittest.TestCase):
+    def setUp(self):
+        self.breakers = CircuitBreakers(min_calls=1, error_rate=0.5, open_seconds=0, half_open_probes=1)
+        with self.assertRaises(requests.ConnectionError):
+            self.breakers.call('Provider', 'model', fail)
+        self.breaker = self.breakers.get('Provider', 'model')
+
+    def test_cancelled_probe_frees_its_slot_without_closing(self):
+        with self.assertRaises(AttemptCancelled):
+            self.breakers.call('Provider', 'model', cancelled)
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+
+        # The freed slot lets another call probe, and its success closes the breaker
+        self.assertEqual(self.breakers.call('Provider', 'model', lambda: 'ok'), 'ok')
+        self.assertEqual(self.breaker.state, CLOSED)
+
+
+if __name__ == '__main__':
+    unittest.main()
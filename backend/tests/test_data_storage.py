@@ -0,0 +1,85 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation_view import InvalidCursor  # noqa: E402
+from data_storage import DataStorage  # noqa: E402
+from history_archive import RetentionPolicy  # noqa: E402
+
+
+class CompactionTest(unittest.TestCase):
+    def setUp(self):
+        self.storage = DataStorage(tempfile.mkdtemp(prefix='storage-test-'), backend='json',
+                                   retention=RetentionPolicy(max_age_days=0, max_conversations=1, max_bytes=0))
+        for i in range(3):
+            self.storage.save_exchanges('user', [(f'c{i}', {'user': 'question', 'bot': 'answer'})],
+                                        {f'c{i}': {'messages': [], 'timestamp': f'2024-01-0{i + 1}'}})
+
+    def test_turn_saved_during_compaction_stays_hot(self):
+        archive_append = self.storage.archive.append
+
+        def append(user_id, records):
+            archive_append(user_id, records)
+            self.storage.append_conversation_turn('user', 'c0', {'user': 'late', 'bot': 'answer'})
+
+        self.storage.archive.append = append
+        self.assertEqual(self.storage.compact(['user']), 1)
+        self.assertEqual(len(self.storage.get_conversation_turns('user', 'c0')), 2)
+        self.assertEqual(self.storage.archive.conversation_ids('user'), ['c1'])
+
+    def test_restore_moves_conversation_back_to_hot_store(self):
+        self.storage.compact(['user'])
+        self.assertTrue(self.storage.restore_archived('user', 'c0'))
+        self.assertNotIn('c0', self.storage.archive.conversation_ids('user'))
+        self.assertEqual(len(self.storage.get_conversation_turns('user', 'c0')), 1)
+        self.assertNotIn('archived', self.storage.get_chat_history('user', 'c0'))
+        self.assertFalse(self.storage.restore_archived('user', 'c0'))
+
+
+class ListingTest(unittest.TestCase):
+    def test_invalid_cursor_is_reported_not_an_empty_page(self):
+        storage = DataStorage(tempfile.mkdtemp(prefix='storage-test-'), backend='json')
+        storage.save_chat_history('user', 'c1', {'messages': [], 'timestamp': '2024-01-01'})
+        for cursor in ('not a cursor', 'bm90IGpzb24', 'WzFd'):
+            with self.assertRaises(InvalidCursor):
+                storage.list_conversation_summaries('user', cursor=cursor)
+
+
+def conversation_ids(storage):
+    return [conversation['conversation_id'] for conversation in storage.get_chat_history('user')['conversations']]
+
+
+class CrossProcessWriteTest(unittest.TestCase):
+    """Two instances on one directory stand in for two worker processes"""
+
+    def check_write_landing_just_before_ours(self, engine):
+        directory = tempfile.mkdtemp(prefix='storage-test-')
+        ours, theirs = DataStorage(directory, backend=engine), DataStorage(directory, backend=engine)
+        ours.save_chat_history('user', 'c1', {'messages': [], 'timestamp': '2024-01-01'})
+        self.assertEqual(conversation_ids(ours), ['c1'])
+        generation = ours.history_generation('user')
+
+        put_conversations_batch = ours.backend.put_conversations_batch
+
+        def put_after_theirs(*args, **kwargs):
+            # The other process commits after we decided to write, but before we take the lock
+            theirs.save_chat_history('user', 'c2', {'messages': [], 'timestamp': '2024-01-02'})
+            return put_conversations_batch(*args, **kwargs)
+
+        ours.backend.put_conversations_batch = put_after_theirs
+        ours.save_chat_history('user', 'c3', {'messages': [], 'timestamp': '2024-01-03'})
+        self.assertEqual(sorted(conversation_ids(ours)), ['c1', 'c2', 'c3'])
+        self.assertNotEqual(ours.history_generation('user'), generation)
+
+    def test_json(self):
+        self.check_write_landing_just_before_ours('json')
+
+    def test_sqlite(self):
+        self.check_write_landing_just_before_ours('sqlite')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history_archive import RetentionPolicy, _parse_timestamp  # noqa: E402
+
+NOW = 1_700_000_000.0
+DAY = 86400
+
+
+class ParseTimestampTest(unittest.TestCase):
+    def test_epoch_milliseconds_and_seconds(self):
+        self.assertEqual(_parse_timestamp(str(int(NOW * 1000))), NOW)
+        self.assertEqual(_parse_timestamp(int(NOW * 1000)), NOW)
+        self.assertEqual(_parse_timestamp(str(int(NOW))), NOW)
+        self.assertEqual(_parse_timestamp(NOW), NOW)
+
+    def test_iso(self):
+        self.assertEqual(_parse_timestamp('2023-11-14T22:13:20Z'), NOW)
+
+    def test_unparseable(self):
+        self.assertIsNone(_parse_timestamp('yesterday'))
+        self.assertIsNone(_parse_timestamp(None))
+
+
+class SelectColdTest(unittest.TestCase):
+    def test_max_age_matches_ms_epoch_records(self):
+        # Records saved by the chat route carry the app's millisecond timestamp
+        fresh = {'conversation_id': 'fresh', 'timestamp': str(int((NOW - DAY) * 1000))}
+        old = {'conversation_id': 'old', 'timestamp': str(int((NOW - 40 * DAY) * 1000))}
+        policy = RetentionPolicy(max_age_days=30, max_conversations=0, max_bytes=0)
+        cold = policy.select_cold([fresh, old], now=NOW)
+        self.assertEqual([conversation['conversation_id'] for conversation in cold], ['old'])
+
+
+if __name__ == '__main__':
+    unittest.main()
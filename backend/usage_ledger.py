@@ -0,0 +1,158 @@
+"""
+Usage ledger with hourly and daily counters.
+
+Each completed upstream call adds its tokens and cost to one hourly and one
+daily counter keyed by (user, provider, model, key, subject). Updates only
+touch an in-memory dict. A background thread flushes the changed counters to
+a small SQLite file in one batched upsert. Queries aggregate those counters
+with SQL, so usage reports never re-read chat history. Hourly rows are kept
+for a limited time and daily rows much longer, so the ledger stays a fixed
+size however much traffic it has seen.
+"""
+
+import atexit
+import os
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+GRANULARITIES = {'hour': 3600, 'day': 86400}
+GROUP_BY_COLUMNS = {
+    'period': 'bucket',
+    'provider': 'provider',
+    'model': 'model',
+    'key': 'key_id',
+    'subject': 'subject',
+}
+COUNTERS = ('requests', 'input_tokens', 'output_tokens', 'total_tokens', 'cost')
+
+
+def parse_time(value: str) -> float:
+    """Epoch seconds from an epoch number or an ISO 8601 date/time (UTC unless it has an offset)"""
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+
+class UsageLedger:
+    def __init__(self, path: str, flush_interval: Optional[float] = None,
+                 hourly_retention: Optional[float] = None, daily_retention: Optional[float] = None):
+        env = os.environ.get
+        self.flush_interval = flush_interval if flush_interval is not None else float(env('LEDGER_FLUSH_INTERVAL', 10))
+        # Retention in days
+        self.hourly_retention = hourly_retention if hourly_retention is not None else float(env('LEDGER_HOURLY_RETENTION', 14))
+        self.daily_retention = daily_retention if daily_retention is not None else float(env('LEDGER_DAILY_RETENTION', 400))
+
+        self._pending: Dict[tuple, List[float]] = {}  # (granularity, bucket, user, provider, model, key, subject) -> counters
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS usage ('
+                'granularity TEXT NOT NULL, bucket INTEGER NOT NULL, user_id TEXT NOT NULL, '
+                'provider TEXT NOT NULL, model TEXT NOT NULL, key_id TEXT NOT NULL, subject TEXT NOT NULL, '
+                'requests INTEGER NOT NULL, input_tokens INTEGER NOT NULL, output_tokens INTEGER NOT NULL, '
+                'total_tokens INTEGER NOT NULL, cost REAL NOT NULL, '
+                'PRIMARY KEY (granularity, user_id, bucket, provider, model, key_id, subject))'
+            )
+
+        self._stop = threading.Event()
+        threading.Thread(target=self._flush_loop, name='usage-ledger-flush', daemon=True).start()
+        atexit.register(self.flush)
+
+    def record(self, user_id: str, provider: str, model: str, key_id: str, subject: str,
+               usage_info: Optional[Dict[str, Any]], cost: float = 0.0, now: Optional[float] = None):
+        """Add one upstream call to its hourly and daily counters"""
+        usage_info = usage_info or {}
+        increments = (1, usage_info.get('input_tokens', 0), usage_info.get('output_tokens', 0),
+                      usage_info.get('total_tokens', 0), cost)
+        now = now if now is not None else datetime.now(timezone.utc).timestamp()
+        with self._lock:
+            for granularity, seconds in GRANULARITIES.items():
+                key = (granularity, int(now - now % seconds), user_id, provider, model, key_id, subject or '')
+                counters = self._pending.get(key)
+                if counters is None:
+                    counters = self._pending[key] = [0, 0, 0, 0, 0.0]
+                for index, value in enumerate(increments):
+                    counters[index] += value
+
+    def flush(self):
+        """Write the pending counters in one transaction and prune expired buckets"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+
+        now = datetime.now(timezone.utc).timestamp()
+        try:
+            with self._db_lock, self._db:
+                self._db.executemany(
+                    'INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (granularity, user_id, bucket, provider, model, key_id, subject) DO UPDATE SET '
+                    'requests = requests + excluded.requests, input_tokens = input_tokens + excluded.input_tokens, '
+                    'output_tokens = output_tokens + excluded.output_tokens, '
+                    'total_tokens = total_tokens + excluded.total_tokens, cost = cost + excluded.cost',
+                    [key + tuple(counters) for key, counters in pending.items()],
+                )
+                self._db.execute('DELETE FROM usage WHERE granularity = ? AND bucket < ?',
+                                 ('hour', now - self.hourly_retention * 86400))
+                self._db.execute('DELETE FROM usage WHERE granularity = ? AND bucket < ?',
+                                 ('day', now - self.daily_retention * 86400))
+        except sqlite3.Error as e:
+            print(f"Warning: Usage ledger flush failed: {e}")
+            # Put the counters back so the next flush retries them
+            with self._lock:
+                for key, counters in pending.items():
+                    current = self._pending.setdefault(key, [0, 0, 0, 0, 0.0])
+                    for index, value in enumerate(counters):
+                        current[index] += value
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def query(self, user_id: str, granularity: str = 'day', start: Optional[float] = None,
+              end: Optional[float] = None, group_by: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Usage totals for a user between start and end (epoch seconds), grouped by the given dimensions"""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f'granularity must be one of {", ".join(GRANULARITIES)}')
+        group_by = group_by or []
+        unknown = [dimension for dimension in group_by if dimension not in GROUP_BY_COLUMNS]
+        if unknown:
+            raise ValueError(f'Cannot group by {", ".join(unknown)}; use {", ".join(GROUP_BY_COLUMNS)}')
+
+        self.flush()
+        where = ['granularity = ?', 'user_id = ?']
+        params: List[Any] = [granularity, user_id]
+        if start is not None:
+            # Include the bucket that contains `start`
+            where.append('bucket >= ?')
+            params.append(int(start - start % GRANULARITIES[granularity]))
+        if end is not None:
+            where.append('bucket < ?')
+            params.append(end)
+
+        columns = [GROUP_BY_COLUMNS[dimension] for dimension in group_by]
+        select = columns + [f'SUM({counter})' for counter in COUNTERS]
+        sql = f'SELECT {", ".join(select)} FROM usage WHERE {" AND ".join(where)}'
+        if columns:
+            sql += f' GROUP BY {", ".join(columns)} ORDER BY {", ".join(columns)}'
+
+        with self._db_lock:
+            rows = self._db.execute(sql, params).fetchall()
+
+        results = []
+        for row in rows:
+            if row[len(columns)] is None:  # SUM over no rows
+                continue
+            result = dict(zip(group_by, row[:len(columns)]))
+            result.update(zip(COUNTERS, row[len(columns):]))
+            result['cost'] = round(result['cost'], 6)
+            results.append(result)
+        return {'granularity': granularity, 'group_by': group_by, 'usage': results}
@@ -0,0 +1,194 @@
+"""
+In-process rate limits and spend budgets for chat requests.
+
+Each user and each API key gets a token bucket for request rate. On top of
+that, users have a running token budget per period and keys a running credit
+spend that is held against their credit_limit. Both are fed from the usage
+block of completed answers and checked before any upstream call is made.
+Budgets are checkpointed to a small JSON file in the background, so a restart
+does not hand out a fresh budget.
+"""
+
+import atexit
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from safe_files import atomic_write
+
+
+class RateLimited(Exception):
+    """Too many requests for this user or key right now"""
+
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f'Too many chat requests for this {scope}, please slow down')
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class BudgetExceeded(Exception):
+    """The user's token budget for the current period is used up"""
+
+    def __init__(self, retry_after: float):
+        super().__init__('Token budget for this period is used up')
+        self.retry_after = retry_after
+
+
+def key_id(api_key: str) -> str:
+    """Stable, non-secret identifier for an API key"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:16]
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate  # tokens added per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, count: float = 1) -> float:
+        """Take tokens if available; returns 0, or the seconds until they would be"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= count:
+            self.tokens -= count
+            return 0.0
+        return (count - self.tokens) / self.rate
+
+
+class UsageLimiter:
+    def __init__(self, checkpoint_path: Optional[str] = None, user_rate: Optional[float] = None,
+                 user_burst: Optional[float] = None, key_rate: Optional[float] = None,
+                 key_burst: Optional[float] = None, user_token_budget: Optional[int] = None,
+                 budget_period: Optional[float] = None, checkpoint_interval: Optional[float] = None):
+        env = os.environ.get
+        # Rates are per minute; 0 turns a limit off
+        self.user_rate = user_rate if user_rate is not None else float(env('USER_RATE_LIMIT', 60))
+        self.user_burst = user_burst if user_burst is not None else float(env('USER_RATE_BURST', 20))
+        self.key_rate = key_rate if key_rate is not None else float(env('KEY_RATE_LIMIT', 0))
+        self.key_burst = key_burst if key_burst is not None else float(env('KEY_RATE_BURST', 30))
+        self.user_token_budget = user_token_budget if user_token_budget is not None else int(env('USER_TOKEN_BUDGET', 0))
+        self.budget_period = budget_period if budget_period is not None else float(env('USER_BUDGET_PERIOD', 86400))
+        self.checkpoint_interval = checkpoint_interval if checkpoint_interval is not None else float(
+            env('LIMITS_CHECKPOINT_INTERVAL', 30))
+
+        self._user_buckets: Dict[str, TokenBucket] = {}
+        self._key_buckets: Dict[str, TokenBucket] = {}
+        self._user_budgets: Dict[str, Dict[str, float]] = {}  # user_id -> {period_start, tokens}
+        self._key_spend: Dict[str, float] = {}  # key_id -> credit spent
+        self._lock = threading.Lock()
+        self._dirty = False
+
+        self.checkpoint_path = checkpoint_path
+        if checkpoint_path:
+            self._load()
+            self._stop = threading.Event()
+            threading.Thread(target=self._checkpoint_loop, name='usage-limits-checkpoint', daemon=True).start()
+            atexit.register(self.checkpoint)
+
+    def _period_start(self, now: float) -> float:
+        return now - now % self.budget_period
+
+    def _take(self, buckets: Dict[str, TokenBucket], name: str, rate: float, burst: float, scope: str):
+        if rate <= 0:
+            return
+        bucket = buckets.get(name)
+        if bucket is None:
+            bucket = buckets[name] = TokenBucket(rate / 60, burst)
+        wait = bucket.take()
+        if wait:
+            raise RateLimited(scope, wait)
+
+    def admit_user(self, user_id: str):
+        """Admit one request for the user, or raise RateLimited / BudgetExceeded"""
+        now = time.time()
+        with self._lock:
+            if self.user_token_budget > 0:
+                budget = self._user_budgets.get(user_id)
+                period_start = self._period_start(now)
+                if budget and budget['period_start'] == period_start and budget['tokens'] >= self.user_token_budget:
+                    raise BudgetExceeded(period_start + self.budget_period - now)
+            self._take(self._user_buckets, user_id, self.user_rate, self.user_burst, 'user')
+
+    def admit_key(self, api_key: str):
+        """Admit one upstream call with this key, or raise RateLimited"""
+        with self._lock:
+            self._take(self._key_buckets, key_id(api_key), self.key_rate, self.key_burst, 'API key')
+
+    def key_over_credit(self, api_key: str, credit_limit: Optional[float]) -> bool:
+        if not credit_limit:
+            return False
+        with self._lock:
+            return self._key_spend.get(key_id(api_key), 0.0) >= credit_limit
+
+    def key_spent(self, api_key: str) -> float:
+        with self._lock:
+            return self._key_spend.get(key_id(api_key), 0.0)
+
+    def charge_user(self, user_id: str, tokens: int):
+        """Count the tokens of a completed answer against the user's budget"""
+        if not tokens:
+            return
+        now = time.time()
+        with self._lock:
+            period_start = self._period_start(now)
+            budget = self._user_budgets.get(user_id)
+            if budget is None or budget['period_start'] != period_start:
+                budget = self._user_budgets[user_id] = {'period_start': period_start, 'tokens': 0}
+            budget['tokens'] += tokens
+            self._dirty = True
+
+    def charge_key(self, api_key: str, cost: float):
+        """Add a completed answer's cost to the key's spend"""
+        if not cost:
+            return
+        with self._lock:
+            identifier = key_id(api_key)
+            self._key_spend[identifier] = self._key_spend.get(identifier, 0.0) + cost
+            self._dirty = True
+
+    def user_usage(self, user_id: str) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            period_start = self._period_start(now)
+            budget = self._user_budgets.get(user_id)
+            tokens = budget['tokens'] if budget and budget['period_start'] == period_start else 0
+            bucket = self._user_buckets.get(user_id)
+            return {
+                'tokens_used': tokens,
+                'token_budget': self.user_token_budget or None,
+                'period_resets_in': round(period_start + self.budget_period - now),
+                'requests_available': int(bucket.tokens) if bucket else int(self.user_burst),
+            }
+
+    def _load(self):
+        try:
+            with open(self.checkpoint_path, 'r') as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return
+        self._user_budgets = state.get('user_budgets', {})
+        self._key_spend = state.get('key_spend', {})
+
+    def checkpoint(self):
+        """Write budgets to the checkpoint file if they changed since the last one"""
+        with self._lock:
+            if not self._dirty:
+                return
+            state = json.dumps({'user_budgets': self._user_budgets, 'key_spend': self._key_spend})
+            self._dirty = False
+
+        try:
+            atomic_write(self.checkpoint_path, state)
+        except OSError as e:
+            print(f"Warning: Usage limit checkpoint failed: {e}")
+            with self._lock:
+                self._dirty = True
+
+    def _checkpoint_loop(self):
+        while not self._stop.wait(self.checkpoint_interval):
+            self.checkpoint()
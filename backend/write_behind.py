@@ -0,0 +1,148 @@
+"""
+Write-behind queue with group commit for chat history writes.
+
+Writes are collected per user in the current batch: later saves of the same
+conversation replace earlier ones, and transcript turns are appended in
+order. A background flusher commits the whole batch with one storage call
+once it holds enough writes or the flush interval has passed. Callers either
+wait for their batch to commit ("batched") or return at once ("async").
+"""
+
+import atexit
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class PendingWrites:
+    """Writes of one user waiting in a batch"""
+
+    def __init__(self):
+        self.conversations: Dict[str, Dict[str, Any]] = {}
+        self.turns: List[Tuple[str, Dict[str, Any]]] = []
+
+
+class _Batch:
+    def __init__(self):
+        self.users: Dict[str, PendingWrites] = {}
+        self.writes = 0
+        self.done = threading.Event()
+        self.error: Optional[Exception] = None
+
+
+class WriteBehindQueue:
+    def __init__(self, commit: Callable[[Dict[str, PendingWrites]], None],
+                 flush_interval: float = 0.05, max_batch: int = 256):
+        self.commit = commit
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        self._batch = _Batch()
+        self._committing: Optional[_Batch] = None
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._closed = False
+
+        # Counters
+        self.batches = 0
+        self.writes = 0
+        self.coalesced = 0
+        self.failures = 0
+
+        self._thread = threading.Thread(target=self._run, name='history-write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def put(self, user_id: str, conversations: Optional[Dict[str, Dict[str, Any]]] = None,
+            turns: Optional[List[Tuple[str, Dict[str, Any]]]] = None) -> _Batch:
+        """Queue writes for a user; returns the batch they will be committed with"""
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('History write queue is closed')
+            batch = self._batch
+            pending = batch.users.setdefault(user_id, PendingWrites())
+            for conversation_id, conversation_data in (conversations or {}).items():
+                if conversation_id in pending.conversations:
+                    self.coalesced += 1
+                else:
+                    batch.writes += 1
+                pending.conversations[conversation_id] = conversation_data
+            pending.turns.extend(turns or [])
+            batch.writes += len(turns or [])
+            self.writes += len(conversations or {}) + len(turns or [])
+            self._wakeup.notify()
+            return batch
+
+    def wait(self, batch: _Batch) -> bool:
+        """Block until a batch is committed; returns False if the commit failed"""
+        batch.done.wait()
+        return batch.error is None
+
+    def has_pending(self, user_id: str) -> bool:
+        with self._lock:
+            committing = self._committing
+            return user_id in self._batch.users or (committing is not None and user_id in committing.users)
+
+    def _commit_batch(self):
+        """Commit the current batch now (the caller holds the commit lock)"""
+        with self._lock:
+            batch = self._batch
+            if not batch.users:
+                return
+            self._batch = _Batch()
+            self._committing = batch
+
+        try:
+            self.commit(batch.users)
+        except Exception as e:
+            print(f"Warning: Chat history batch commit failed: {e}")
+            batch.error = e
+            self.failures += 1
+        finally:
+            with self._lock:
+                self._committing = None
+                self.batches += 1
+            batch.done.set()
+
+    def flush(self):
+        """Commit everything queued so far before returning"""
+        with self._commit_lock:
+            self._commit_batch()
+
+    def flush_user(self, user_id: str):
+        """Make a user's queued writes visible to reads (read-your-writes)"""
+        if self.has_pending(user_id):
+            self.flush()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._batch.users and not self._closed:
+                    self._wakeup.wait()
+                if self._closed and not self._batch.users:
+                    return
+                # Give concurrent writers a moment to join this batch
+                if not self._closed and self._batch.writes < self.max_batch:
+                    self._wakeup.wait_for(lambda: self._closed or self._batch.writes >= self.max_batch,
+                                          timeout=self.flush_interval)
+            self.flush()
+
+    def close(self):
+        """Flush what is left and stop the flusher"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._wakeup.notify_all()
+        self._thread.join()
+        self.flush()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'pending_writes': self._batch.writes,
+                'batches': self.batches,
+                'writes': self.writes,
+                'coalesced': self.coalesced,
+                'failures': self.failures,
+            }